@@ -3,6 +3,11 @@ import pydantic
 from typing import List, Dict, Optional, Union
 import loguru
 from requests.adapters import HTTPAdapter, Retry
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+import math
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
 from datetime import datetime
 
@@ -93,12 +98,225 @@ class AutodlDdpOverview(pydantic.BaseModel):
     pass
 
 class AutodlNetworkError(Exception):
-    def __init__(self, message):
+    def __init__(self, message, status_code: Optional[int] = None, code: Optional[str] = None):
         super().__init__(message)
         self.message = message
+        self.status_code = status_code  # http status code, if the server answered
+        self.code = code  # AutoDL business code, if the server answered with one
         pass
 
 
+def is_retryable_error(e: Exception) -> bool:
+    """
+    Whether a failed AutoDL request may succeed if sent again.
+    Timeouts, connection resets and 5xx/429 answers are transient, business
+    errors and other 4xx answers will fail the same way every time.
+    """
+    if isinstance(e, AutodlNetworkError):
+        if e.code is not None:
+            return False
+        if e.status_code is not None:
+            return e.status_code >= 500 or e.status_code == 429
+        return False
+    if isinstance(e, (requests.exceptions.Timeout,
+                      requests.exceptions.ConnectionError,
+                      requests.exceptions.ChunkedEncodingError,
+                      requests.exceptions.JSONDecodeError)):
+        return True
+    return False
+
+
+class AutodlRetryBudget(object):
+    """
+    Per-client retry throttle (token bucket).
+    Every failed attempt costs one token and every success refunds token_ratio,
+    retries are only allowed while more than half of max_tokens is left. A
+    burst of failures therefore quickly turns retries off instead of piling
+    up sleeping threads, and successes turn them back on.
+    """
+
+    def __init__(self, max_tokens: float = 10, token_ratio: float = 0.1):
+        self._lock = threading.Lock()
+        self.max_tokens = max_tokens
+        self.token_ratio = token_ratio
+        self.tokens = max_tokens
+        pass
+
+    def record_success(self):
+        with self._lock:
+            self.tokens = min(self.tokens + self.token_ratio, self.max_tokens)
+            pass
+        pass
+
+    def record_failure(self):
+        with self._lock:
+            self.tokens = max(self.tokens - 1, 0)
+            pass
+        pass
+
+    def can_retry(self) -> bool:
+        with self._lock:
+            return self.tokens > self.max_tokens / 2
+    pass
+
+
+class AutodlConnectionStats(object):
+    """Thread-safe counters of pooled connection usage"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        pass
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+            pass
+        pass
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+            pass
+        pass
+
+    @property
+    def reused_connections(self) -> int:
+        return max(self.requests - self.new_connections, 0)
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": max(self.requests - self.new_connections, 0),
+            }
+    pass
+
+
+def _counting_pool_class(pool_cls, stats: AutodlConnectionStats):
+    class CountingConnection(pool_cls.ConnectionCls):
+        def connect(self):
+            # counts every socket opened, including reconnects of a dropped pooled connection
+            stats.record_new_connection()
+            return super().connect()
+        pass
+
+    class CountingConnectionPool(pool_cls):
+        ConnectionCls = CountingConnection
+        pass
+    return CountingConnectionPool
+
+
+class AutodlHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report new connections to stats"""
+
+    def __init__(self, stats: AutodlConnectionStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+        pass
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool_class(HTTPConnectionPool, self.stats),
+            "https": _counting_pool_class(HTTPSConnectionPool, self.stats),
+        }
+        pass
+    pass
+
+
+def _parse_image_version(version: str):
+    try:
+        return tuple(int(vv) for vv in version.split("."))
+    except ValueError:
+        return None
+
+
+class AutodlImageCatalog(object):
+    """
+    Cached private image list with a name -> uuid and a prefix -> latest version index.
+    Entries are fresh for ttl seconds, then served stale for stale_ttl more seconds
+    while being revalidated, and expired afterwards.
+    """
+
+    def __init__(self, ttl: float = 300.0, stale_ttl: float = 600.0):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.images = None
+        self.loaded_at = 0.0
+        self._by_name = dict()
+        self._latest = dict()
+        pass
+
+    def update(self, images: List[AutodlImage]):
+        by_name = dict()
+        latest = dict()
+        for image in images:
+            by_name[image.image_name] = image
+            repo, sep, version = image.image_name.rpartition(":")
+            if not sep:
+                continue
+            version = _parse_image_version(version)
+            if version is None:
+                continue
+            prefix = repo + ":"
+            if prefix not in latest or version > latest[prefix][0]:
+                latest[prefix] = (version, image)
+                pass
+            pass
+        self._by_name = by_name
+        self._latest = latest
+        self.images = list(images)
+        self.loaded_at = time.time()
+        pass
+
+    def invalidate(self):
+        # entries are kept for readers already holding them, but never served again
+        self.loaded_at = 0.0
+        pass
+
+    def state(self) -> str:
+        """one of empty, fresh, stale, expired"""
+        if self.images is None:
+            return "empty"
+        age = time.time() - self.loaded_at
+        if age < self.ttl:
+            return "fresh"
+        elif age < self.ttl + self.stale_ttl:
+            return "stale"
+        return "expired"
+
+    def name2uuid(self, image_name: str) -> Optional[str]:
+        image = self._by_name.get(image_name)
+        if image is None:
+            return None
+        return image.image_uuid
+
+    def latest(self, prefix: str) -> Optional[AutodlImage]:
+        if not prefix.endswith(":"):
+            prefix += ":"
+            pass
+        entry = self._latest.get(prefix)
+        if entry is not None:
+            return entry[1]
+        # prefixes containing ':' themselves are not indexed, scan for them
+        candidates = []
+        for image in self.images or []:
+            if image.image_name.startswith(prefix):
+                version = _parse_image_version(image.image_name[len(prefix):])
+                if version is not None:
+                    candidates.append((version, image))
+                    pass
+                pass
+            pass
+        if not candidates:
+            return None
+        return max(candidates, key=lambda x: x[0])[1]
+    pass
+
+
 class AutoDLConstants:
     """AutoDL constants"""
     
@@ -149,39 +367,44 @@ class AutoDLConstants:
     ]
 
 
-class AutodlClient(object):
-    def __init__(self, token):
+class AutodlClientBase(object):
+    """Configuration, request building and response parsing shared by the sync and async clients"""
+
+    def __init__(self, token, host: str = "https://api.autodl.com",
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 retry_budget: Optional[AutodlRetryBudget] = None,
+                 image_cache_ttl: float = 300.0, image_cache_stale_ttl: float = 600.0,
+                 page_concurrency: int = 1):
         self.token = token
-        self.host = "https://api.autodl.com"
+        self.host = host
         self.default_region = "chongqingDC1"
         self.default_gpu_set = ["RTX 4090D"]
         self.retray = 5
         self.timeout = 60
-        pass
 
-    def _request_retry(self, url, req="", method=None):
-        for i in range(self.retray):
-            try:
-                # logger.info(f"Requesting {url}... req {req}, method {method}")
-                data = self._request(url, req, method)
-                break
-            except Exception as e:
-                logger.warning(f"Request timeout, retrying {i+1}/{self.retray}...")
-                if i == self.retray - 1:
-                    raise e
-                time.sleep(120)
-                continue
-            pass
+        # exponential backoff with full jitter between retries of transient errors
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget if retry_budget is not None else AutodlRetryBudget()
 
-        return data
+        # private image list cache, image_cache_ttl <= 0 disables it
+        self.image_catalog = AutodlImageCatalog(ttl=image_cache_ttl, stale_ttl=image_cache_stale_ttl)
+        self._image_refreshing = False
+
+        # default number of pages fetched in parallel by get_pages
+        self.page_concurrency = page_concurrency
         pass
 
-    def _request(self, url, req="", method=None):
-        headers = {
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": self.token,
             "Content-Type": "application/json"
         }
-        url = f"{self.host}{url}"
+
+    def _method(self, req, method=None) -> str:
         if method is None:
             if len(req) == 0:
                 method = "get"
@@ -189,24 +412,14 @@ class AutodlClient(object):
                 method = "post"
                 pass
             pass
+        return method.lower()
 
-        session = requests.Session()
-        retries = Retry(total=self.retray, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-        adapter = HTTPAdapter(max_retries=retries)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        if method.lower() == "get":
-            response = session.get(url, headers=headers, timeout=self.timeout)
-        elif method.lower() == "delete":
-            response = session.delete(url, headers=headers, json=req, timeout=self.timeout)
-        elif method.lower() == "put":
-            response = session.put(url, json=req, headers=headers, timeout=self.timeout)
-        else:
-            response = session.post(url, json=req, headers=headers, timeout=self.timeout)
-
+    def _parse_response(self, response):
+        """check a requests/httpx response and return its data field"""
         if response.status_code != 200:
             raise AutodlNetworkError(
-                message=f"http code not 200: {response.status_code} - {response.text}"
+                message=f"http code not 200: {response.status_code} - {response.text}",
+                status_code=response.status_code,
             )
         
         data = response.json()
@@ -214,51 +427,411 @@ class AutodlClient(object):
         code = data.get("code")
         if code != "Success":
             raise AutodlNetworkError(
-                message=f"return code not Success: {code} - {data.get('message')}"
+                message=f"return code not Success: {code} - {data.get('message')}",
+                status_code=response.status_code,
+                code=code,
             )
         
         return data.get("data")
-    
-    def get_pages(self, url, req, parser, page_size=10, limit=None):
-        page_index = 1
-        items = []
-        while True:
+
+    def _page_request(self, req, page_index, page_size):
+        page_req = dict(req)
+        page_req.update({
+            "page_index": page_index,
+            "page_size": page_size
+        })
+        return page_req
+
+    def _deployment_request(self, name: str, image_uuid: str, deployment_type: str = "ReplicaSet",
+                            replica_num: int = 1, parallelism_num: Optional[int] = None,
+                            gpu_name_set: Optional[List[str]] = None, gpu_num: int = 1,
+                            cuda_v_from: int = 113, cuda_v_to: int = 128,
+                            cpu_num_from: int = 1, cpu_num_to: int = 100,
+                            memory_size_from: int = 1, memory_size_to: int = 256,
+                            dc_list: Optional[List[str]] = None, cmd: str = "sleep 100",
+                            price_from: int = 10, price_to: int = 9000,
+                            reuse_container: bool = False, env_vars: Optional[Dict[str, str]] = None) -> dict:
+        if dc_list is None:
+            dc_list = [self.default_region]
+        
+        if gpu_name_set is None or len(gpu_name_set) == 0:
+            gpu_name_set = self.default_gpu_set
+        
+        data = {
+            "name": name,
+            "deployment_type": deployment_type,
+            "replica_num": replica_num,
+            "reuse_container": reuse_container,
+            "container_template": {
+                "dc_list": dc_list,
+                "gpu_name_set": gpu_name_set,
+                "gpu_num": gpu_num,
+                "cuda_v_from": cuda_v_from,
+                "cuda_v_to": cuda_v_to,
+                "cpu_num_from": cpu_num_from,
+                "cpu_num_to": cpu_num_to,
+                "memory_size_from": memory_size_from,
+                "memory_size_to": memory_size_to,
+                "cmd": cmd,
+                "price_from": price_from,
+                "price_to": price_to,
+                "image_uuid": image_uuid,
+            }
+        }
+        
+        if deployment_type == "Job" and parallelism_num is not None:
+            data["parallelism_num"] = parallelism_num
+        elif deployment_type == "Container":
+            data["container_template"]["cuda_v"] = cuda_v_from
+            data["container_template"].pop("cuda_v_from", None)
+            data["container_template"].pop("cuda_v_to", None)
+        
+        if env_vars:
+            data["container_template"]["env_vars"] = env_vars
+        return data
+
+    def _parse_deployment_uuid(self, resp) -> str:
+        deployment_uuid = resp.get("deployment_uuid")
+
+        if not deployment_uuid:
+            raise AutodlNetworkError("Deployment created successfully but no UUID returned")
+        
+        return deployment_uuid
+
+    def _parse_gpu_stock(self, data) -> Dict[str, AutodlGpuStock]:
+        stocks = dict()
+
+        for gpu_stock in data:
+            gpu_type = list(gpu_stock.keys())[0]
+            idle_gpu_num = gpu_stock[gpu_type]["idle_gpu_num"]
+            total_gpu_num = gpu_stock[gpu_type]["total_gpu_num"]
+            stock = AutodlGpuStock(
+                idle_gpu_num=idle_gpu_num,
+                total_gpu_num=total_gpu_num
+            )
+            stocks[gpu_type] = stock
+            pass
+        
+        return stocks
+
+    def _parse_deployment(self, data) -> AutodlDeployment:
+        for key in ["region_sign", "dc_list", "gpu_name_set"]:
+            data[key] = data['template'][key]
+            pass
+        return AutodlDeployment(**data)
+
+    def _deployment_list_request(self, deployment_uuid=None, name=None, status=None) -> dict:
+        req = dict()
+        if deployment_uuid is not None:
             req.update({
-                "page_index": page_index,
-                "page_size": page_size
+                "deployment_uuid": deployment_uuid
             })
-            data = self._request_retry(url, req)
+            pass
+        if name is not None:
+            req.update({
+                "name": name
+            })
+            pass
+        if status is not None:
+            req.update({
+                "status": status
+            })
+            pass
+        return req
+
+    def _container_event_request(self, deployment_uuid: str, container_uuid: str = None) -> dict:
+        req = {
+            "deployment_uuid": deployment_uuid,
+        }
+        if container_uuid is not None:
+            req["deployment_container_uuid"] = container_uuid
+            pass
+        else:
+            req["deployment_container_uuid"] = ""
+            pass
+        return req
+
+    def _container_list_request(self, deployment_uuid: str,
+            deployment_container_uuid: str = "", 
+            date_from: str = "",
+            date_to: str = "",
+            gpu_name: str = "",
+            cpu_num_from: int = 0,
+            cpu_num_to: int = 0,
+            memory_size_from: int = 0,
+            memory_size_to: int = 0,
+            price_from: int = 0,
+            price_to: int = 0,
+            released: bool = False,
+            status: List[str] = ["running"]) -> dict:
+        return {
+            "deployment_uuid": deployment_uuid,
+            "container_uuid": deployment_container_uuid,
+            "date_from": date_from,
+            "date_to": date_to,
+            "gpu_name": gpu_name,
+            "cpu_num_from": cpu_num_from,
+            "cpu_num_to": cpu_num_to,
+            "memory_size_from": memory_size_from,
+            "memory_size_to": memory_size_to,
+            "price_from": price_from,
+            "price_to": price_to,
+            "released": released,
+            "status": status,
+        }
+    pass
+
+
+class AutodlClient(AutodlClientBase):
+    def __init__(self, token, host: str = "https://api.autodl.com",
+                 pool_connections: int = 4, pool_maxsize: int = 16, keep_alive: bool = True,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 retry_budget: Optional[AutodlRetryBudget] = None,
+                 image_cache_ttl: float = 300.0, image_cache_stale_ttl: float = 600.0,
+                 page_concurrency: int = 1):
+        super().__init__(
+            token, host=host, backoff_base=backoff_base, backoff_max=backoff_max,
+            retry_budget=retry_budget, image_cache_ttl=image_cache_ttl,
+            image_cache_stale_ttl=image_cache_stale_ttl, page_concurrency=page_concurrency)
+        self._image_lock = threading.Lock()
+
+        # one long-lived session per client, so calls reuse pooled keep-alive connections
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.connection_stats = AutodlConnectionStats()
+        self._session = None
+        self._session_lock = threading.Lock()
+        pass
+
+    def _get_session(self) -> requests.Session:
+        if self._session is not None:
+            return self._session
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                # only retry failed connects here, everything else is classified by _request_retry
+                retries = Retry(total=self.retray, connect=self.retray, read=0, status=0, other=0, backoff_factor=0.5)
+                adapter = AutodlHTTPAdapter(
+                    self.connection_stats,
+                    pool_connections=self.pool_connections,
+                    pool_maxsize=self.pool_maxsize,
+                    max_retries=retries)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+                pass
+            pass
+        return self._session
+
+    def close(self):
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                pass
+            pass
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        pass
+
+    def get_connection_stats(self) -> Dict[str, int]:
+        """Counters of requests sent, connections opened and connections reused"""
+        return self.connection_stats.to_dict()
+
+    # reads only: after a timeout a PUT/DELETE may already be applied, sending it again would
+    # repeat it behind the caller's back. Writes use _request, failed connects (the request never
+    # left) are still retried by the transport
+    def _request_retry(self, url, req="", method=None):
+        for i in range(self.retray):
+            try:
+                # logger.info(f"Requesting {url}... req {req}, method {method}")
+                data = self._request(url, req, method)
+                self.retry_budget.record_success()
+                break
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise e
+                self.retry_budget.record_failure()
+                if i == self.retray - 1:
+                    raise e
+                if not self.retry_budget.can_retry():
+                    logger.warning(f"Request {url} failed: {e}, retry budget exhausted, giving up")
+                    raise e
+                delay = self._backoff(i)
+                logger.warning(f"Request {url} failed: {e}, retrying {i+1}/{self.retray} in {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+            pass
+
+        return data
+        pass
+
+    def _request(self, url, req="", method=None):
+        headers = self._headers()
+        if not self.keep_alive:
+            headers["Connection"] = "close"
+            pass
+        url = f"{self.host}{url}"
+        method = self._method(req, method)
+
+        session = self._get_session()
+        self.connection_stats.record_request()
+        if method == "get":
+            response = session.get(url, headers=headers, timeout=self.timeout)
+        elif method == "delete":
+            response = session.delete(url, headers=headers, json=req, timeout=self.timeout)
+        elif method == "put":
+            response = session.put(url, json=req, headers=headers, timeout=self.timeout)
+        else:
+            response = session.post(url, json=req, headers=headers, timeout=self.timeout)
+
+        return self._parse_response(response)
+    
+    def _get_page(self, url, req, page_index, page_size):
+        return self._request_retry(url, self._page_request(req, page_index, page_size))
+
+    def get_pages(self, url, req, parser, page_size=10, limit=None, concurrency=None):
+        """
+        Fetch all pages of a list api and parse their items, in page order.
+        With concurrency > 1 the pages after the first one, which tells max_page,
+        are fetched by a bounded pool of threads. Pages beyond limit are never
+        requested, and pending pages are cancelled once limit items are collected.
+        """
+        if concurrency is None:
+            concurrency = self.page_concurrency
+            pass
+        items = []
+
+        def collect(data) -> bool:
             for item in data["list"]:
                 items.append(parser(item))
                 if limit is not None and len(items) >= limit:
+                    return True
+                pass
+            return False
+
+        data = self._get_page(url, req, 1, page_size)
+        if collect(data):
+            return items[:limit]
+        max_page = data["max_page"]
+        if limit is not None:
+            max_page = min(max_page, math.ceil(limit / page_size))
+            pass
+
+        if concurrency <= 1 or max_page <= 2:
+            page_index = 2
+            while page_index <= max_page:
+                data = self._get_page(url, req, page_index, page_size)
+                if collect(data):
                     return items[:limit]
+                page_index += 1
                 pass
-            max_page = data["max_page"]
-            if page_index >= max_page:
-                break
-            page_index += 1
+            return items
+
+        executor = ThreadPoolExecutor(max_workers=min(concurrency, max_page - 1))
+        futures = [
+            executor.submit(self._get_page, url, req, page_index, page_size)
+            for page_index in range(2, max_page + 1)
+        ]
+        try:
+            for future in futures:
+                if collect(future.result()):
+                    return items[:limit]
+                pass
+        finally:
+            # drop pages not started yet, and let in-flight ones finish before returning
+            for future in futures:
+                future.cancel()
+                pass
+            executor.shutdown(wait=True)
             pass
 
         return items
+
+    def iter_pages(self, url, req, parser, page_size=10):
+        """Lazily yield parsed items page by page, so callers can stop early"""
+        page_index = 1
+        while True:
+            data = self._get_page(url, req, page_index, page_size)
+            for item in data["list"]:
+                yield parser(item)
+                pass
+            if page_index >= data["max_page"]:
+                break
+            page_index += 1
+            pass
+        pass
         
-    def image_list(self, ) -> List[AutodlImage]:
+    def _fetch_image_list(self) -> List[AutodlImage]:
         url = "/api/v1/dev/image/private/list"
         return self.get_pages(url, {}, lambda x: AutodlImage(**x))
+
+    def _refresh_image_catalog(self):
+        images = self._fetch_image_list()
+        with self._image_lock:
+            self.image_catalog.update(images)
+            pass
+        pass
+
+    def _revalidate_image_catalog(self):
+        try:
+            self._refresh_image_catalog()
+        except Exception as e:
+            logger.warning(f"refresh image list in background failed: {e}")
+            pass
+        finally:
+            self._image_refreshing = False
+            pass
+        pass
+
+    def _image_catalog(self) -> AutodlImageCatalog:
+        """return the image catalog, refreshing it first when it is empty or expired"""
+        catalog = self.image_catalog
+        state = catalog.state()
+        if state == "fresh":
+            return catalog
+        if state == "stale":
+            # serve stale entries, only one background refresh at a time
+            with self._image_lock:
+                start = not self._image_refreshing
+                self._image_refreshing = True
+                pass
+            if start:
+                threading.Thread(target=self._revalidate_image_catalog, daemon=True).start()
+                pass
+            return catalog
+        # empty or expired, concurrent callers wait for a single fetch
+        with self._image_lock:
+            if catalog.state() in ("fresh", "stale"):
+                return catalog
+            catalog.update(self._fetch_image_list())
+            pass
+        return catalog
+
+    def invalidate_image_cache(self):
+        with self._image_lock:
+            self.image_catalog.invalidate()
+            pass
+        pass
+
+    def image_list(self, use_cache: bool = True) -> List[AutodlImage]:
+        if not use_cache or self.image_catalog.ttl <= 0:
+            return self._fetch_image_list()
+        return list(self._image_catalog().images)
     
     
     def image_latest(self, prefix: str) -> Optional[AutodlImage]:
-        if not prefix.endswith(":"):
-            prefix += ":"
-            pass
-        images = self.image_list()
-        filtered_images = [img for img in images if img.image_name.startswith(prefix)]
-        if not filtered_images:
-            return None
-        # Sort by ID in descending order to get the latest image
-        versions = [img.image_name[len(prefix):] for img in filtered_images]
-        versions = [tuple(int(vv) for vv in v.split(".")) for v in versions]
-        filtered_images = [img for _, img in sorted(zip(versions, filtered_images), key=lambda x: x[0], reverse=True)]
-        return filtered_images[0]
+        if self.image_catalog.ttl <= 0:
+            catalog = AutodlImageCatalog()
+            catalog.update(self._fetch_image_list())
+            return catalog.latest(prefix)
+        return self._image_catalog().latest(prefix)
     
 
     def gpu_stock_list(self, region=None) -> Dict[str, AutodlGpuStock]:
@@ -273,21 +846,7 @@ class AutodlClient(object):
         }
         
         data = self._request_retry(url, req)
-        
-        stocks = dict()
-
-        for gpu_stock in data:
-            gpu_type = list(gpu_stock.keys())[0]
-            idle_gpu_num = gpu_stock[gpu_type]["idle_gpu_num"]
-            total_gpu_num = gpu_stock[gpu_type]["total_gpu_num"]
-            stock = AutodlGpuStock(
-                idle_gpu_num=idle_gpu_num,
-                total_gpu_num=total_gpu_num
-            )
-            stocks[gpu_type] = stock
-            pass
-        
-        return stocks
+        return self._parse_gpu_stock(data)
     
     def blacklist_list(self, ) -> List[AutodlBlacklist]:
         url = "/api/v1/dev/deployment/blacklist"
@@ -311,52 +870,18 @@ class AutodlClient(object):
                          price_from: int = 10, price_to: int = 9000,
                          reuse_container: bool = False, env_vars: Optional[Dict[str, str]] = None) -> str:
         """Create elastic deployment"""
-        if dc_list is None:
-            dc_list = [self.default_region]
-        
-        if gpu_name_set is None or len(gpu_name_set) == 0:
-            gpu_name_set = self.default_gpu_set
-        
-        data = {
-            "name": name,
-            "deployment_type": deployment_type,
-            "replica_num": replica_num,
-            "reuse_container": reuse_container,
-            "container_template": {
-                "dc_list": dc_list,
-                "gpu_name_set": gpu_name_set,
-                "gpu_num": gpu_num,
-                "cuda_v_from": cuda_v_from,
-                "cuda_v_to": cuda_v_to,
-                "cpu_num_from": cpu_num_from,
-                "cpu_num_to": cpu_num_to,
-                "memory_size_from": memory_size_from,
-                "memory_size_to": memory_size_to,
-                "cmd": cmd,
-                "price_from": price_from,
-                "price_to": price_to,
-                "image_uuid": image_uuid,
-            }
-        }
-        
-        if deployment_type == "Job" and parallelism_num is not None:
-            data["parallelism_num"] = parallelism_num
-        elif deployment_type == "Container":
-            data["container_template"]["cuda_v"] = cuda_v_from
-            data["container_template"].pop("cuda_v_from", None)
-            data["container_template"].pop("cuda_v_to", None)
-        
-        if env_vars:
-            data["container_template"]["env_vars"] = env_vars
+        data = self._deployment_request(
+            name=name, image_uuid=image_uuid, deployment_type=deployment_type,
+            replica_num=replica_num, parallelism_num=parallelism_num,
+            gpu_name_set=gpu_name_set, gpu_num=gpu_num,
+            cuda_v_from=cuda_v_from, cuda_v_to=cuda_v_to,
+            cpu_num_from=cpu_num_from, cpu_num_to=cpu_num_to,
+            memory_size_from=memory_size_from, memory_size_to=memory_size_to,
+            dc_list=dc_list, cmd=cmd, price_from=price_from, price_to=price_to,
+            reuse_container=reuse_container, env_vars=env_vars)
             
         resp = self._request_retry("/api/v1/dev/deployment", req=data)
-        
-        deployment_uuid = resp.get("deployment_uuid")
-
-        if not deployment_uuid:
-            raise AutodlNetworkError("Deployment created successfully but no UUID returned")
-        
-        return deployment_uuid
+        return self._parse_deployment_uuid(resp)
 
     def create_replicaset_deployment(self, name: str, image_uuid: str, replica_num: int = 2,
                                    gpu_name_set: Optional[List[str]] = None, gpu_num: int = 1,
@@ -448,44 +973,22 @@ class AutodlClient(object):
             env_vars=env_vars
         )
 
-    def _parse_deployment(self, data) -> AutodlDeployment:
-        for key in ["region_sign", "dc_list", "gpu_name_set"]:
-            data[key] = data['template'][key]
-            pass
-        return AutodlDeployment(**data)
-    
-    def deployment_list(self, deployment_uuid=None, name=None, page_size=10, limit=None) -> List[AutodlDeployment]:
-        """Get deployment list"""
+    def deployment_list(self, deployment_uuid=None, name=None, page_size=10, limit=None,
+                        concurrency=None, status=None) -> List[AutodlDeployment]:
+        """Get deployment list, name is a substring match and status an exact match, both done by AutoDL"""
         url = "/api/v1/dev/deployment/list"
-        req = dict()
-        if deployment_uuid is not None:
-            req.update({
-                "deployment_uuid": deployment_uuid
-            })
-            pass
-        if name is not None:
-            req.update({
-                "name": name
-            })
-            pass
-        return self.get_pages(url, req, self._parse_deployment, page_size=page_size, limit=limit)
+        req = self._deployment_list_request(deployment_uuid=deployment_uuid, name=name, status=status)
+        return self.get_pages(url, req, self._parse_deployment, page_size=page_size, limit=limit,
+                              concurrency=concurrency)
 
     def container_event_list(
             self, deployment_uuid: str,
-            container_uuid: str = None) -> List[AutodlContainerEvent]:
+            container_uuid: str = None,
+            concurrency: Optional[int] = None) -> List[AutodlContainerEvent]:
         """Query container events"""
         url = "/api/v1/dev/deployment/container/event/list"
-        req = {
-            "deployment_uuid": deployment_uuid,
-        }
-        if container_uuid is not None:
-            req["deployment_container_uuid"] = container_uuid
-            pass
-        else:
-            req["deployment_container_uuid"] = ""
-            pass
-
-        return self.get_pages(url, req, lambda x: AutodlContainerEvent(**x))
+        req = self._container_event_request(deployment_uuid, container_uuid)
+        return self.get_pages(url, req, lambda x: AutodlContainerEvent(**x), concurrency=concurrency)
 
     def container_list(self, deployment_uuid: str,
             deployment_container_uuid: str = "", 
@@ -499,25 +1002,17 @@ class AutodlClient(object):
             price_from: int = 0,
             price_to: int = 0,
             released: bool = False,
-            status: List[str] = ["running"]) -> List[AutodlContainer]:
+            status: List[str] = ["running"],
+            concurrency: Optional[int] = None) -> List[AutodlContainer]:
         """Query containers"""
-        body = {
-            "deployment_uuid": deployment_uuid,
-            "container_uuid": deployment_container_uuid,
-            "date_from": date_from,
-            "date_to": date_to,
-            "gpu_name": gpu_name,
-            "cpu_num_from": cpu_num_from,
-            "cpu_num_to": cpu_num_to,
-            "memory_size_from": memory_size_from,
-            "memory_size_to": memory_size_to,
-            "price_from": price_from,
-            "price_to": price_to,
-            "released": released,
-            "status": status,
-        }
+        body = self._container_list_request(
+            deployment_uuid, deployment_container_uuid=deployment_container_uuid,
+            date_from=date_from, date_to=date_to, gpu_name=gpu_name,
+            cpu_num_from=cpu_num_from, cpu_num_to=cpu_num_to,
+            memory_size_from=memory_size_from, memory_size_to=memory_size_to,
+            price_from=price_from, price_to=price_to, released=released, status=status)
         url = "/api/v1/dev/deployment/container/list"
-        return self.get_pages(url, body, lambda x: AutodlContainer(**x))
+        return self.get_pages(url, body, lambda x: AutodlContainer(**x), concurrency=concurrency)
 
     def stop_container(self, deployment_container_uuid: str,
             decrease_one_replica_num: bool = False,
@@ -610,12 +1105,11 @@ class AutodlClient(object):
         return ddp_list
     
     def image_name2uuid(self, image_name: str) -> Optional[str]:
-        images = self.image_list()
-        for image in images:
-            if image.image_name == image_name:
-                return image.image_uuid
-            pass
-        return None
+        if self.image_catalog.ttl <= 0:
+            catalog = AutodlImageCatalog()
+            catalog.update(self._fetch_image_list())
+            return catalog.name2uuid(image_name)
+        return self._image_catalog().name2uuid(image_name)
     
     def deployment_get(self, deployment_uuid: str) -> Optional[AutodlDeployment]:
         deployments = self.deployment_list(deployment_uuid=deployment_uuid)
@@ -627,4 +1121,29 @@ class AutodlClient(object):
         deployment = self.deployment_get(deployment_uuid)
         if deployment is None:
             return None
-        return deployment.status
\ No newline at end of file
+        return deployment.status
+
+    def deployment_statuses(self, deployment_uuids: List[str], page_size: int = 100) -> Dict[str, Optional[str]]:
+        """
+        Status of many deployments, joined in memory from one sweep over the
+        deployment list that stops as soon as every uuid is found.
+        Unknown uuids map to None.
+        """
+        statuses = {deployment_uuid: None for deployment_uuid in deployment_uuids}
+        if len(statuses) == 1:
+            deployment_uuid = next(iter(statuses))
+            statuses[deployment_uuid] = self.deployment_status(deployment_uuid)
+            return statuses
+        pending = set(statuses)
+        if len(pending) == 0:
+            return statuses
+        url = "/api/v1/dev/deployment/list"
+        for deployment in self.iter_pages(url, {}, self._parse_deployment, page_size=page_size):
+            if deployment.uuid in pending:
+                statuses[deployment.uuid] = deployment.status
+                pending.discard(deployment.uuid)
+                if len(pending) == 0:
+                    break
+                pass
+            pass
+        return statuses
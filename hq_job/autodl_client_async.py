@@ -0,0 +1,389 @@
+import asyncio
+import json
+import math
+from typing import List, Dict, Optional
+
+import httpx
+import loguru
+
+from .autodl_client import (
+    AutodlClientBase, AutodlNetworkError, AutodlRetryBudget, AutodlImageCatalog,
+    AutodlImage, AutodlGpuStock, AutodlBlacklist, AutodlDeployment,
+    AutodlContainerEvent, AutodlContainer, is_retryable_error,
+)
+
+
+logger = loguru.logger
+
+
+def is_retryable_async_error(e: Exception) -> bool:
+    """is_retryable_error for the exceptions raised by httpx"""
+    if isinstance(e, (httpx.TimeoutException, httpx.NetworkError,
+                      httpx.RemoteProtocolError, json.JSONDecodeError)):
+        return True
+    return is_retryable_error(e)
+
+
+class AsyncAutodlClient(AutodlClientBase):
+    """
+    asyncio AutoDL client with the same surface as AutodlClient.
+    All calls share one httpx connection pool, so concurrent coroutines
+    scale with I/O instead of blocking the event loop.
+    """
+
+    def __init__(self, token, host: str = "https://api.autodl.com",
+                 max_connections: int = 32, max_keepalive_connections: int = 16,
+                 keepalive_expiry: float = 30.0,
+                 backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 retry_budget: Optional[AutodlRetryBudget] = None,
+                 image_cache_ttl: float = 300.0, image_cache_stale_ttl: float = 600.0,
+                 page_concurrency: int = 1):
+        super().__init__(
+            token, host=host, backoff_base=backoff_base, backoff_max=backoff_max,
+            retry_budget=retry_budget, image_cache_ttl=image_cache_ttl,
+            image_cache_stale_ttl=image_cache_stale_ttl, page_concurrency=page_concurrency)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry)
+        self._client = None
+        self._image_lock = None
+        self._image_refresh_task = None
+        pass
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # created lazily so it binds to the running event loop
+        if self._client is None:
+            # only failed connects are retried by the transport, the rest by _request_retry
+            transport = httpx.AsyncHTTPTransport(retries=self.retray, limits=self.limits)
+            self._client = httpx.AsyncClient(
+                base_url=self.host, headers=self._headers(), timeout=self.timeout, transport=transport)
+            pass
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            pass
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+        pass
+
+    async def _request(self, url, req="", method=None):
+        method = self._method(req, method)
+        client = self._get_client()
+        if method == "get":
+            response = await client.get(url)
+        else:
+            response = await client.request(method.upper(), url, json=req)
+            pass
+        return self._parse_response(response)
+
+    # reads only: after a timeout a PUT/DELETE may already be applied, sending it again would
+    # repeat it behind the caller's back. Writes use _request, failed connects (the request never
+    # left) are still retried by the transport
+    async def _request_retry(self, url, req="", method=None):
+        for i in range(self.retray):
+            try:
+                data = await self._request(url, req, method)
+                self.retry_budget.record_success()
+                break
+            except Exception as e:
+                if not is_retryable_async_error(e):
+                    raise e
+                self.retry_budget.record_failure()
+                if i == self.retray - 1:
+                    raise e
+                if not self.retry_budget.can_retry():
+                    logger.warning(f"Request {url} failed: {e}, retry budget exhausted, giving up")
+                    raise e
+                delay = self._backoff(i)
+                logger.warning(f"Request {url} failed: {e}, retrying {i+1}/{self.retray} in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+                continue
+            pass
+
+        return data
+
+    async def _get_page(self, url, req, page_index, page_size):
+        return await self._request_retry(url, self._page_request(req, page_index, page_size))
+
+    async def get_pages(self, url, req, parser, page_size=10, limit=None, concurrency=None):
+        """same as AutodlClient.get_pages, concurrent pages are bounded by a semaphore"""
+        if concurrency is None:
+            concurrency = self.page_concurrency
+            pass
+        items = []
+
+        def collect(data) -> bool:
+            for item in data["list"]:
+                items.append(parser(item))
+                if limit is not None and len(items) >= limit:
+                    return True
+                pass
+            return False
+
+        data = await self._get_page(url, req, 1, page_size)
+        if collect(data):
+            return items[:limit]
+        max_page = data["max_page"]
+        if limit is not None:
+            max_page = min(max_page, math.ceil(limit / page_size))
+            pass
+
+        if concurrency <= 1 or max_page <= 2:
+            page_index = 2
+            while page_index <= max_page:
+                data = await self._get_page(url, req, page_index, page_size)
+                if collect(data):
+                    return items[:limit]
+                page_index += 1
+                pass
+            return items
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(page_index):
+            async with semaphore:
+                return await self._get_page(url, req, page_index, page_size)
+
+        tasks = [asyncio.ensure_future(fetch(page_index)) for page_index in range(2, max_page + 1)]
+        try:
+            for task in tasks:
+                if collect(await task):
+                    return items[:limit]
+                pass
+        finally:
+            for task in tasks:
+                task.cancel()
+                pass
+            await asyncio.gather(*tasks, return_exceptions=True)
+            pass
+
+        return items
+
+    async def iter_pages(self, url, req, parser, page_size=10):
+        """Lazily yield parsed items page by page, so callers can stop early"""
+        page_index = 1
+        while True:
+            data = await self._get_page(url, req, page_index, page_size)
+            for item in data["list"]:
+                yield parser(item)
+                pass
+            if page_index >= data["max_page"]:
+                break
+            page_index += 1
+            pass
+        pass
+
+    # ------------------------------------------------------------------
+    # images
+    # ------------------------------------------------------------------
+
+    async def _fetch_image_list(self) -> List[AutodlImage]:
+        url = "/api/v1/dev/image/private/list"
+        return await self.get_pages(url, {}, lambda x: AutodlImage(**x))
+
+    async def _revalidate_image_catalog(self):
+        try:
+            self.image_catalog.update(await self._fetch_image_list())
+        except Exception as e:
+            logger.warning(f"refresh image list in background failed: {e}")
+            pass
+        finally:
+            self._image_refreshing = False
+            pass
+        pass
+
+    async def _image_catalog(self) -> AutodlImageCatalog:
+        catalog = self.image_catalog
+        state = catalog.state()
+        if state == "fresh":
+            return catalog
+        if state == "stale":
+            if not self._image_refreshing:
+                self._image_refreshing = True
+                self._image_refresh_task = asyncio.ensure_future(self._revalidate_image_catalog())
+                pass
+            return catalog
+        if self._image_lock is None:
+            self._image_lock = asyncio.Lock()
+            pass
+        async with self._image_lock:
+            if catalog.state() in ("fresh", "stale"):
+                return catalog
+            catalog.update(await self._fetch_image_list())
+            pass
+        return catalog
+
+    def invalidate_image_cache(self):
+        self.image_catalog.invalidate()
+        pass
+
+    async def image_list(self, use_cache: bool = True) -> List[AutodlImage]:
+        if not use_cache or self.image_catalog.ttl <= 0:
+            return await self._fetch_image_list()
+        return list((await self._image_catalog()).images)
+
+    async def image_latest(self, prefix: str) -> Optional[AutodlImage]:
+        if self.image_catalog.ttl <= 0:
+            catalog = AutodlImageCatalog()
+            catalog.update(await self._fetch_image_list())
+            return catalog.latest(prefix)
+        return (await self._image_catalog()).latest(prefix)
+
+    async def image_name2uuid(self, image_name: str) -> Optional[str]:
+        if self.image_catalog.ttl <= 0:
+            catalog = AutodlImageCatalog()
+            catalog.update(await self._fetch_image_list())
+            return catalog.name2uuid(image_name)
+        return (await self._image_catalog()).name2uuid(image_name)
+
+    # ------------------------------------------------------------------
+    # resources
+    # ------------------------------------------------------------------
+
+    async def gpu_stock_list(self, region=None) -> Dict[str, AutodlGpuStock]:
+        url = "/api/v1/dev/machine/region/gpu_stock"
+        if region is None:
+            region = self.default_region
+            pass
+        data = await self._request_retry(url, {"region_sign": region})
+        return self._parse_gpu_stock(data)
+
+    async def blacklist_list(self, ) -> List[AutodlBlacklist]:
+        url = "/api/v1/dev/deployment/blacklist"
+        data = await self._request_retry(url, {})
+        if data is None:
+            return []
+        return [AutodlBlacklist(**item) for item in data]
+
+    # ------------------------------------------------------------------
+    # deployments
+    # ------------------------------------------------------------------
+
+    async def create_deployment(self, name: str, image_uuid: str, **kwargs) -> str:
+        """Create elastic deployment, see AutodlClient.create_deployment for the arguments"""
+        data = self._deployment_request(name=name, image_uuid=image_uuid, **kwargs)
+        resp = await self._request_retry("/api/v1/dev/deployment", req=data)
+        return self._parse_deployment_uuid(resp)
+
+    async def create_replicaset_deployment(self, name: str, image_uuid: str, replica_num: int = 2,
+                                           cuda_v_to: int = 1000, cpu_num_to: int = 1000,
+                                           memory_size_to: int = 1000, reuse_container: bool = True,
+                                           **kwargs) -> str:
+        """Create ReplicaSet type deployment"""
+        return await self.create_deployment(
+            name=name, image_uuid=image_uuid, deployment_type="ReplicaSet", replica_num=replica_num,
+            cuda_v_to=cuda_v_to, cpu_num_to=cpu_num_to, memory_size_to=memory_size_to,
+            reuse_container=reuse_container, **kwargs)
+
+    async def create_job_deployment(self, name: str, image_uuid: str, replica_num: int = 1,
+                                    parallelism_num: int = 1, cuda_v_to: int = 1000,
+                                    cpu_num_to: int = 1000, memory_size_to: int = 1000,
+                                    cmd: str = "sleep 10", **kwargs) -> str:
+        """Create Job type deployment"""
+        return await self.create_deployment(
+            name=name, image_uuid=image_uuid, deployment_type="Job", replica_num=replica_num,
+            parallelism_num=parallelism_num, cuda_v_to=cuda_v_to, cpu_num_to=cpu_num_to,
+            memory_size_to=memory_size_to, cmd=cmd, **kwargs)
+
+    async def create_container_deployment(self, name: str, image_uuid: str, cuda_v: int = 113,
+                                          reuse_container: bool = True, **kwargs) -> str:
+        """Create Container type deployment"""
+        return await self.create_deployment(
+            name=name, image_uuid=image_uuid, deployment_type="Container", replica_num=1,
+            cuda_v_from=cuda_v, cuda_v_to=cuda_v, reuse_container=reuse_container, **kwargs)
+
+    async def deployment_list(self, deployment_uuid=None, name=None, page_size=10, limit=None,
+                              concurrency=None, status=None) -> List[AutodlDeployment]:
+        """Get deployment list, name is a substring match and status an exact match, both done by AutoDL"""
+        url = "/api/v1/dev/deployment/list"
+        req = self._deployment_list_request(deployment_uuid=deployment_uuid, name=name, status=status)
+        return await self.get_pages(url, req, self._parse_deployment, page_size=page_size, limit=limit,
+                                    concurrency=concurrency)
+
+    def iter_deployments(self, name=None, status=None, page_size=10):
+        """Lazily walk the deployment list, newest first"""
+        url = "/api/v1/dev/deployment/list"
+        req = self._deployment_list_request(name=name, status=status)
+        return self.iter_pages(url, req, self._parse_deployment, page_size=page_size)
+
+    async def container_event_list(self, deployment_uuid: str, container_uuid: str = None,
+                                   concurrency: Optional[int] = None) -> List[AutodlContainerEvent]:
+        """Query container events"""
+        url = "/api/v1/dev/deployment/container/event/list"
+        req = self._container_event_request(deployment_uuid, container_uuid)
+        return await self.get_pages(url, req, lambda x: AutodlContainerEvent(**x), concurrency=concurrency)
+
+    async def container_list(self, deployment_uuid: str, concurrency: Optional[int] = None,
+                             **kwargs) -> List[AutodlContainer]:
+        """Query containers, see AutodlClient.container_list for the filters"""
+        url = "/api/v1/dev/deployment/container/list"
+        body = self._container_list_request(deployment_uuid, **kwargs)
+        return await self.get_pages(url, body, lambda x: AutodlContainer(**x), concurrency=concurrency)
+
+    async def set_replicas(self, deployment_uuid: str, replicas: int) -> bool:
+        """Set replica count"""
+        body = {
+            "deployment_uuid": deployment_uuid,
+            "replica_num": replicas
+        }
+        await self._request("/api/v1/dev/deployment/replica_num", req=body, method="PUT")
+        return True
+
+    async def stop_deployment(self, deployment_uuid: str) -> bool:
+        """Stop deployment"""
+        data = {
+            "deployment_uuid": deployment_uuid,
+            "operate": "stop"
+        }
+        await self._request("/api/v1/dev/deployment/operate", req=data, method="PUT")
+        return True
+
+    async def deployment_delete(self, deployment_uuid: str) -> bool:
+        """Delete deployment"""
+        body = {
+            "deployment_uuid": deployment_uuid,
+        }
+        await self._request("/api/v1/dev/deployment", req=body, method="DELETE")
+        return True
+
+    async def deployment_get(self, deployment_uuid: str) -> Optional[AutodlDeployment]:
+        deployments = await self.deployment_list(deployment_uuid=deployment_uuid)
+        if len(deployments) == 0:
+            return None
+        return deployments[0]
+
+    async def deployment_status(self, deployment_uuid: str) -> Optional[str]:
+        deployment = await self.deployment_get(deployment_uuid)
+        if deployment is None:
+            return None
+        return deployment.status
+
+    async def deployment_statuses(self, deployment_uuids: List[str], page_size: int = 100) -> Dict[str, Optional[str]]:
+        """see AutodlClient.deployment_statuses"""
+        statuses = {deployment_uuid: None for deployment_uuid in deployment_uuids}
+        if len(statuses) == 1:
+            deployment_uuid = next(iter(statuses))
+            statuses[deployment_uuid] = await self.deployment_status(deployment_uuid)
+            return statuses
+        pending = set(statuses)
+        if len(pending) == 0:
+            return statuses
+        url = "/api/v1/dev/deployment/list"
+        async for deployment in self.iter_pages(url, {}, self._parse_deployment, page_size=page_size):
+            if deployment.uuid in pending:
+                statuses[deployment.uuid] = deployment.status
+                pending.discard(deployment.uuid)
+                if len(pending) == 0:
+                    break
+                pass
+            pass
+        return statuses
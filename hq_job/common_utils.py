@@ -17,6 +17,8 @@ def to_str(v):
 def from_str(v, target_type):
     if target_type == str:
         return v
+    elif target_type == bool:
+        return v.strip().lower() in ("1", "true", "yes")
     elif target_type == int:
         return int(v)
     elif target_type == float:
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import hashlib
+import sysconfig
+import subprocess
+import importlib.metadata
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional
+
+import loguru
+from packaging.requirements import InvalidRequirement, Requirement
+from packaging.utils import canonicalize_name
+
+logger = loguru.logger
+
+# applied to every AutoDL job unless the job declares the same package itself
+DEFAULT_REQUIREMENTS = ["numpy<2.0.0"]
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hq_job", "env")
+
+
+def requirement_satisfied(requirement: str) -> Optional[bool]:
+    """
+    whether the running interpreter already satisfies a `name<spec>` requirement,
+    None when it can't be told from the installed metadata (urls, pip options)
+    """
+    try:
+        req = Requirement(requirement)
+    except InvalidRequirement:
+        return None
+    if req.url:
+        return None
+    if req.marker is not None and not req.marker.evaluate():
+        return True
+    try:
+        version = importlib.metadata.version(req.name)
+    except importlib.metadata.PackageNotFoundError:
+        return False
+    return req.specifier.contains(version, prereleases=True)
+
+
+def merge_requirements(requirements: List[str], defaults: List[str] = DEFAULT_REQUIREMENTS) -> List[str]:
+    """job requirements plus the defaults for packages the job doesn't name"""
+    names = set()
+    for requirement in requirements:
+        try:
+            names.add(canonicalize_name(Requirement(requirement).name))
+        except InvalidRequirement:
+            pass
+        pass
+    merged = [r for r in defaults if canonicalize_name(Requirement(r).name) not in names]
+    return merged + [r for r in requirements if r not in merged]
+
+
+class EnvPreparer(object):
+    """
+    Prepares the interpreter for a job before its command starts.
+
+    Requirements that are already satisfied are left alone. The others are
+    uninstalled (leftovers included) and installed again with pip. When all of them
+    hold, a marker named by the hash of the requirements is written, later starts
+    with the same requirements skip pip for what the metadata can't check (urls,
+    options). Every step is timed into the log.
+    """
+
+    def __init__(self, requirements: List[str], cache_dir: Optional[str] = None, python: str = sys.executable,
+                 retries: int = 5, retry_interval: float = 10.0):
+        self.requirements = list(requirements)
+        self.cache_dir = cache_dir or os.environ.get("HQJOB_ENV_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.python = python
+        self.retries = retries
+        self.retry_interval = retry_interval
+        self.timings = []
+        pass
+
+    @contextmanager
+    def step(self, name: str):
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            self.timings.append((name, elapsed))
+            logger.info(f"env: {name} took {elapsed:.2f}s")
+            pass
+        pass
+
+    def key(self) -> str:
+        content = json.dumps({"python": self.python, "requirements": sorted(self.requirements)})
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+    def marker_file(self) -> str:
+        return os.path.join(self.cache_dir, f"{self.key()}.json")
+
+    def unsatisfied(self) -> List[str]:
+        marked = os.path.exists(self.marker_file())
+        missing = []
+        for requirement in self.requirements:
+            satisfied = requirement_satisfied(requirement)
+            if satisfied is None:
+                satisfied = marked
+                pass
+            if not satisfied:
+                missing.append(requirement)
+                pass
+            pass
+        return missing
+
+    def _pip(self, args: List[str]) -> int:
+        return subprocess.call([self.python, "-m", "pip"] + args)
+
+    def _uninstall(self, requirements: List[str]):
+        names = []
+        for requirement in requirements:
+            try:
+                names.append(Requirement(requirement).name)
+            except InvalidRequirement:
+                pass
+            pass
+        if len(names) == 0:
+            return
+        self._pip(["uninstall", "-y"] + names)
+        # a broken install may leave files pip doesn't know about
+        site_packages = sysconfig.get_paths()["purelib"]
+        for name in names:
+            module = canonicalize_name(name).replace("-", "_")
+            for path in [os.path.join(site_packages, module)] + glob.glob(
+                    os.path.join(site_packages, f"{module}-*.*-info")):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                    pass
+                pass
+            pass
+        pass
+
+    def _install(self, requirements: List[str]) -> bool:
+        for i in range(self.retries):
+            if self._pip(["install"] + requirements) == 0:
+                return True
+            logger.warning(f"installing {requirements} failed, try again")
+            time.sleep(self.retry_interval)
+            pass
+        return False
+
+    def prepare(self) -> bool:
+        """returns whether the environment satisfies all requirements"""
+        with self.step("check requirements"):
+            missing = self.unsatisfied()
+            pass
+        if len(missing) == 0:
+            logger.info(f"env: {len(self.requirements)} requirements already satisfied, nothing to install")
+            self._mark()
+            return True
+
+        logger.info(f"env: preparing {missing}")
+        with self.step("uninstall"):
+            self._uninstall(missing)
+            pass
+        with self.step("install"):
+            installed = self._install(missing)
+            pass
+        if not installed:
+            logger.error(f"env: can't install {missing}, the job starts anyway")
+            return False
+        self._mark()
+        return True
+
+    def _mark(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.marker_file(), "w", encoding="utf-8") as f:
+            json.dump({"python": self.python, "requirements": self.requirements,
+                       "prepared_at": datetime.now().isoformat(),
+                       "timings": {name: round(elapsed, 3) for name, elapsed in self.timings}}, f, indent=2)
+            pass
+        pass
+    pass
+
+
+def prepare_environment(requirements: List[str], **kwargs) -> EnvPreparer:
+    """prepare the job requirements merged with DEFAULT_REQUIREMENTS"""
+    preparer = EnvPreparer(merge_requirements(requirements), **kwargs)
+    preparer.prepare()
+    total = sum(elapsed for _, elapsed in preparer.timings)
+    logger.info(f"env: prepared in {total:.2f}s ({', '.join(f'{n} {t:.2f}s' for n, t in preparer.timings)})")
+    return preparer
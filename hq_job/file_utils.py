@@ -1,60 +1,473 @@
 import os
+import re
+import json
+import time
+import hashlib
 import tarfile
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
 
-def pack_files_by_fixed_size(source, destination, basename, postfix="tar", size=1024*1024*1024):
+import loguru
 
-    if postfix == "tar":
-        file_mode = "w"
+logger = loguru.logger
+
+# shard codec -> file extension, zstd and lz4 need their packages and fall back to gzip
+CODEC_EXTENSIONS = {"none": "tar", "gzip": "tar.gz", "zstd": "tar.zst", "lz4": "tar.lz4"}
+MANIFEST_POSTFIX = "manifest.json"
+
+
+def resolve_codec(codec: Optional[str]) -> str:
+    """the codec packing will use, gzip when the package of a fast codec is missing"""
+    if codec in (None, "", "none", "tar"):
+        return "none"
+    if codec in ("gzip", "gz"):
+        return "gzip"
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    try:
+        if codec == "zstd":
+            import zstandard
+        else:
+            import lz4.frame
+            pass
+    except ImportError:
+        logger.warning(f"{codec} is not installed, packing with gzip instead")
+        return "gzip"
+    return codec
+
+
+def codec_of(path: str) -> str:
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if codec != "none" and path.endswith("." + extension):
+            return codec
+        pass
+    return "none"
+
+
+@contextmanager
+def open_tar(path: str, mode: str = "r", codec: Optional[str] = None,
+             fileobj: Optional[BinaryIO] = None) -> Iterator[tarfile.TarFile]:
+    """
+    a shard as a TarFile, mode "r" or "w", the codec defaults to the one of the extension.
+    zstd and lz4 shards, and any shard read from fileobj (e.g. a download stream), are
+    streams: members are read in order, no seeking back
+    """
+    codec = codec or codec_of(path)
+    if codec == "none" and fileobj is None:
+        with tarfile.open(path, mode) as tar:
+            yield tar
+            pass
+        return
+    if codec == "gzip" and fileobj is None:
+        with tarfile.open(path, f"{mode}:gz", **({"compresslevel": 1} if mode == "w" else {})) as tar:
+            yield tar
+            pass
+        return
+    stream_mode = f"{mode}|"
+    if codec == "none":
+        stream = fileobj
+    elif codec == "gzip":
+        stream = fileobj
+        stream_mode = f"{mode}|gz"
+    elif codec == "zstd":
+        import zstandard
+        raw = fileobj or open(path, mode + "b")
+        if mode == "w":
+            stream = zstandard.ZstdCompressor(level=3).stream_writer(raw)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw)
+            pass
+    elif codec == "lz4":
+        import lz4.frame
+        stream = lz4.frame.open(fileobj or path, mode + "b")
     else:
-        raise ValueError(f"Unsupported postfix: {postfix}")
-    
-    target_names = []
+        raise ValueError(f"Unsupported codec: {codec}")
+    try:
+        with tarfile.open(fileobj=stream, mode=stream_mode) as tar:
+            yield tar
+            pass
+    finally:
+        # closes the file below as well
+        stream.close()
+        pass
+    pass
+
+
+class _HashingReader(object):
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.hash = hashlib.sha256()
+        pass
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.hash.update(data)
+        return data
+    pass
+
+
+def plan_shards(source: str, size: int) -> List[List[Tuple[str, str, int]]]:
+    """(path, arcname, size) of the files of each shard, in walk order, a new shard when one would exceed size"""
     if os.path.isfile(source):
-        target_name = os.path.join(destination, basename + f"_0.{postfix}")
-        target_names.append(target_name)
-        with tarfile.open(target_name, "w") as tar:
-            tar.add(source, arcname=os.path.basename(source))
+        return [[(source, os.path.basename(source), os.path.getsize(source))]]
+    shards = []
+    current_size = 0
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            file_size = os.path.getsize(file_path)
+            if len(shards) == 0 or (current_size + file_size > size and current_size > 0):
+                shards.append([])
+                current_size = 0
+                pass
+            shards[-1].append((file_path, os.path.relpath(file_path, source).replace(os.sep, "/"), file_size))
+            current_size += file_size
             pass
         pass
-    else:
-        current_size = 0
-        current_index = 0
-        current_tar = None
-        for root, dirs, files in os.walk(source):
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_size = os.path.getsize(file_path)
-                if current_tar is None or current_size + file_size > size:
-                    if current_tar is not None:
-                        current_tar.close()
-                        pass
-                    target_name = os.path.join(destination, f"{basename}_{current_index}.{postfix}")
-                    target_names.append(target_name)
-                    current_tar = tarfile.open(target_name, file_mode)
-                    current_size = 0
-                    current_index += 1
+    return shards
+
+
+def _pack_shard(target_name: str, members: List[Tuple[str, str, int]], codec: str) -> List[dict]:
+    """write one shard, returns the manifest entries of its members (offsets in the uncompressed tar)"""
+    entries = []
+    with open_tar(target_name, "w", codec) as tar:
+        for file_path, arcname, _ in members:
+            tarinfo = tar.gettarinfo(file_path, arcname=arcname)
+            header_offset = tar.offset
+            checksum = ""
+            if tarinfo.isreg():
+                with open(file_path, "rb") as f:
+                    reader = _HashingReader(f)
+                    tar.addfile(tarinfo, reader)
+                    checksum = reader.hash.hexdigest()
                     pass
-                current_tar.add(file_path, arcname=os.path.relpath(file_path, source))
-                current_size += file_size
+            else:
+                tar.addfile(tarinfo)
                 pass
+            padded_size = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE if tarinfo.isreg() else 0
+            entries.append({"path": arcname, "size": tarinfo.size, "header_offset": header_offset,
+                            "offset": tar.offset - padded_size, "sha256": checksum})
+            pass
+        pass
+    return entries
+
+
+def pack_files_by_fixed_size(source, destination, basename, postfix="tar", size=1024*1024*1024,
+                             workers: Optional[int] = None, codec: Optional[str] = None):
+    """
+    Packs source (a file or a dir) into shards of about `size` input bytes,
+    <basename>_<i>.<ext>, built by `workers` processes at a time (default: the cpus).
+    codec none / gzip / zstd / lz4 picks the compression, postfix "tar" means none.
+    <basename>.manifest.json lists the shards and, per file, its shard, offsets in
+    the uncompressed tar, size and sha256. Returns the shard paths in order.
+    """
+    if codec is None:
+        if postfix not in CODEC_EXTENSIONS.values():
+            raise ValueError(f"Unsupported postfix: {postfix}")
+        codec = codec_of("." + postfix)
+        pass
+    codec = resolve_codec(codec)
+    postfix = CODEC_EXTENSIONS[codec]
+
+    os.makedirs(destination or ".", exist_ok=True)
+    shards = plan_shards(source, size)
+    target_names = [os.path.join(destination, f"{basename}_{i}.{postfix}") for i in range(len(shards))]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(shards)))
+    start = time.time()
+    if workers == 1:
+        results = [_pack_shard(t, m, codec) for t, m in zip(target_names, shards)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_pack_shard, target_names, shards, [codec] * len(shards)))
             pass
-        if current_tar is not None:
-            current_tar.close()
         pass
 
+    manifest = {"codec": codec, "shard_size": size, "shards": [], "files": []}
+    for i, (target_name, entries) in enumerate(zip(target_names, results)):
+        manifest["shards"].append({"name": os.path.basename(target_name), "files": len(entries),
+                                   "bytes": sum(e["size"] for e in entries),
+                                   "stored_bytes": os.path.getsize(target_name)})
+        for entry in entries:
+            manifest["files"].append(dict(entry, shard=i))
+            pass
+        pass
+    manifest_file = os.path.join(destination, f"{basename}.{MANIFEST_POSTFIX}")
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        pass
+    os.replace(manifest_file + ".tmp", manifest_file)
+
+    total = sum(s["bytes"] for s in manifest["shards"])
+    stored = sum(s["stored_bytes"] for s in manifest["shards"])
+    elapsed = time.time() - start
+    logger.info(f"packed {len(manifest['files'])} files ({total / 1e6:.1f} MB) into {len(target_names)} {codec} "
+                f"shards ({stored / 1e6:.1f} MB) with {workers} workers in {elapsed:.2f}s "
+                f"({total / elapsed / 1e6 if elapsed > 0 else 0.0:.1f} MB/s)")
     return target_names
 
-def unpack_files_and_delete(source, destination, basename, postfix="tar"):
-    current_index = 0
+def shard_postfix(source: str, basename: str) -> str:
+    """the extension of the shards of a pack, from its manifest or the first shard found"""
+    manifest_file = os.path.join(source, f"{basename}.{MANIFEST_POSTFIX}")
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            return CODEC_EXTENSIONS[json.load(f)["codec"]]
+    for postfix in CODEC_EXTENSIONS.values():
+        if os.path.exists(os.path.join(source, f"{basename}_0.{postfix}")):
+            return postfix
+        pass
+    return "tar"
+
+
+def _check_member(member: tarfile.TarInfo, destination: str):
+    """raises for a member that would land, or link, outside destination (../x, /x)"""
+    root = os.path.realpath(destination)
+
+    def inside(path: str) -> bool:
+        path = os.path.realpath(path)
+        return path == root or path.startswith(root + os.sep)
+
+    if not inside(os.path.join(root, member.name)):
+        raise tarfile.TarError(f"{member.name} would be extracted outside {destination}")
+    if member.issym() and not inside(os.path.join(root, os.path.dirname(member.name), member.linkname)):
+        raise tarfile.TarError(f"{member.name} links outside {destination}")
+    if member.islnk() and not inside(os.path.join(root, member.linkname)):
+        raise tarfile.TarError(f"{member.name} links outside {destination}")
+    pass
+
 
+def _extract(tar: tarfile.TarFile, destination: str) -> Tuple[int, int]:
+    """extract the members in order, none of them outside destination, returns (files, bytes)"""
+    files = 0
+    total = 0
+    # the data filter of newer Pythons, the check below covers the others
+    kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    for member in tar:
+        _check_member(member, destination)
+        # shards are extracted in parallel into the same tree
+        os.makedirs(os.path.dirname(os.path.join(destination, member.name)), exist_ok=True)
+        tar.extract(member, path=destination, **kwargs)
+        if member.isreg():
+            files += 1
+            total += member.size
+            pass
+        pass
+    return files, total
+
+
+def extract_stream(fileobj: BinaryIO, destination: str, codec: str = "none") -> Tuple[int, int]:
+    """extract a tar read from a stream (e.g. an ssh channel) in one pass, returns (files, bytes)"""
+    with open_tar("", "r", codec, fileobj=fileobj) as tar:
+        return _extract(tar, destination)
+
+
+def _unpack_shard(target_name: str, destination: str, codec: Optional[str] = None) -> Tuple[int, int]:
+    with open_tar(target_name, "r", codec) as tar:
+        result = _extract(tar, destination)
+        pass
+    # right away, the disk holds at most one shard per worker next to the extracted files
+    os.remove(target_name)
+    return result
+
+
+def _unpack_remote_shard(remote_path: str, destination: str, codec: str) -> Tuple[int, int]:
+    from . import storage
+    try:
+        stream = storage.open_file(remote_path)
+    except NotImplementedError:
+        # the backend can only download, the shard lands on disk until it is extracted
+        local_path = os.path.join(destination, f".{os.path.basename(remote_path)}.part")
+        os.makedirs(destination, exist_ok=True)
+        storage.download_file(remote_path, local_path)
+        try:
+            return _unpack_shard(local_path, destination, codec)
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+                pass
+            pass
+        pass
+    try:
+        with open_tar(remote_path, "r", codec, fileobj=stream) as tar:
+            return _extract(tar, destination)
+    finally:
+        stream.close()
+        pass
+    pass
+
+
+def _run_shards(func: Callable, args: List[tuple], workers: Optional[int]) -> Tuple[List[Tuple[int, int]], int]:
+    """func(*a) for every shard, `workers` processes at a time (default: the cpus)"""
+    workers = max(1, min(workers or os.cpu_count() or 1, len(args)))
+    if workers == 1:
+        return [func(*a) for a in args], workers
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, *zip(*args))), workers
+
+
+def _log_unpacked(what: str, results: List[Tuple[int, int]], workers: int, start: float):
+    files = sum(r[0] for r in results)
+    total = sum(r[1] for r in results)
+    elapsed = time.time() - start
+    logger.info(f"unpacked {files} files ({total / 1e6:.1f} MB) from {len(results)} shards of {what} "
+                f"with {workers} workers in {elapsed:.2f}s ({total / elapsed / 1e6 if elapsed > 0 else 0.0:.1f} MB/s)")
+    pass
+
+
+def unpack_files_and_delete(source, destination, basename, postfix="tar", workers: Optional[int] = None):
+    """
+    extracts the shards <basename>_<i>.<postfix> of source into destination, `workers` at a time,
+    deleting each shard as soon as it is extracted. postfix None finds it with shard_postfix
+    """
+    if postfix is None:
+        postfix = shard_postfix(source, basename)
+        pass
+    target_names = []
     while True:
-        target_name = os.path.join(source, f"{basename}_{current_index}.{postfix}")
+        target_name = os.path.join(source, f"{basename}_{len(target_names)}.{postfix}")
         if not os.path.exists(target_name):
             break
-        with tarfile.open(target_name, "r") as tar:
-            tar.extractall(path=destination)
+        target_names.append(target_name)
+        pass
+    if len(target_names) == 0:
+        return
+    start = time.time()
+    results, workers = _run_shards(_unpack_shard, [(t, destination) for t in target_names], workers)
+    _log_unpacked(os.path.join(source, basename), results, workers, start)
+    pass
+
+
+def _remote_shards(remote_dir: str, basename: str) -> List[str]:
+    """shard names of a pack in storage, from its manifest or a COS listing"""
+    from . import storage
+    manifest_path = remote_dir + f"{basename}.{MANIFEST_POSTFIX}"
+    try:
+        try:
+            stream = storage.open_file(manifest_path)
+            try:
+                manifest = json.loads(stream.read())
+            finally:
+                stream.close()
+                pass
+        except NotImplementedError:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                storage.download_file(manifest_path, os.path.join(tmp_dir, "manifest.json"))
+                with open(os.path.join(tmp_dir, "manifest.json"), "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                    pass
+                pass
+            pass
+        return [s["name"] for s in manifest["shards"]]
+    except (FileNotFoundError, RuntimeError):
+        pass
+    # packed before there were manifests
+    if not remote_dir.startswith("cos://"):
+        raise FileNotFoundError(f"no manifest {manifest_path}")
+    prefix = remote_dir[len("cos://"):]
+    pattern = re.compile(re.escape(basename) + r"_(\d+)\.(" + "|".join(
+        re.escape(e) for e in CODEC_EXTENSIONS.values()) + r")$")
+    names = []
+    for f in storage.cos_client().list_files(prefix=prefix + basename + "_"):
+        match = pattern.match(f.Key[len(prefix):])
+        if match:
+            names.append((int(match.group(1)), f.Key[len(prefix):]))
             pass
-        os.remove(target_name)
-        current_index += 1
         pass
-    pass
\ No newline at end of file
+    return [name for _, name in sorted(names)]
+
+
+def unpack_files_from_storage(remote_dir: str, destination: str, basename: str,
+                              workers: Optional[int] = None) -> List[str]:
+    """
+    extracts the shards of a pack in storage (e.g. cos://prefix/packs) into destination,
+    `workers` at a time, streaming each download straight into tarfile so no shard
+    lands on disk. Backends that can't stream (coscmd) download one shard per worker
+    next to the files instead. Returns the shard paths.
+    """
+    remote_dir = remote_dir.rstrip("/") + "/"
+    remote_paths = [remote_dir + name for name in _remote_shards(remote_dir, basename)]
+    if len(remote_paths) == 0:
+        return remote_paths
+    os.makedirs(destination, exist_ok=True)
+    start = time.time()
+    results, workers = _run_shards(
+        _unpack_remote_shard, [(p, destination, codec_of(p)) for p in remote_paths], workers)
+    _log_unpacked(remote_dir + basename, results, workers, start)
+    return remote_paths
+
+
+def _complete_utf8_length(data: bytes) -> int:
+    """length of data without an incomplete utf-8 sequence at its end"""
+    for i in range(1, min(4, len(data)) + 1):
+        b = data[-i]
+        if b & 0xC0 == 0x80:
+            # continuation byte, keep looking for the lead byte
+            continue
+        if b >= 0xF0:
+            need = 4
+        elif b >= 0xE0:
+            need = 3
+        elif b >= 0xC0:
+            need = 2
+        else:
+            need = 1
+        return len(data) if need <= i else len(data) - i
+    return len(data)
+
+
+def tail_offset(f: BinaryIO, size: int, lines: int, limit: Optional[int] = None,
+                block_size: int = 64 * 1024) -> int:
+    """offset where the last `lines` lines of a file start, looking back at most `limit` bytes"""
+    floor = 0 if limit is None else max(0, size - limit)
+    if lines <= 0:
+        return size
+    count = 0
+    pos = size
+    while pos > floor:
+        start = max(floor, pos - block_size)
+        f.seek(start)
+        block = f.read(pos - start)
+        i = len(block)
+        while True:
+            i = block.rfind(b"\n", 0, i)
+            if i < 0:
+                break
+            # a trailing newline ends the last line, it doesn't start one
+            if start + i == size - 1:
+                continue
+            count += 1
+            if count == lines:
+                return start + i + 1
+            pass
+        pos = start
+        pass
+    return floor
+
+
+def read_chunk(f: BinaryIO, size: int, offset: int = 0, max_bytes: Optional[int] = None,
+               tail_lines: Optional[int] = None) -> Tuple[bytes, int, int]:
+    """
+    read a piece of a growing file by seeking, local or remote (sftp) alike.
+    returns (data, start, next_offset): data starts at `start`, pass next_offset back as
+    offset to continue. tail_lines starts at the last lines instead, but not before offset.
+    An offset past the end means the file was rewritten, reading starts over.
+    A multi-byte utf-8 character cut at the end is left for the next read.
+    """
+    if offset > size:
+        offset = 0
+    start = offset
+    if tail_lines is not None:
+        start = max(offset, tail_offset(f, size, tail_lines, limit=max_bytes))
+        pass
+    length = size - start
+    if max_bytes is not None:
+        length = min(length, max_bytes)
+        pass
+    if length <= 0:
+        return b"", start, start
+    f.seek(start)
+    data = f.read(length)
+    data = data[:_complete_utf8_length(data)]
+    return data, start, start + len(data)
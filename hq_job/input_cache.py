@@ -0,0 +1,206 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+import uuid
+from typing import Callable, List, Optional, Set, Tuple
+
+import loguru
+
+from . import storage
+
+logger = loguru.logger
+
+# on the AutoDL data disk, which outlives the jobs of a container
+DEFAULT_CACHE_DIR = "/root/autodl-tmp/.hq_job_cache"
+# share of the cache disk the cache may fill when no size is given
+DEFAULT_DISK_SHARE = 0.5
+# downloads of a crashed worker older than this are removed by evict()
+TMP_MAX_AGE = 24 * 3600
+
+
+def cos_list_objects(prefix: str) -> List[Tuple[str, str, int]]:
+    """(key, etag, size) of the objects under prefix, through the ~/.cos.conf account coscmd uses"""
+    return [(f.Key, f.ETag, f.Size) for f in storage.cos_client().list_files(prefix=prefix)]
+
+
+class InputCache(object):
+    """
+    Content-addressed cache of COS inputs on the container.
+
+    An object is stored under the hash of its key, ETag and size, so a changed object is
+    a new entry and a stale copy is never served. Misses are downloaded into the cache first.
+    Entries are stored read-only and hardlinked (symlinked across devices) into the working
+    dir, so a job can't write through a staged input into the cache. Root ignores the mode,
+    as root (AutoDL containers) inputs are copied instead.
+    Entries are evicted least recently used first (by mtime) once the cache holds more
+    than max_bytes. download() has the signature of storage.download_file.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 list_objects: Callable[[str], List[Tuple[str, str, int]]] = cos_list_objects,
+                 download: Callable[[str, str], None] = storage.download_file):
+        self.cache_dir = cache_dir or os.environ.get("HQJOB_INPUT_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.objects_dir = os.path.join(self.cache_dir, "objects")
+        self.tmp_dir = os.path.join(self.cache_dir, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        if max_bytes is None and os.environ.get("HQJOB_INPUT_CACHE_MAX_BYTES"):
+            max_bytes = int(os.environ["HQJOB_INPUT_CACHE_MAX_BYTES"])
+            pass
+        if max_bytes is None:
+            max_bytes = int(shutil.disk_usage(self.cache_dir).total * DEFAULT_DISK_SHARE)
+            pass
+        self.max_bytes = max_bytes
+        self.list_objects = list_objects
+        self._download = download
+        self._lock = threading.Lock()
+        # entries this process linked, eviction leaves them alone
+        self._in_use: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+        pass
+
+    @staticmethod
+    def entry_id(key: str, etag: str, size: int) -> str:
+        return hashlib.sha256(f"{key}\0{etag.strip(chr(34))}\0{size}".encode("utf-8")).hexdigest()
+
+    def _entry_path(self, entry_id: str) -> str:
+        return os.path.join(self.objects_dir, entry_id[:2], entry_id)
+
+    def download(self, remote_path: str, local_path: str):
+        if not remote_path.startswith("cos://"):
+            self._download(remote_path, local_path)
+            return
+        prefix = remote_path[len("cos://"):]
+        try:
+            objects = self.list_objects(prefix)
+        except Exception as e:
+            logger.warning(f"input cache: can't list {remote_path} ({e}), downloading without cache")
+            self._download(remote_path, local_path)
+            return
+
+        if not prefix.endswith("/"):
+            objects = [o for o in objects if o[0] == prefix]
+            if len(objects) == 0:
+                raise FileNotFoundError(f"{remote_path} not found")
+            self._fetch(*objects[0], local_path)
+            return
+        # a folder lands in local_path with the layout below the prefix, like `coscmd download -r`
+        for key, etag, size in objects:
+            if key.endswith("/"):
+                continue
+            self._fetch(key, etag, size, os.path.join(local_path, key[len(prefix):]))
+            pass
+        pass
+
+    def _fetch(self, key: str, etag: str, size: int, local_path: str):
+        entry_id = self.entry_id(key, etag, size)
+        entry_path = self._entry_path(entry_id)
+        with self._lock:
+            self._in_use.add(entry_id)
+            pass
+        if os.path.exists(entry_path):
+            # a hit is the most recent use
+            os.utime(entry_path)
+            with self._lock:
+                self.hits += 1
+                self.hit_bytes += size
+                pass
+        else:
+            tmp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+            try:
+                self._download(f"cos://{key}", tmp_path)
+                os.chmod(tmp_path, 0o444)
+                os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+                os.replace(tmp_path, entry_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                    pass
+                pass
+            with self._lock:
+                self.misses += 1
+                self.miss_bytes += size
+                pass
+            pass
+        self._link(entry_path, local_path)
+        pass
+
+    @staticmethod
+    def _link(entry_path: str, local_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+        if os.path.lexists(local_path):
+            os.remove(local_path)
+            pass
+        if hasattr(os, "geteuid") and os.geteuid() == 0:
+            # the read-only mode doesn't stop root, a link would let the job change the entry
+            shutil.copyfile(entry_path, local_path)
+            return
+        try:
+            os.link(entry_path, local_path)
+        except OSError:
+            # another device, or a filesystem without hardlinks
+            os.symlink(entry_path, local_path)
+            pass
+        pass
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of the cached objects"""
+        entries = []
+        for root, dirs, files in os.walk(self.objects_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                pass
+            pass
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> int:
+        """drop least recently used entries until the cache fits max_bytes, returns the bytes freed"""
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                if os.stat(path).st_mtime < time.time() - TMP_MAX_AGE:
+                    os.remove(path)
+                    pass
+            except OSError:
+                pass
+            pass
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        freed = 0
+        for mtime, size, path in entries:
+            if total - freed <= self.max_bytes:
+                break
+            if os.path.basename(path) in self._in_use:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+            self.evicted += 1
+            pass
+        self.evicted_bytes += freed
+        return freed
+
+    def log_stats(self):
+        logger.info(f"input cache: {self.hits} hits ({self.hit_bytes / 1e6:.1f} MB), "
+                    f"{self.misses} misses ({self.miss_bytes / 1e6:.1f} MB downloaded), "
+                    f"evicted {self.evicted} ({self.evicted_bytes / 1e6:.1f} MB), "
+                    f"holding {self.size() / 1e6:.1f} of {self.max_bytes / 1e6:.1f} MB in {self.cache_dir}")
+        pass
+    pass
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import Callable, Dict, List, Optional
+
+import loguru
+
+from . import storage
+
+logger = loguru.logger
+
+MANIFEST_NAME = ".hq_job_inputs.json"
+
+
+def local_path_for(input_path: str, working_dir: str) -> str:
+    """where an input lands, folders (trailing /) are downloaded into the working dir itself"""
+    return os.path.join(working_dir, os.path.basename(input_path))
+
+
+def path_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+            pass
+        pass
+    return total
+
+
+class InputTransfer(object):
+    def __init__(self, input_path: str, local_path: str, required: bool):
+        self.input_path = input_path
+        self.local_path = local_path
+        self.required = required
+        self.status = "pending"     # pending / running / done / failed / cancelled
+        self.bytes = 0
+        self.seconds = 0.0
+        self.error = None
+        pass
+
+    @property
+    def throughput(self) -> float:
+        """MB/s"""
+        return self.bytes / self.seconds / 1e6 if self.seconds > 0 else 0.0
+
+    def to_dict(self) -> dict:
+        return {"input_path": self.input_path, "local_path": self.local_path, "required": self.required,
+                "status": self.status, "bytes": self.bytes, "seconds": round(self.seconds, 3),
+                "error": self.error}
+    pass
+
+
+class InputStager(object):
+    """
+    Downloads the job inputs with at most max_workers transfers at a time.
+
+    Required inputs are queued first, wait_required() returns once they are all in, so the
+    command can start while the others keep streaming. Empty `required` means every input is
+    required, like the old serial staging. Progress is kept in <working_dir>/.hq_job_inputs.json
+    for the command to poll. Bytes of folder inputs are the growth of their local dir,
+    approximate when several folders land in the same place.
+    """
+
+    def __init__(self, input_paths: List[str], working_dir: str, required: Optional[List[str]] = None,
+                 max_workers: int = 4, download: Callable[[str, str], None] = storage.download_file):
+        required = set(required or input_paths)
+        unknown = required - set(input_paths)
+        if len(unknown) > 0:
+            raise ValueError(f"required inputs {sorted(unknown)} are not in input_paths")
+        self.working_dir = working_dir
+        self.max_workers = max(1, max_workers)
+        self.download = download
+        # required first, they get the slots first
+        self.transfers = sorted(
+            [InputTransfer(p, local_path_for(p, working_dir), p in required) for p in input_paths],
+            key=lambda t: not t.required)
+        self.manifest_file = os.path.join(working_dir, MANIFEST_NAME)
+        self._futures: Dict[str, Future] = dict()
+        self._executor = None
+        self._lock = threading.Lock()
+        self._start_time = None
+        pass
+
+    def start(self) -> "InputStager":
+        self._start_time = time.time()
+        self._write_manifest()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hq_job_input")
+        for transfer in self.transfers:
+            self._futures[transfer.input_path] = self._executor.submit(self._transfer, transfer)
+            pass
+        return self
+
+    def _transfer(self, transfer: InputTransfer):
+        with self._lock:
+            transfer.status = "running"
+            pass
+        is_file = not transfer.input_path.endswith("/")
+        size_before = 0 if is_file else path_size(transfer.local_path)
+        start = time.time()
+        try:
+            self.download(transfer.input_path, transfer.local_path)
+            transfer.seconds = time.time() - start
+            transfer.bytes = max(0, path_size(transfer.local_path) - size_before)
+            transfer.status = "done"
+            logger.info(f"input {transfer.input_path}: {transfer.bytes / 1e6:.1f} MB in {transfer.seconds:.2f}s "
+                        f"({transfer.throughput:.1f} MB/s)")
+        except Exception as e:
+            transfer.seconds = time.time() - start
+            transfer.status = "failed"
+            transfer.error = str(e)
+            logger.error(f"input {transfer.input_path} failed after {transfer.seconds:.2f}s: {e}")
+        finally:
+            self._write_manifest()
+            pass
+        pass
+
+    def _write_manifest(self):
+        with self._lock:
+            content = {"inputs": [t.to_dict() for t in self.transfers],
+                       "ready": all(t.status == "done" for t in self.transfers)}
+            tmp_file = self.manifest_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(content, f, ensure_ascii=False, indent=2)
+                pass
+            os.replace(tmp_file, self.manifest_file)
+            pass
+        pass
+
+    def wait_required(self, timeout: Optional[float] = None):
+        """block until the required inputs are in, RuntimeError when one of them failed"""
+        futures = [self._futures[t.input_path] for t in self.transfers if t.required]
+        done, not_done = wait(futures, timeout=timeout)
+        if len(not_done) > 0:
+            raise TimeoutError(f"{len(not_done)} required inputs still downloading after {timeout}s")
+        failed = [t.input_path for t in self.transfers if t.required and t.status == "failed"]
+        if len(failed) > 0:
+            raise RuntimeError(f"required inputs failed: {failed}")
+        logger.info(f"required inputs ready in {time.time() - self._start_time:.2f}s")
+        pass
+
+    def close(self, cancel: bool = False) -> List[InputTransfer]:
+        """wait for the transfers, or drop those not started yet with cancel, returns the failed ones"""
+        if self._executor is None:
+            return []
+        for transfer in self.transfers:
+            if cancel and self._futures[transfer.input_path].cancel():
+                transfer.status = "cancelled"
+                pass
+            pass
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        self._write_manifest()
+        self.log_summary()
+        return [t for t in self.transfers if t.status == "failed"]
+
+    def log_summary(self):
+        total_bytes = sum(t.bytes for t in self.transfers)
+        elapsed = time.time() - self._start_time
+        counts = dict()
+        for transfer in self.transfers:
+            counts[transfer.status] = counts.get(transfer.status, 0) + 1
+            pass
+        logger.info(f"inputs: {counts}, {total_bytes / 1e6:.1f} MB in {elapsed:.2f}s "
+                    f"({total_bytes / elapsed / 1e6 if elapsed > 0 else 0.0:.1f} MB/s overall, "
+                    f"{self.max_workers} parallel)")
+        pass
+    pass
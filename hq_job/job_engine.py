@@ -1,5 +1,5 @@
 import os
-from typing import Dict
+from typing import Dict, Optional
 from . import common_utils
 import json
 
@@ -18,6 +18,14 @@ class JobDescription:
         self.priority = priority  # 任务优先级
         self.description = description  # 任务描述
         self.input_paths = input_paths
+
+        # used for local scheduling, see JobScheduler
+        self.cpu_num = 1  # CPU 槽位数
+        self.memory_size = 0  # 内存（MB）
+        self.resource_tokens = 0  # 自定义资源令牌数
+        # local log durability: fsync every N ms / N bytes, 0 disables the trigger (always fsync at exit)
+        self.log_fsync_ms = 1000
+        self.log_fsync_bytes = 4 * 1024 * 1024
         
         # 运行时信息
         self.job_id = ""  # 任务ID
@@ -33,6 +41,11 @@ class JobDescription:
         self.image = image
         self.gpu_name_set = []  # GPU 型号列表
         self.region = ""  # 区域
+        self.requirements = []  # pip 依赖，如 ["numpy<2.0.0", "opencv-python==4.8.1.78"]，启动前按需安装
+        self.required_inputs = []  # 命令启动前必须下载完成的 input_paths 子集，空表示全部
+        self.input_concurrency = 4  # 同时下载的输入数
+        self.use_input_cache = True  # 输入经容器上的缓存下载（/root/autodl-tmp/.hq_job_cache），命中时链接或复制到工作目录
+        self.output_sync_interval = 300  # 运行中每隔多少秒增量上传输出目录，<=0 只在结束时上传
 
         self.env_prefix = "HQJOB_"
         
@@ -82,6 +95,23 @@ class JobDescription:
         return job
 
 
+class LogChunk(object):
+    """a piece of a job log, pass next_offset back as offset to read on"""
+
+    def __init__(self, data: str = "", offset: int = 0, next_offset: int = 0, size: int = 0):
+        self.data = data    # 日志内容
+        self.offset = offset    # data 在日志文件中的起始字节位置
+        self.next_offset = next_offset  # 下次读取的起始位置
+        self.size = size    # 读取时日志文件的大小
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int, next_offset: int, size: int) -> "LogChunk":
+        return cls(data.decode("utf-8", errors="replace"), offset, next_offset, size)
+
+    def to_dict(self, ) -> dict:
+        return dict(self.__dict__)
+
+
 class JobEngine(object):
 
     def __init__(self,):
@@ -105,5 +135,6 @@ class JobEngine(object):
     def remove(self, job_id: int):
         pass
     
-    def log(self, job_id: int):
+    def log(self, job_id: int, offset: int = 0, max_bytes: Optional[int] = None,
+            tail_lines: Optional[int] = None) -> LogChunk:
         pass
\ No newline at end of file
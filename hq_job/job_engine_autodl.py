@@ -1,18 +1,23 @@
 
-from .job_engine import JobDescription, JobEngine
+from .job_engine import JobDescription, JobEngine, LogChunk
 from hq_job.autodl_client import AutodlClient, AutodlContainer, AutodlDeployment
 import base64
 import os
-from typing import Tuple
 from . import ssh_utils
 from . import storage
+from . import output_fetch
+from .output_fetch import FetchSummary
 import loguru
-import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 
 logger = loguru.logger
 
 DEFAULT_COS_PREFIX = "cos://ml_backend/autodl"
+# where default_command writes the job output, relative to the ssh login dir like `pid`
+DEFAULT_LOG_PATH = "job.log"
+# containers of a job stopped at a time
+STOP_WORKERS = 8
 
 class JobEngineAutodl(JobEngine):
     """
@@ -62,28 +67,57 @@ class JobEngineAutodl(JobEngine):
             logger.info(f"can't find container for job {job_uuid}, maybe job is finished")
             return
         
-        for container in containers:
-            if container.status == "running":
-                ssh_command = container.info.ssh_command
-                password = container.info.root_password
-                ssh_user, ssh_host, ssh_port = self.parse_ssh_command(ssh_command)
-                ssh_utils.execute_command("pkill -P `cat pid`", host=ssh_host, username=ssh_user, password=password, port=int(ssh_port))
-                pass
+        running = [c for c in containers if c.status == "running"]
+        if len(running) == 0:
+            return
+        # each container has its own host, the gain is running their handshakes and pkills side by side
+        with ThreadPoolExecutor(max_workers=min(len(running), STOP_WORKERS), thread_name_prefix="hq_job_stop") as executor:
+            list(executor.map(self._stop_container, running))
             pass
         pass
 
+    def _stop_container(self, container: AutodlContainer):
+        ssh_command = container.info.ssh_command
+        password = container.info.root_password
+        ssh_user, ssh_host, ssh_port = self.parse_ssh_command(ssh_command)
+        ssh_utils.execute_command("pkill -P `cat pid`", host=ssh_host, username=ssh_user, password=password, port=int(ssh_port))
+        pass
+
     def status(self, job_id: str) -> str:
         return self.autodl_client.deployment_status(job_id)
 
-    def list(self, name: str = None, page_size=10, limit=None) -> List[AutodlDeployment]:
-        return self.autodl_client.deployment_list(name=name, page_size=page_size, limit=limit)
+    def statuses(self, job_ids: List[str]) -> Dict[str, Optional[str]]:
+        return self.autodl_client.deployment_statuses(job_ids)
+
+    def list(self, name: str = None, page_size=10, limit=None, concurrency=None,
+             status: str = None) -> List[AutodlDeployment]:
+        return self.autodl_client.deployment_list(
+            name=name, page_size=page_size, limit=limit, concurrency=concurrency, status=status)
 
     def remove(self, job_uuid: str):
         return self.autodl_client.deployment_delete(job_uuid)
         pass
     
-    def log(self, job_id: int):
-        pass
+    def log(self, job_uuid: str, offset: int = 0, max_bytes: Optional[int] = None,
+            tail_lines: Optional[int] = None) -> LogChunk:
+        """
+        read the job.log of the running container over ssh, from offset or its last tail_lines lines.
+        An empty chunk when no container is running (the finished log is uploaded with the output)
+        """
+        containers = self.autodl_client.container_list(job_uuid)
+        running = [c for c in containers or [] if c.status == "running"]
+        if len(running) == 0:
+            return LogChunk(offset=offset, next_offset=offset)
+        return self.read_container_log(running[0], offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+
+    @classmethod
+    def read_container_log(cls, container: AutodlContainer, offset: int = 0, max_bytes: Optional[int] = None,
+                           tail_lines: Optional[int] = None) -> LogChunk:
+        ssh_user, ssh_host, ssh_port = cls.parse_ssh_command(container.info.ssh_command)
+        data, start, next_offset, size = ssh_utils.read_file_chunk(
+            DEFAULT_LOG_PATH, host=ssh_host, username=ssh_user, password=container.info.root_password,
+            port=int(ssh_port), offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+        return LogChunk.from_bytes(data, start, next_offset, size)
 
     def get_job_output_url(self, job_uuid: str) -> str:
         events = self.autodl_client.container_event_list(job_uuid)
@@ -110,7 +144,8 @@ class JobEngineAutodl(JobEngine):
             return False
         return any(c.status == "running" for c in containers)
 
-    def parse_ssh_command(self, ssh_command: str) -> Tuple[str, str, int]:
+    @staticmethod
+    def parse_ssh_command(ssh_command: str) -> Tuple[str, str, int]:
         # ssh -p port root@ip
         parts = ssh_command.split()
         if len(parts) != 4:
@@ -121,8 +156,10 @@ class JobEngineAutodl(JobEngine):
         return user, host, port
 
 
-    def download_job_output_from_container(self, job_uuid: str, job_desc: JobDescription, local_path: str, ignores=""):
+    def download_job_output_from_container(self, job_uuid: str, job_desc: JobDescription, local_path: str, ignores="",
+                                           sync: bool = False, max_workers: int = 4) -> Optional[FetchSummary]:
         # download output path to local path
+        # sync: only new or changed files (by size and mtime on the container), max_workers at a time
         container = self.get_job_conainter(job_uuid)
         if container is None:
             logger.info(f"can't find container for job {job_uuid}, maybe job is finished")
@@ -133,16 +170,26 @@ class JobEngineAutodl(JobEngine):
         password = container.info.root_password
         ssh_user, ssh_host, ssh_port = self.parse_ssh_command(ssh_command)
         logger.info(f"download output from {ssh_user}@{ssh_host}:{output_path} to {local_path}")
+        if sync:
+            # same layout as the tar download: <local_path>/<output dir name>/
+            target_path = os.path.join(local_path, os.path.basename(output_path.rstrip("/")))
+            return output_fetch.fetch_over_ssh(
+                output_path, target_path, host=ssh_host, username=ssh_user, password=password, port=int(ssh_port),
+                ignores=ignores, max_workers=max_workers)
         ssh_utils.download_file(output_path, local_path, host=ssh_host, username=ssh_user, password=password, port=int(ssh_port), ignores=ignores)
         logger.info(f"download output finished")
         pass
 
-    def download_job_output_from_cos(self, job_uuid: str, local_path: str):
+    def download_job_output_from_cos(self, job_uuid: str, local_path: str, sync: bool = False,
+                                     max_workers: int = 4) -> Optional[FetchSummary]:
         # download all files in job dir to local path
+        # sync: only new or changed files (by size and ETag of the listing), max_workers at a time
         url = self.get_job_output_url(job_uuid)
         if url == "":
             logger.info(f"can't find output url for job {job_uuid}, maybe job is not finished")
             return
+        if sync:
+            return output_fetch.fetch_from_cos(url, local_path, max_workers=max_workers)
         storage.download_file(url, local_path)
         pass
     
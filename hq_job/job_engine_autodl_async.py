@@ -0,0 +1,105 @@
+import asyncio
+import functools
+from typing import Dict, List, Optional
+
+import loguru
+
+from .job_engine import JobDescription, JobEngine, LogChunk
+from .job_engine_autodl import JobEngineAutodl
+from .autodl_client import AutodlDeployment
+from .autodl_client_async import AsyncAutodlClient
+from . import ssh_utils
+
+logger = loguru.logger
+
+
+class JobEngineAutodlAsync(JobEngine):
+    """
+    asyncio variant of JobEngineAutodl, used by the FastAPI server.
+    AutoDL calls go through AsyncAutodlClient, blocking SSH work runs in the default executor.
+    """
+
+    def __init__(self, token: str, host: str = "https://api.autodl.com"):
+        super().__init__()
+        self.autodl_client = AsyncAutodlClient(token=token, host=host)
+        pass
+
+    async def aclose(self):
+        await self.autodl_client.aclose()
+        pass
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+    async def run(self, job: JobDescription) -> str:
+        image_uuid = await self.autodl_client.image_name2uuid(job.image)
+
+        dc_list = None
+        if job.region:
+            dc_list = [job.region]
+
+        gpu_name_set = job.gpu_name_set if job.gpu_name_set else None
+        if image_uuid is None:
+            image = await self.autodl_client.image_latest(job.image)
+            if image is None:
+                raise RuntimeError(f"can't find image {job.image} in AutoDL")
+            image_uuid = image.image_uuid
+
+        job_uuid = await self.autodl_client.create_job_deployment(
+            name=job.name,
+            image_uuid=image_uuid,
+            cmd=JobEngineAutodl.default_command(job),
+            gpu_num=job.gpu_num,
+            gpu_name_set=gpu_name_set,
+            dc_list=dc_list,
+        )
+
+        return job_uuid
+
+    async def _stop_container(self, container):
+        ssh_user, ssh_host, ssh_port = JobEngineAutodl.parse_ssh_command(container.info.ssh_command)
+        await self._run_blocking(
+            ssh_utils.execute_command, "pkill -P `cat pid`", host=ssh_host, username=ssh_user,
+            password=container.info.root_password, port=int(ssh_port))
+        pass
+
+    async def stop(self, job_uuid: str):
+        containers = await self.autodl_client.container_list(job_uuid)
+        if containers is None or len(containers) == 0:
+            logger.info(f"can't find container for job {job_uuid}, maybe job is finished")
+            return
+
+        await asyncio.gather(*[
+            self._stop_container(container) for container in containers if container.status == "running"
+        ])
+        pass
+
+    async def status(self, job_id: str) -> Optional[str]:
+        return await self.autodl_client.deployment_status(job_id)
+
+    async def statuses(self, job_ids: List[str]) -> Dict[str, Optional[str]]:
+        return await self.autodl_client.deployment_statuses(job_ids)
+
+    async def list(self, name: str = None, page_size=10, limit=None, concurrency=None,
+                   status: str = None) -> List[AutodlDeployment]:
+        return await self.autodl_client.deployment_list(
+            name=name, page_size=page_size, limit=limit, concurrency=concurrency, status=status)
+
+    def iter_list(self, name: str = None, status: str = None, page_size=10):
+        """async iterator over deployments, newest first, fetching pages on demand"""
+        return self.autodl_client.iter_deployments(name=name, status=status, page_size=page_size)
+
+    async def remove(self, job_uuid: str):
+        return await self.autodl_client.deployment_delete(job_uuid)
+
+    async def log(self, job_uuid: str, offset: int = 0, max_bytes: Optional[int] = None,
+                  tail_lines: Optional[int] = None) -> LogChunk:
+        """read part of the running container's job.log, see JobEngineAutodl.log"""
+        containers = await self.autodl_client.container_list(job_uuid)
+        running = [c for c in containers or [] if c.status == "running"]
+        if len(running) == 0:
+            return LogChunk(offset=offset, next_offset=offset)
+        return await self._run_blocking(
+            JobEngineAutodl.read_container_log, running[0], offset=offset, max_bytes=max_bytes,
+            tail_lines=tail_lines)
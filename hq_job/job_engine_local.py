@@ -9,15 +9,26 @@ import psutil
 from datetime import datetime
 from typing import Dict, List, Optional
 
-from hq_job.job_engine import JobEngine, JobDescription
+from hq_job.job_engine import JobEngine, JobDescription, LogChunk
+from hq_job.job_registry import JobRegistry
+from hq_job.job_scheduler import JobScheduler, QUEUED
+from hq_job import file_utils, job_supervisor
+from hq_job.scripts import job_worker_entry
 
 
 class JobEngineLocal(JobEngine):
     
-    def __init__(self, jobs_dir: str = "./jobs"):
-        """init local job engine"""
+    def __init__(self, jobs_dir: str = "./jobs", cpu_slots: Optional[int] = None,
+                 memory_slots: Optional[int] = None, resource_tokens: Optional[int] = None,
+                 use_supervisor: Optional[bool] = None):
+        """
+        init local job engine. cpu_slots defaults to the CPU count and memory_slots (MB)
+        to the physical memory, resource_tokens is a free-form counted resource.
+        Slots given here are saved for the jobs_dir, the others are the saved ones.
+        Jobs are run by the jobs_dir supervisor daemon where Unix sockets are available
+        (use_supervisor=None), otherwise by one nohup'ed worker process per job
+        """
         self.jobs_dir = os.path.abspath(jobs_dir)
-        self._jobs: Dict[int, Dict] = {}
         
         log_dir = os.path.join(self.jobs_dir, "logs")
         os.makedirs(log_dir, exist_ok=True)
@@ -34,50 +45,31 @@ class JobEngineLocal(JobEngine):
         self.logger = logging.getLogger(__name__)
         
         os.makedirs(self.jobs_dir, exist_ok=True)
-        
-        self._load_jobs()
-        self._set_next_job_id()
 
-    def _load_jobs(self):
-        """scan jobs_dir, load job status from individual status files"""
-        self._jobs = {}
-        if not os.path.exists(self.jobs_dir):
-            os.makedirs(self.jobs_dir, exist_ok=True)
-        for name in os.listdir(self.jobs_dir):
-            if name.startswith("job_"):
-                try:
-                    job_id = int(name.split("_")[1])
-                except Exception:
-                    continue
-                job_dir = os.path.join(self.jobs_dir, name)
-                status_file = os.path.join(job_dir, "status.json")
-                if os.path.exists(status_file):
-                    try:
-                        with open(status_file, 'r', encoding='utf-8') as f:
-                            job_info = json.load(f)
-                            job_info['id'] = job_id
-                            # ensure all necessary fields exist
-                            job_info.setdefault('args', [])
-                            job_info.setdefault('env', {})
-                            job_info.setdefault('priority', 0)
-                            job_info.setdefault('description', '')
-                            self._jobs[job_id] = job_info
-                    except Exception as e:
-                        self.logger.error(f"load job {job_id} status error: {e}")
+        self.registry = JobRegistry(self.jobs_dir)
+        self.registry.migrate_from_dirs()
+        # read-only tools (local_job_list, local_job_stop) must not reset the capacity
+        saved = JobScheduler.from_registry(self.registry).capacity
+        self.scheduler = JobScheduler(
+            self.registry,
+            cpu_slots=cpu_slots if cpu_slots is not None else saved["cpu"],
+            memory_slots=memory_slots if memory_slots is not None else saved["memory"],
+            resource_tokens=resource_tokens if resource_tokens is not None else saved["tokens"])
+        if any(slots is not None for slots in (cpu_slots, memory_slots, resource_tokens)):
+            self.scheduler.save_config()
+        if use_supervisor is None:
+            use_supervisor = job_supervisor.supported()
+        self.supervisor = job_supervisor.SupervisorClient(self.jobs_dir) if use_supervisor else None
 
-    def _set_next_job_id(self):
-        """set next_job_id based on existing jobs"""
-        if not self._jobs:
-            self.next_job_id = 1
-        else:
-            max_job_id = max(self._jobs.keys())
-            self.next_job_id = max_job_id + 1
+    def _get_job(self, job_id: int) -> Dict:
+        """get job info from the registry"""
+        job_info = self.registry.get(job_id)
+        if job_info is None:
+            raise ValueError(f"job {job_id} not found")
+        return job_info
 
-    def _save_job_status(self, job_id: int):
+    def _save_job_status(self, job_id: int, job_info: Dict):
         """save job status to individual status.json file"""
-        job_info = self._jobs.get(job_id)
-        if not job_info:
-            return
         job_dir = self._get_job_dir(job_id)
         os.makedirs(job_dir, exist_ok=True)
         status_file = os.path.join(job_dir, "status.json")
@@ -88,12 +80,11 @@ class JobEngineLocal(JobEngine):
             self.logger.error(f"save job {job_id} status error: {e}")
 
     def _update_job_status(self, job_id: int, **kwargs):
-        """update job status and immediately save to file"""
-        if job_id not in self._jobs:
+        """update job status in the registry and its status.json file"""
+        job_info = self.registry.update(job_id, **kwargs)
+        if job_info is None:
             return
-        for key, value in kwargs.items():
-            self._jobs[job_id][key] = value
-        self._save_job_status(job_id)
+        self._save_job_status(job_id, job_info)
 
     def _get_job_dir(self, job_id: int) -> str:
         """get job dir"""
@@ -104,41 +95,48 @@ class JobEngineLocal(JobEngine):
         return os.path.join(self._get_job_dir(job_id), f"job_{job_id}.log")
 
     def run(self, job: JobDescription) -> int:
-        """run job"""
-        job_id = self.next_job_id
-        self.next_job_id += 1
+        """queue job, it starts as soon as the scheduler admits it"""
+        # save job info
+        job_info = job.to_dict()
+        job_info['status'] = QUEUED
+        job_info['submit_time'] = datetime.now().isoformat()
+        job_info['start_time'] = None
+        # where and how the job would have been started by this process, the supervisor or
+        # the process that admits it later doesn't share env, cwd or interpreter with it.
+        # Only an allow-list of the env is saved, the supervisor gets all of it in memory
+        job_info['launch'] = {'env': job_worker_entry.launch_env(os.environ), 'cwd': os.getcwd(),
+                              'python': sys.executable}
+        self.scheduler.check(job_info)
+        job_id = self.registry.create(job_info)
         job.job_id = job_id
+        job_info['job_id'] = job_id
+        self.registry.put(job_id, job_info)
         job_dir = self._get_job_dir(job_id)
         os.makedirs(job_dir, exist_ok=True)
-        # save job info
-        job_info = job.to_dict()
-        job_info['status'] = 'pending'
-        job_info['start_time'] = datetime.now().isoformat()
-        self._jobs[job_id] = job_info
-        self._save_job_status(job_id)
-
-        worker_script = os.path.join(os.path.dirname(__file__), 'scripts', 'job_worker_entry.py')
-        python_exe = sys.executable 
-        self.logger.info(f"python_exe: {python_exe}")
-        self.logger.info(f"worker_script: {worker_script}")
+        self._save_job_status(job_id, job_info)
         self.logger.info(f"job_dir: {job_dir}")
         self.logger.info(f"job_id: {job_id}")
-        if sys.platform == 'win32':
-            cmd = f'start /B "" "{python_exe}" "{worker_script}" "{job_dir}" "{job_id}"'
-            os.system(cmd)
-        else:
-            cmd = f'nohup "{python_exe}" "{worker_script}" "{job_dir}" "{job_id}" > /dev/null 2>&1 &'
-            os.system(cmd)
 
+        self._schedule(job_id)
         return job_id
 
+    def _schedule(self, job_id: Optional[int] = None):
+        """start queued jobs that fit, through the supervisor when there is one"""
+        if self.supervisor is not None:
+            self.supervisor.ensure_running()
+            # the whole env of a new job goes to the supervisor in memory only, it isn't saved
+            kwargs = {"job_id": job_id, "env": dict(os.environ)} if job_id is not None else {}
+            self.supervisor.request("schedule", **kwargs)
+        else:
+            self.scheduler.schedule()
+
+    def metrics(self) -> Dict:
+        """scheduler metrics: queue depth, active jobs, used / total slots and wait times"""
+        return self.scheduler.metrics()
+
     def execute(self, job_id: int, command: str):
         """execute command in job"""
-        self._load_jobs()
-        if job_id not in self._jobs:
-            raise ValueError(f"job {job_id} not found")
-        
-        job_info = self._jobs[job_id]
+        job_info = self._get_job(job_id)
         if job_info['status'] != 'running':
             raise ValueError(f"job {job_id} is not running")
         
@@ -187,10 +185,15 @@ class JobEngineLocal(JobEngine):
 
     def stop(self, job_id: int):
         """stop job"""
-        self._load_jobs()
-        if job_id not in self._jobs:
-            raise ValueError(f"job {job_id} not found")
-        job_info = self._jobs[job_id]
+        job_info = self._get_job(job_id)
+        if self.supervisor is not None and job_info['status'] in [QUEUED, 'pending', 'running', 'postprocessing'] \
+                and self.supervisor.ping():
+            # the supervisor owns the process group, jobs it doesn't know fall through to the pid kill
+            if self.supervisor.request("stop", job_id=job_id)["ok"]:
+                return True
+        if job_info['status'] == QUEUED:
+            self._update_job_status(job_id, status='stopped', end_time=datetime.now().isoformat())
+            return True
         if job_info['status'] not in ['running', 'postprocessing']:
             raise ValueError(f"job {job_id} is not running or postprocessing")
         try:
@@ -210,11 +213,13 @@ class JobEngineLocal(JobEngine):
                 if psutil.pid_exists(pid):
                     raise RuntimeError(f"failed to kill process {pid}")
             time.sleep(1)
-            self._update_job_status(job_id, status='stopped', end_time=datetime.now().isoformat())
+            end_time = datetime.now().isoformat()
+            self._update_job_status(job_id, status='stopped', end_time=end_time)
             log_file = self._get_log_file(job_id)
             with open(log_file, 'a', encoding='utf-8') as f:
                 f.write(f"\njob {job_id} stopped by user\n")
-                f.write(f"stop time: {self._jobs[job_id]['end_time']}\n")
+                f.write(f"stop time: {end_time}\n")
+            self._schedule()
             return True
         except Exception as e:
             self.logger.error(f"stop job {job_id} error: {e}")
@@ -222,14 +227,13 @@ class JobEngineLocal(JobEngine):
 
     def status(self, job_id: int) -> str:
         """get job status"""
-        self._load_jobs()
-        if job_id not in self._jobs:
+        status = self.registry.status(job_id)
+        if status is None:
             raise ValueError(f"job {job_id} not found")
-        return self._jobs[job_id]['status']
+        return status
 
-    def list(self) -> List[Dict]:
-        """list all jobs"""
-        self._load_jobs()
+    def list(self, status: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """list jobs newest first, optionally only those in one status"""
         return [
             {
                 'id': job_id,
@@ -240,44 +244,46 @@ class JobEngineLocal(JobEngine):
                 'priority': info.get('priority', 0),
                 'working_dir': info.get('working_dir'),
                 'output_dir': info.get('output_dir'),
+                'submit_time': info.get('submit_time'),
                 'start_time': info.get('start_time'),
                 'end_time': info.get('end_time'),
                 'exit_code': info.get('exit_code'),
                 'pid': info.get('pid'),
                 'error_message': info.get('error_message')
             }
-            for job_id, info in sorted(self._jobs.items(), key=lambda x: x[0], reverse=True)
+            for job_id, info in ((info['id'], info) for info in self.registry.list(status=status, limit=limit))
         ]
 
     def remove(self, job_id: int):
-        self._load_jobs()
-        if job_id not in self._jobs:
-            raise ValueError(f"job {job_id} not found")
+        job_info = self._get_job(job_id)
         # stop job if running
-        if self._jobs[job_id]['status'] in ['running', 'postprocessing']:
+        if job_info['status'] in ['running', 'postprocessing']:
             raise ValueError(f"job {job_id} is running or postprocessing")
         # remove output dir
-        job_info = self._jobs[job_id]
         output_dir = job_info.get('output_dir')
         if output_dir:
             shutil.rmtree(output_dir, ignore_errors=True)
         self.logger.info(f"remove job {job_id} output dir: {output_dir}")
 
-    def log(self, job_id: int) -> str:
-        """get job log"""
-        self._load_jobs()
-        if job_id not in self._jobs:
-            return f"job {job_id} not found"
-        
+    def log(self, job_id: int, offset: int = 0, max_bytes: Optional[int] = None,
+            tail_lines: Optional[int] = None) -> LogChunk:
+        """
+        read job log from offset, at most max_bytes (None reads to the end), or its last
+        tail_lines lines. Only the requested range is read, the file is never loaded whole
+        """
+        if self.registry.status(job_id) is None:
+            raise ValueError(f"job {job_id} not found")
+
         log_file = self._get_log_file(job_id)
         if not os.path.exists(log_file):
-            return f"job {job_id} log file not found"
-        
-        try:
-            with open(log_file, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            return f"read job {job_id} log error: {e}"
+            # not started yet
+            return LogChunk()
+
+        with open(log_file, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            data, start, next_offset = file_utils.read_chunk(
+                f, size, offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+        return LogChunk.from_bytes(data, start, next_offset, size)
 
 
 class ConsoleAndFileHandler(logging.Handler):
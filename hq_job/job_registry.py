@@ -0,0 +1,229 @@
+import os
+import json
+import sqlite3
+import threading
+from typing import List, Optional
+
+import loguru
+
+logger = loguru.logger
+
+DB_NAME = "jobs.db"
+SCHEMA_VERSION = 1
+
+# fields kept in their own columns so lookups and listings can use indexes,
+# the whole job info is stored as json in `info`
+INDEXED_FIELDS = ("name", "status", "priority", "start_time", "end_time")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    name TEXT,
+    status TEXT,
+    priority INTEGER,
+    start_time TEXT,
+    end_time TEXT,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_start_time ON jobs (start_time);
+CREATE TABLE IF NOT EXISTS registry_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class JobRegistry(object):
+    """
+    SQLite (WAL mode) index of local jobs under jobs_dir, shared by JobEngineLocal
+    and the job worker processes.
+
+    Point lookups go through the primary key and listings through the status / start_time
+    indexes, so nothing has to rescan the job_* directories. status.json files are still
+    written next to each job, existing ones are imported once by migrate_from_dirs.
+    """
+
+    def __init__(self, jobs_dir: str, timeout: float = 30.0):
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.db_path = os.path.join(self.jobs_dir, DB_NAME)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+        pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            pass
+        pass
+
+    # ------------------------------------------------------------------
+    # writes
+    # ------------------------------------------------------------------
+
+    def transaction(self, op):
+        """
+        run op(conn) in one write transaction and return its result. BEGIN IMMEDIATE takes the
+        write lock up front, so a read-modify-write can't interleave with another process
+        """
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = op(self._conn)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+    @staticmethod
+    def _row_values(job_id: int, info: dict) -> tuple:
+        return (job_id,) + tuple(info.get(k) for k in INDEXED_FIELDS) + (json.dumps(info, ensure_ascii=False),)
+
+    def create(self, info: dict) -> int:
+        """insert a new job with the next free id, returns the id"""
+        def op(conn):
+            row = conn.execute("SELECT MAX(id) FROM jobs").fetchone()
+            job_id = (row[0] or 0) + 1
+            info["id"] = job_id
+            conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)", self._row_values(job_id, info))
+            return job_id
+        return self.transaction(op)
+
+    def put(self, job_id: int, info: dict):
+        """insert or replace a job"""
+        info = dict(info, id=job_id)
+        self.transaction(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)", self._row_values(job_id, info)))
+        pass
+
+    def update(self, job_id: int, **kwargs) -> Optional[dict]:
+        """merge fields into a job, returns the updated info or None if the job is unknown"""
+        def op(conn):
+            row = conn.execute("SELECT info FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            info = json.loads(row["info"])
+            info.update(kwargs)
+            conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)", self._row_values(job_id, info))
+            return info
+        return self.transaction(op)
+
+    def delete(self, job_id: int):
+        self.transaction(lambda conn: conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)))
+        pass
+
+    # ------------------------------------------------------------------
+    # reads
+    # ------------------------------------------------------------------
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, job_id: int) -> Optional[dict]:
+        rows = self._query("SELECT info FROM jobs WHERE id = ?", (job_id,))
+        if len(rows) == 0:
+            return None
+        return json.loads(rows[0]["info"])
+
+    def status(self, job_id: int) -> Optional[str]:
+        rows = self._query("SELECT status FROM jobs WHERE id = ?", (job_id,))
+        if len(rows) == 0:
+            return None
+        return rows[0]["status"]
+
+    def list(self, status: Optional[str] = None, started_after: Optional[str] = None,
+             started_before: Optional[str] = None, limit: Optional[int] = None) -> List[dict]:
+        """jobs newest first, times are isoformat strings as stored in start_time"""
+        where = []
+        params = []
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+            pass
+        if started_after is not None:
+            where.append("start_time >= ?")
+            params.append(started_after)
+            pass
+        if started_before is not None:
+            where.append("start_time < ?")
+            params.append(started_before)
+            pass
+        sql = "SELECT info FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+            pass
+        sql += " ORDER BY id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+            pass
+        return [json.loads(row["info"]) for row in self._query(sql, tuple(params))]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        rows = self._query("SELECT value FROM registry_meta WHERE key = ?", (key,))
+        if len(rows) == 0:
+            return None
+        return rows[0]["value"]
+
+    def set_meta(self, key: str, value: str):
+        self.transaction(lambda conn: conn.execute("INSERT OR REPLACE INTO registry_meta VALUES (?, ?)", (key, value)))
+        pass
+
+    def count(self, status: Optional[str] = None) -> int:
+        if status is None:
+            return self._query("SELECT COUNT(*) FROM jobs")[0][0]
+        return self._query("SELECT COUNT(*) FROM jobs WHERE status = ?", (status,))[0][0]
+
+    # ------------------------------------------------------------------
+    # migration
+    # ------------------------------------------------------------------
+
+    def migrate_from_dirs(self, force: bool = False) -> int:
+        """
+        import job_*/status.json files written before the registry existed,
+        runs once per jobs_dir unless force, returns the number of imported jobs
+        """
+        if not force and self.get_meta("migrated") is not None:
+            return 0
+        imported = 0
+        for name in os.listdir(self.jobs_dir):
+            if not name.startswith("job_"):
+                continue
+            try:
+                job_id = int(name.split("_")[1])
+            except Exception:
+                continue
+            status_file = os.path.join(self.jobs_dir, name, "status.json")
+            if not os.path.exists(status_file):
+                continue
+            try:
+                with open(status_file, 'r', encoding='utf-8') as f:
+                    info = json.load(f)
+                    pass
+            except Exception as e:
+                logger.error(f"migrate job {job_id} status error: {e}")
+                continue
+            info['id'] = job_id
+            info.setdefault('args', [])
+            info.setdefault('env', {})
+            info.setdefault('priority', 0)
+            info.setdefault('description', '')
+            self.transaction(lambda conn: conn.execute(
+                "INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)", self._row_values(job_id, info)))
+            imported += 1
+            pass
+        self.transaction(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO registry_meta VALUES ('migrated', datetime('now'))"))
+        if imported > 0:
+            logger.info(f"imported {imported} jobs from {self.jobs_dir} into {self.db_path}")
+            pass
+        return imported
+    pass
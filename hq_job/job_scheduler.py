@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import loguru
+import psutil
+
+from .job_registry import JobRegistry
+
+logger = loguru.logger
+
+QUEUED = "queued"
+# admitted jobs hold their slots until they leave these states
+ACTIVE_STATUSES = ("pending", "running", "postprocessing")
+# resource -> (job field, default request of a job)
+RESOURCES = {
+    "cpu": ("cpu_num", 1),
+    "memory": ("memory_size", 0),
+    "tokens": ("resource_tokens", 0),
+}
+CONFIG_KEY = "scheduler"
+# admitted jobs looked at for the average wait time
+WAIT_WINDOW = 100
+
+
+def job_request(job_info: dict) -> Dict[str, int]:
+    """resources a job asks for"""
+    return {name: int(job_info.get(field) or default) for name, (field, default) in RESOURCES.items()}
+
+
+def spawn_worker(job_dir: str, job_id: int):
+    """start scripts/job_worker_entry.py for one job in the background"""
+    worker_script = os.path.join(os.path.dirname(__file__), 'scripts', 'job_worker_entry.py')
+    # the interpreter of the submitter, the scheduling process may be another job's worker
+    python_exe = sys.executable
+    try:
+        with open(os.path.join(job_dir, 'status.json'), 'r', encoding='utf-8') as f:
+            python_exe = (json.load(f).get('launch') or {}).get('python') or python_exe
+            pass
+    except (OSError, ValueError):
+        pass
+    if sys.platform == 'win32':
+        cmd = f'start /B "" "{python_exe}" "{worker_script}" "{job_dir}" "{job_id}"'
+        os.system(cmd)
+    else:
+        cmd = f'nohup "{python_exe}" "{worker_script}" "{job_dir}" "{job_id}" > /dev/null 2>&1 &'
+        os.system(cmd)
+        pass
+    pass
+
+
+class JobScheduler(object):
+    """
+    Priority queue with admission control for local jobs.
+
+    Submitted jobs wait in status `queued`. They are admitted by priority (higher first),
+    then submit order, as long as their cpu_num / memory_size (MB) / resource_tokens fit in
+    what the active jobs leave free. The head of the queue is never skipped, so a large
+    job can't be starved by a stream of small ones, queued jobs larger than the whole
+    capacity (after it was lowered) fail instead.
+
+    All state lives in the JobRegistry and admission runs in one registry transaction,
+    so the engine (on submit) and job workers (on exit) can both call schedule().
+    """
+
+    def __init__(self, registry: JobRegistry, cpu_slots: Optional[int] = None, memory_slots: Optional[int] = None,
+                 resource_tokens: int = 0, launcher: Optional[Callable[[str, int], None]] = None):
+        self.registry = registry
+        self.capacity = {
+            "cpu": cpu_slots if cpu_slots is not None else (os.cpu_count() or 1),
+            "memory": memory_slots if memory_slots is not None else psutil.virtual_memory().total // (1024 * 1024),
+            "tokens": resource_tokens,
+        }
+        self.launcher = launcher if launcher is not None else spawn_worker
+        pass
+
+    def save_config(self):
+        """persist capacity so job workers schedule with the same limits"""
+        self.registry.set_meta(CONFIG_KEY, json.dumps(self.capacity))
+        pass
+
+    @classmethod
+    def from_registry(cls, registry: JobRegistry, launcher=None) -> "JobScheduler":
+        config = registry.get_meta(CONFIG_KEY)
+        capacity = json.loads(config) if config else {}
+        return cls(registry, cpu_slots=capacity.get("cpu"), memory_slots=capacity.get("memory"),
+                   resource_tokens=capacity.get("tokens", 0), launcher=launcher)
+
+    # ------------------------------------------------------------------
+    # admission
+    # ------------------------------------------------------------------
+
+    def check(self, job_info: dict):
+        """reject jobs that could never be admitted"""
+        request = job_request(job_info)
+        for name, amount in request.items():
+            if amount > self.capacity[name]:
+                raise ValueError(f"job asks for {amount} {name} but the scheduler only has {self.capacity[name]}")
+            pass
+        pass
+
+    @staticmethod
+    def _load(conn, statuses) -> List[dict]:
+        marks = ", ".join("?" for _ in statuses)
+        rows = conn.execute(f"SELECT info FROM jobs WHERE status IN ({marks})", tuple(statuses)).fetchall()
+        return [json.loads(row["info"]) for row in rows]
+
+    def _used(self, active: List[dict]) -> Dict[str, int]:
+        used = {name: 0 for name in RESOURCES}
+        for job_info in active:
+            for name, amount in job_request(job_info).items():
+                used[name] += amount
+                pass
+            pass
+        return used
+
+    def _admit(self, conn) -> List[int]:
+        used = self._used(self._load(conn, ACTIVE_STATUSES))
+        queue = sorted(self._load(conn, (QUEUED,)), key=lambda j: (-int(j.get("priority") or 0), j["id"]))
+        admitted = []
+        for job_info in queue:
+            request = job_request(job_info)
+            too_big = [name for name, amount in request.items() if amount > self.capacity[name]]
+            if len(too_big) > 0:
+                # queued before the capacity was lowered, it would hold the head of the queue forever
+                job_info["status"] = "failed"
+                job_info["end_time"] = datetime.now().isoformat()
+                job_info["error_message"] = "job asks for more than the scheduler has: " + ", ".join(
+                    f"{request[name]} {name} > {self.capacity[name]}" for name in too_big)
+                conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             JobRegistry._row_values(job_info["id"], job_info))
+                logger.warning(f"reject job {job_info['id']}: {job_info['error_message']}")
+                continue
+            if any(used[name] + amount > self.capacity[name] for name, amount in request.items()):
+                break
+            for name, amount in request.items():
+                used[name] += amount
+                pass
+            job_info["status"] = "pending"
+            job_info["start_time"] = datetime.now().isoformat()
+            conn.execute("INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         JobRegistry._row_values(job_info["id"], job_info))
+            admitted.append(job_info["id"])
+            pass
+        return admitted
+
+    def schedule(self) -> List[int]:
+        """admit as many queued jobs as fit and launch them, returns their ids"""
+        admitted = self.registry.transaction(self._admit)
+        for job_id in admitted:
+            logger.info(f"admit job {job_id}")
+            self.launcher(os.path.join(self.registry.jobs_dir, f"job_{job_id}"), job_id)
+            pass
+        return admitted
+
+    # ------------------------------------------------------------------
+    # metrics
+    # ------------------------------------------------------------------
+
+    def metrics(self) -> dict:
+        now = datetime.now()
+        queued = self.registry.list(status=QUEUED)
+        active = []
+        for status in ACTIVE_STATUSES:
+            active.extend(self.registry.list(status=status))
+            pass
+
+        waits = [(now - datetime.fromisoformat(j["submit_time"])).total_seconds()
+                 for j in queued if j.get("submit_time")]
+        admitted_waits = []
+        # started_after="" skips jobs that have no start_time yet
+        for job_info in self.registry.list(started_after="", limit=WAIT_WINDOW):
+            if job_info.get("submit_time") and job_info.get("start_time"):
+                admitted_waits.append((datetime.fromisoformat(job_info["start_time"])
+                                       - datetime.fromisoformat(job_info["submit_time"])).total_seconds())
+                pass
+            pass
+        return {
+            "queue_depth": len(queued),
+            "active": len(active),
+            "capacity": dict(self.capacity),
+            "used": self._used(active),
+            "oldest_wait_seconds": max(waits) if waits else 0.0,
+            "avg_wait_seconds": sum(admitted_waits) / len(admitted_waits) if admitted_waits else 0.0,
+        }
+    pass
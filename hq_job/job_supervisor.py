@@ -0,0 +1,371 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import hashlib
+import tempfile
+import threading
+import subprocess
+import socketserver
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import loguru
+
+from .job_registry import JobRegistry
+from .job_scheduler import ACTIVE_STATUSES, QUEUED, JobScheduler
+from .scripts import job_worker_entry as worker
+
+logger = loguru.logger
+
+SOCKET_NAME = "supervisor.sock"
+LOCK_NAME = "supervisor.lock"
+# AF_UNIX paths are limited to about 108 bytes
+MAX_SOCKET_PATH = 100
+
+
+def socket_path(jobs_dir: str) -> str:
+    path = os.path.join(os.path.abspath(jobs_dir), SOCKET_NAME)
+    if len(path) > MAX_SOCKET_PATH:
+        digest = hashlib.sha1(os.path.abspath(jobs_dir).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(tempfile.gettempdir(), f"hq_job_{digest}.sock")
+        pass
+    return path
+
+
+def supported() -> bool:
+    return sys.platform != "win32" and hasattr(socket, "AF_UNIX")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                resp = self.server.supervisor.handle(json.loads(line))
+            except Exception as e:
+                logger.exception(f"supervisor request failed: {e}")
+                resp = {"ok": False, "error": str(e)}
+                pass
+            self.wfile.write((json.dumps(resp) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            pass
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class JobSupervisor(object):
+    """
+    One long-lived process per jobs_dir that owns the local jobs.
+
+    JobEngineLocal talks to it over a Unix socket with newline-delimited json requests.
+    It hosts the JobScheduler, starts admitted jobs directly with subprocess (no worker
+    interpreter per job), keeps the Popen handles, so pids, stop and exit codes are
+    authoritative, and reschedules whenever a job ends. It exits after idle_timeout
+    seconds without running or queued jobs, the engine starts it again on demand.
+    """
+
+    def __init__(self, jobs_dir: str, idle_timeout: float = 600.0):
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.socket_path = socket_path(self.jobs_dir)
+        self.idle_timeout = idle_timeout
+        self.registry = JobRegistry(self.jobs_dir)
+        self._processes: Dict[int, subprocess.Popen] = dict()
+        # jobs between admission and their Popen handle, see stop_job
+        self._launching = set()
+        # env of the submitters of queued jobs, kept in memory only
+        self._envs: Dict[int, dict] = dict()
+        self._lock = threading.Lock()
+        self._schedule_lock = threading.Lock()
+        self._server = None
+        self._last_busy = time.time()
+        pass
+
+    # ------------------------------------------------------------------
+    # jobs
+    # ------------------------------------------------------------------
+
+    def _job_dir(self, job_id: int) -> str:
+        return os.path.join(self.jobs_dir, f"job_{job_id}")
+
+    def schedule(self) -> List[int]:
+        # the capacity is read on every call, the engine may have changed it
+        with self._schedule_lock:
+            return JobScheduler.from_registry(self.registry, launcher=self._launch).schedule()
+
+    def _launch(self, job_dir: str, job_id: int):
+        self.registry.update(job_id, supervised=True)
+        threading.Thread(target=self._run, args=(job_dir, job_id), daemon=True).start()
+        pass
+
+    def _run(self, job_dir: str, job_id: int):
+        registry = self.registry
+        try:
+            job_info = worker.load_job(registry, job_dir, job_id)
+            with self._lock:
+                submitter_env = self._envs.pop(job_id, None)
+                if registry.status(job_id) == "stopped":
+                    return
+                # from here on a stop is left to this thread, see stop_job
+                self._launching.add(job_id)
+                worker.update_status(registry, job_dir, job_id, status="running")
+                pass
+            command_str, working_dir, env = worker.prepare_job(job_dir, job_info, submitter_env)
+            log_file = os.path.join(job_dir, f"job_{job_id}.log")
+            with open(log_file, "w", encoding="utf-8", buffering=1) as f:
+                worker.write_log_header(f, job_id, job_info, command_str, working_dir)
+                process = worker.start_job_process(command_str, working_dir, env)
+                with self._lock:
+                    self._processes[job_id] = process
+                    self._launching.discard(job_id)
+                    stopped = registry.status(job_id) == "stopped"
+                    pass
+                worker.update_status(registry, job_dir, job_id, pid=process.pid)
+                if stopped:
+                    # stopped while it was being started
+                    self._kill(process)
+                    f.write(f"\njob {job_id} stopped by user\n")
+                    pass
+                return_code = worker.pump_output(process, f, **worker.log_policy(job_info))
+                pass
+            worker.finish_job(registry, job_dir, job_id, job_info, return_code)
+        except Exception as e:
+            logger.exception(f"job {job_id} failed in supervisor: {e}")
+            worker.fail_job(registry, job_dir, job_id, e)
+        finally:
+            with self._lock:
+                self._processes.pop(job_id, None)
+                self._launching.discard(job_id)
+                self._last_busy = time.time()
+                pass
+            self.schedule()
+            pass
+        pass
+
+    @staticmethod
+    def _kill(process: subprocess.Popen):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait(timeout=10)
+        pass
+
+    def stop_job(self, job_id: int) -> bool:
+        job_dir = self._job_dir(job_id)
+        end_time = datetime.now().isoformat()
+        # under the lock _run sees the stop either before it starts the job or right after
+        with self._lock:
+            status = self.registry.status(job_id)
+            process = self._processes.get(job_id)
+            if status in (QUEUED, "pending") or (process is None and job_id in self._launching):
+                # not started yet, _run skips it or kills it as soon as it has a process
+                self._envs.pop(job_id, None)
+                worker.update_status(self.registry, job_dir, job_id, status="stopped", end_time=end_time)
+                return True
+            if process is None:
+                return False
+            # mark it first, so finish_job keeps `stopped` instead of reporting a failure
+            worker.update_status(self.registry, job_dir, job_id, status="stopped", end_time=end_time)
+            pass
+        self._kill(process)
+        with open(os.path.join(job_dir, f"job_{job_id}.log"), "a", encoding="utf-8") as f:
+            f.write(f"\njob {job_id} stopped by user\n")
+            f.write(f"stop time: {end_time}\n")
+            pass
+        return True
+
+    def reconcile(self):
+        """jobs a previous supervisor was running can't be followed anymore, fail them"""
+        for status in ACTIVE_STATUSES:
+            for job_info in self.registry.list(status=status):
+                if not job_info.get("supervised"):
+                    continue
+                pid = job_info.get("pid")
+                if pid:
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except (ProcessLookupError, PermissionError):
+                        pass
+                    pass
+                worker.fail_job(self.registry, self._job_dir(job_info["id"]), job_info["id"],
+                                "lost by a supervisor restart")
+                pass
+            pass
+        pass
+
+    # ------------------------------------------------------------------
+    # requests
+    # ------------------------------------------------------------------
+
+    def handle(self, req: dict) -> dict:
+        op = req.get("op")
+        with self._lock:
+            self._last_busy = time.time()
+            pass
+        if op == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        elif op == "schedule":
+            # a job admitted before its env arrives runs with the saved allow-list, see launch_env
+            if req.get("job_id") is not None and req.get("env") is not None:
+                with self._lock:
+                    self._envs[int(req["job_id"])] = req["env"]
+                    pass
+                pass
+            return {"ok": True, "admitted": self.schedule()}
+        elif op == "stop":
+            return {"ok": self.stop_job(int(req["job_id"]))}
+        elif op == "jobs":
+            with self._lock:
+                return {"ok": True, "jobs": {str(k): p.pid for k, p in self._processes.items()}}
+        elif op == "shutdown":
+            with self._lock:
+                job_ids = list(self._processes.keys())
+                pass
+            for job_id in job_ids:
+                self.stop_job(job_id)
+                pass
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {"ok": True}
+        return {"ok": False, "error": f"unknown op {op}"}
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+
+    def _idle(self) -> bool:
+        with self._lock:
+            if len(self._processes) > 0 or time.time() - self._last_busy < self.idle_timeout:
+                return False
+            pass
+        return self.registry.count(status=QUEUED) == 0
+
+    def _watch_idle(self):
+        while self._server is not None:
+            time.sleep(1.0)
+            if self.idle_timeout > 0 and self._idle():
+                logger.info("supervisor idle, exiting")
+                self.shutdown()
+                break
+            pass
+        pass
+
+    def serve_forever(self):
+        import fcntl
+        lock_file = open(os.path.join(self.jobs_dir, LOCK_NAME), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            logger.info(f"another supervisor already serves {self.jobs_dir}")
+            lock_file.close()
+            return
+        try:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+                pass
+            self._server = _Server(self.socket_path, _Handler)
+            self._server.supervisor = self
+            self.reconcile()
+            self.schedule()
+            threading.Thread(target=self._watch_idle, daemon=True).start()
+            logger.info(f"supervisor {os.getpid()} serving {self.jobs_dir} on {self.socket_path}")
+            self._server.serve_forever()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+                pass
+            lock_file.close()
+            pass
+        pass
+
+    def shutdown(self):
+        server, self._server = self._server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            pass
+        pass
+    pass
+
+
+class SupervisorClient(object):
+    """talks to the supervisor of a jobs_dir, starting it when it isn't running"""
+
+    def __init__(self, jobs_dir: str, timeout: float = 10.0):
+        self.jobs_dir = os.path.abspath(jobs_dir)
+        self.socket_path = socket_path(self.jobs_dir)
+        self.timeout = timeout
+        pass
+
+    def request(self, op: str, **kwargs) -> dict:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall((json.dumps(dict(kwargs, op=op)) + "\n").encode("utf-8"))
+            data = b""
+            while not data.endswith(b"\n"):
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+                pass
+            pass
+        if not data:
+            raise ConnectionError(f"supervisor at {self.socket_path} closed the connection")
+        return json.loads(data)
+
+    def ping(self) -> bool:
+        try:
+            return self.request("ping").get("ok", False)
+        except (OSError, ValueError):
+            return False
+
+    def ensure_running(self):
+        if self.ping():
+            return
+        log_dir = os.path.join(self.jobs_dir, "logs")
+        os.makedirs(log_dir, exist_ok=True)
+        env = os.environ.copy()
+        # importable from a source checkout too
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (package_root, env.get("PYTHONPATH")) if p)
+        with open(os.path.join(log_dir, "supervisor.log"), "a") as log:
+            subprocess.Popen([sys.executable, "-m", "hq_job.job_supervisor", self.jobs_dir],
+                             stdin=subprocess.DEVNULL, stdout=log, stderr=log, env=env,
+                             start_new_session=True, close_fds=True)
+            pass
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            if self.ping():
+                return
+            time.sleep(0.05)
+            pass
+        raise RuntimeError(f"supervisor for {self.jobs_dir} didn't start, see {log_dir}/supervisor.log")
+
+    def shutdown(self):
+        """stop the supervisor, jobs it still runs are stopped too"""
+        if not self.ping():
+            return
+        try:
+            self.request("shutdown")
+        except (OSError, ValueError):
+            # it may exit before the answer is written
+            pass
+        pass
+    pass
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python -m hq_job.job_supervisor <jobs_dir> [idle_timeout]")
+        sys.exit(1)
+    idle_timeout = float(sys.argv[2]) if len(sys.argv) > 2 else 600.0
+    JobSupervisor(sys.argv[1], idle_timeout=idle_timeout).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import time
+import fnmatch
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+
+import loguru
+
+logger = loguru.logger
+
+# what was fetched into a local dir, per relative path: the remote etag and the local size/mtime after the download.
+# Kept out of the dir itself, one file per dir under the state dir, named by a hash of the dir path
+DEFAULT_STATE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hq_job", "fetch")
+# where older versions kept the state, inside the local dir, taken over on the next fetch
+LEGACY_STATE_NAME = ".hq_job_fetch.json"
+PART_SUFFIX = ".hq_job_part"
+
+
+def file_md5(path: str, block_size: int = 1024 * 1024) -> str:
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+            pass
+        pass
+    return h.hexdigest()
+
+
+class RemoteFile(object):
+    """a file of a remote listing, etag is whatever changes with its content (COS ETag, size + mtime)"""
+
+    def __init__(self, path: str, size: int, etag: str):
+        self.path = path    # relative to the remote dir, / separated
+        self.size = size
+        self.etag = etag
+        pass
+    pass
+
+
+class FetchSummary(object):
+    def __init__(self):
+        self.transferred = 0
+        self.transferred_bytes = 0
+        self.skipped = 0
+        self.skipped_bytes = 0
+        self.failed: List[str] = []
+        self.seconds = 0.0
+        pass
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+
+    def __repr__(self) -> str:
+        return (f"{self.transferred} files ({self.transferred_bytes / 1e6:.1f} MB) transferred, "
+                f"{self.skipped} unchanged ({self.skipped_bytes / 1e6:.1f} MB) skipped, "
+                f"{len(self.failed)} failed in {self.seconds:.2f}s")
+    pass
+
+
+class DeltaFetcher(object):
+    """
+    Brings a local dir up to date with a remote listing, transferring only new and changed files.
+
+    A file is unchanged when the local state (in state_dir, see DEFAULT_STATE_DIR) says it was fetched
+    with the remote etag and the local copy still has the size and mtime it got then. Files
+    without state that have the remote size are passed to same_content, which returns the
+    ones whose content matches (by a hash), so a dir fetched the old way is not downloaded
+    again. Downloads run max_workers at a time into a part file renamed when complete.
+    Local files missing from the listing are left alone.
+    """
+
+    def __init__(self, local_dir: str, max_workers: int = 4, ignores: str = "", state_dir: Optional[str] = None):
+        self.local_dir = local_dir
+        self.max_workers = max(1, max_workers)
+        # a glob like the --exclude of the tar download, matched against the path and the file name
+        self.ignores = [ignores] if ignores else []
+        self.state_dir = state_dir or os.environ.get("HQJOB_FETCH_STATE_DIR", DEFAULT_STATE_DIR)
+        key = hashlib.sha256(os.path.abspath(local_dir).encode("utf-8")).hexdigest()[:32]
+        self.state_file = os.path.join(self.state_dir, f"{key}.json")
+        self.legacy_state_file = os.path.join(local_dir, LEGACY_STATE_NAME)
+        self.state: Dict[str, dict] = dict()
+        self._lock = threading.Lock()
+        pass
+
+    def _load_state(self):
+        self.state = dict()
+        for state_file in [self.state_file, self.legacy_state_file]:
+            try:
+                with open(state_file, "r", encoding="utf-8") as f:
+                    self.state = json.load(f)
+                    pass
+                return
+            except (OSError, ValueError):
+                pass
+            pass
+        pass
+
+    def _save_state(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with self._lock:
+            tmp_file = self.state_file + ".tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+                pass
+            os.replace(tmp_file, self.state_file)
+            pass
+        if os.path.exists(self.legacy_state_file):
+            os.remove(self.legacy_state_file)
+            pass
+        pass
+
+    def local_path(self, remote_file: RemoteFile) -> str:
+        return os.path.join(self.local_dir, *remote_file.path.split("/"))
+
+    def _ignored(self, path: str) -> bool:
+        return any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(os.path.basename(path), p) for p in self.ignores)
+
+    def _record(self, remote_file: RemoteFile):
+        st = os.stat(self.local_path(remote_file))
+        with self._lock:
+            self.state[remote_file.path] = {"etag": remote_file.etag, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+            pass
+        pass
+
+    def plan(self, remote_files: List[RemoteFile],
+             same_content: Optional[Callable[[List[RemoteFile]], Set[str]]] = None) -> List[RemoteFile]:
+        """the files to transfer, records the ones found unchanged"""
+        self._load_state()
+        to_fetch = []
+        unknown = []
+        for remote_file in remote_files:
+            if self._ignored(remote_file.path):
+                continue
+            try:
+                st = os.stat(self.local_path(remote_file))
+            except OSError:
+                to_fetch.append(remote_file)
+                continue
+            if st.st_size != remote_file.size:
+                to_fetch.append(remote_file)
+                continue
+            state = self.state.get(remote_file.path)
+            if state is not None and state["size"] == st.st_size and state["mtime_ns"] == st.st_mtime_ns:
+                if state["etag"] == remote_file.etag:
+                    continue
+                to_fetch.append(remote_file)
+                continue
+            unknown.append(remote_file)
+            pass
+        same = same_content(unknown) if same_content is not None and len(unknown) > 0 else set()
+        for remote_file in unknown:
+            if remote_file.path in same:
+                self._record(remote_file)
+            else:
+                to_fetch.append(remote_file)
+                pass
+            pass
+        return to_fetch
+
+    def fetch(self, remote_files: List[RemoteFile], download: Callable[[RemoteFile, str], None],
+              same_content: Optional[Callable[[List[RemoteFile]], Set[str]]] = None) -> FetchSummary:
+        """download(remote_file, local_path) transfers one file"""
+        summary = FetchSummary()
+        start = time.time()
+        to_fetch = self.plan(remote_files, same_content)
+        planned = set(f.path for f in to_fetch)
+        for remote_file in remote_files:
+            if remote_file.path not in planned and not self._ignored(remote_file.path):
+                summary.skipped += 1
+                summary.skipped_bytes += remote_file.size
+                pass
+            pass
+
+        def transfer(remote_file: RemoteFile):
+            local_path = self.local_path(remote_file)
+            part_path = local_path + PART_SUFFIX
+            try:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                download(remote_file, part_path)
+                os.replace(part_path, local_path)
+                self._record(remote_file)
+            except Exception as e:
+                logger.error(f"fetching {remote_file.path} failed: {e}")
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                    pass
+                with self._lock:
+                    summary.failed.append(remote_file.path)
+                    pass
+                return
+            with self._lock:
+                summary.transferred += 1
+                summary.transferred_bytes += remote_file.size
+                pass
+            pass
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hq_job_fetch") as executor:
+                list(executor.map(transfer, to_fetch))
+                pass
+        finally:
+            self._save_state()
+            pass
+        summary.seconds = time.time() - start
+        logger.info(f"fetch into {self.local_dir}: {summary}")
+        return summary
+    pass
+
+
+def cos_same_content(fetcher: DeltaFetcher) -> Callable[[List[RemoteFile]], Set[str]]:
+    """local files matching the md5 ETag of a simple upload, multipart ETags can't tell and are fetched"""
+    def same_content(remote_files: List[RemoteFile]) -> Set[str]:
+        same = set()
+        for remote_file in remote_files:
+            etag = remote_file.etag.strip('"')
+            if re.fullmatch(r"[0-9a-f]{32}", etag) and file_md5(fetcher.local_path(remote_file)) == etag:
+                same.add(remote_file.path)
+                pass
+            pass
+        return same
+    return same_content
+
+
+def fetch_from_cos(remote_path: str, local_dir: str, max_workers: int = 4, client=None) -> FetchSummary:
+    """delta download of a cos://<prefix>/ folder into local_dir, client defaults to storage.cos_client()"""
+    if client is None:
+        from . import storage
+        client = storage.cos_client()
+        pass
+    prefix = remote_path[len("cos://"):] if remote_path.startswith("cos://") else remote_path
+    if prefix != "" and not prefix.endswith("/"):
+        prefix += "/"
+        pass
+    remote_files = [RemoteFile(f.Key[len(prefix):], f.Size, f.ETag)
+                    for f in client.list_files(prefix=prefix) if not f.Key.endswith("/")]
+    fetcher = DeltaFetcher(local_dir, max_workers=max_workers)
+    return fetcher.fetch(remote_files, lambda f, path: client.download_file(prefix + f.path, path),
+                         same_content=cos_same_content(fetcher))
+
+
+def fetch_over_ssh(remote_dir: str, local_dir: str, host: str, username: str, password=None, port=22,
+                   key_file=None, ignores: str = "", max_workers: int = 4) -> FetchSummary:
+    """
+    delta download of a remote dir over SSH, the manifest is the size and mtime of every
+    file (find), content of same sized files without local state is compared with md5sum
+    """
+    from . import ssh_utils, ssh_pool
+    remote_dir = remote_dir.rstrip("/") + "/"
+    ssh = dict(host=host, username=username, password=password, port=port, key_file=key_file)
+    remote_files = [RemoteFile(path, size, f"{size}-{mtime}")
+                    for path, size, mtime in ssh_utils.list_remote_files(remote_dir, **ssh)]
+    fetcher = DeltaFetcher(local_dir, max_workers=max_workers, ignores=ignores)
+
+    def same_content(candidates: List[RemoteFile]) -> Set[str]:
+        remote_md5 = ssh_utils.remote_md5(remote_dir, [f.path for f in candidates], **ssh)
+        return set(f.path for f in candidates
+                   if f.path in remote_md5 and file_md5(fetcher.local_path(f)) == remote_md5[f.path])
+
+    def download(f: RemoteFile, path: str):
+        # pooled connections, one per transfer in flight
+        with ssh_pool.connection(**ssh) as conn:
+            conn.get(remote=remote_dir + f.path, local=path)
+            pass
+        pass
+
+    return fetcher.fetch(remote_files, download, same_content=same_content)
@@ -0,0 +1,172 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import loguru
+
+from . import storage
+
+logger = loguru.logger
+
+# files modified more recently than this are left for the next periodic sync, they may be half written
+SETTLE_SECONDS = 5.0
+
+
+def file_hash(path: str, block_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+            pass
+        pass
+    return h.hexdigest()
+
+
+class SyncedFile(object):
+    """what was uploaded for a file: its size, mtime and content hash at the time"""
+
+    def __init__(self, size: int, mtime_ns: int, sha256: str):
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.sha256 = sha256
+        pass
+    pass
+
+
+class OutputSyncer(object):
+    """
+    Uploads the new and changed files of output_dir to remote_path while the job runs.
+
+    Every interval seconds the dir is scanned. A file with the size and mtime of its
+    last upload is skipped without reading it, one that only got a new mtime is skipped
+    after comparing its hash. Periodic passes leave files modified in the last
+    SETTLE_SECONDS alone, stop() runs a final pass over everything, so the upload at
+    the end of the job is only the delta. interval <= 0 disables the periodic passes.
+    """
+
+    def __init__(self, output_dir: str, remote_path: str, interval: float = 300.0, max_workers: int = 4,
+                 upload: Callable[[str, str], None] = storage.upload_file):
+        self.output_dir = output_dir
+        self.remote_path = remote_path if remote_path.endswith("/") else remote_path + "/"
+        self.interval = interval
+        self.max_workers = max(1, max_workers)
+        self.upload = upload
+        self.synced: Dict[str, SyncedFile] = dict()
+        self.passes = 0
+        self.uploaded = 0
+        self.uploaded_bytes = 0
+        self.skipped = 0
+        self._sync_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        pass
+
+    def _changed(self, settle: float) -> List[Tuple[str, os.stat_result]]:
+        """(relative path, stat) of the files to upload"""
+        changed = []
+        now = time.time()
+        for root, dirs, files in os.walk(self.output_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                relative_path = os.path.relpath(path, self.output_dir).replace(os.sep, "/")
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if st.st_mtime > now - settle:
+                    continue
+                synced = self.synced.get(relative_path)
+                if synced is not None and synced.size == st.st_size:
+                    if synced.mtime_ns == st.st_mtime_ns:
+                        self.skipped += 1
+                        continue
+                    # rewritten with the same content
+                    try:
+                        sha256 = file_hash(path)
+                    except OSError:
+                        continue
+                    if sha256 == synced.sha256:
+                        synced.mtime_ns = st.st_mtime_ns
+                        self.skipped += 1
+                        continue
+                    pass
+                changed.append((relative_path, st))
+                pass
+            pass
+        return changed
+
+    def _upload(self, relative_path: str, st: os.stat_result) -> bool:
+        path = os.path.join(self.output_dir, relative_path)
+        try:
+            sha256 = file_hash(path)
+            self.upload(path, self.remote_path + relative_path)
+            after = os.stat(path)
+        except Exception as e:
+            logger.error(f"output sync: uploading {relative_path} failed: {e}")
+            return False
+        if (after.st_size, after.st_mtime_ns) != (st.st_size, st.st_mtime_ns):
+            # written to during the upload, the next pass takes it again
+            return True
+        with self._lock:
+            self.synced[relative_path] = SyncedFile(st.st_size, st.st_mtime_ns, sha256)
+            self.uploaded += 1
+            self.uploaded_bytes += st.st_size
+            pass
+        return True
+
+    def sync(self, final: bool = False) -> List[str]:
+        """one pass, returns the files that failed to upload"""
+        with self._sync_lock:
+            start = time.time()
+            uploaded, uploaded_bytes = self.uploaded, self.uploaded_bytes
+            changed = self._changed(settle=0.0 if final else SETTLE_SECONDS)
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hq_job_output") as executor:
+                results = list(executor.map(lambda c: self._upload(*c), changed))
+                pass
+            failed = [c[0] for c, ok in zip(changed, results) if not ok]
+            self.passes += 1
+            if len(changed) > 0 or final:
+                logger.info(f"output sync{' (final)' if final else ''}: {self.uploaded - uploaded} files "
+                            f"({(self.uploaded_bytes - uploaded_bytes) / 1e6:.1f} MB) uploaded to {self.remote_path} "
+                            f"in {time.time() - start:.2f}s, {len(failed)} failed, {len(self.synced)} in sync")
+                pass
+            return failed
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"output sync: {e}")
+                pass
+            pass
+        pass
+
+    def start(self) -> "OutputSyncer":
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="hq_job_output_sync", daemon=True)
+            self._thread.start()
+            pass
+        return self
+
+    def stop(self):
+        """stop the periodic passes and upload what is left, RuntimeError when files failed"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            pass
+        failed = self.sync(final=True)
+        logger.info(f"output sync: {self.uploaded} uploads ({self.uploaded_bytes / 1e6:.1f} MB) in {self.passes} "
+                    f"passes, {self.skipped} unchanged files skipped")
+        if len(failed) > 0:
+            raise RuntimeError(f"output sync: {len(failed)} files failed to upload: {sorted(failed)}")
+        pass
+    pass
@@ -0,0 +1,184 @@
+import os
+import io
+import json
+import mmap
+import hashlib
+import threading
+from typing import BinaryIO, Dict, List, Optional
+
+import loguru
+
+from . import file_utils
+
+logger = loguru.logger
+
+
+class PackMember(object):
+    """where a file of a pack is: its shard and offsets in the uncompressed tar"""
+
+    def __init__(self, path: str, shard: int, header_offset: int, offset: int, size: int, sha256: str = ""):
+        self.path = path
+        self.shard = shard
+        self.header_offset = header_offset  # first header of the member (pax headers included)
+        self.offset = offset    # first byte of the content
+        self.size = size
+        self.sha256 = sha256
+        pass
+
+    def to_dict(self) -> dict:
+        return dict(self.__dict__)
+    pass
+
+
+def build_manifest(source: str, basename: str, postfix: Optional[str] = None) -> str:
+    """
+    writes the manifest (the index of the pack) of shards packed before there were manifests,
+    by scanning them, files get no checksum. Returns the manifest path
+    """
+    postfix = postfix or file_utils.shard_postfix(source, basename)
+    codec = file_utils.codec_of("." + postfix)
+    manifest = {"codec": codec, "shard_size": None, "shards": [], "files": []}
+    while True:
+        name = f"{basename}_{len(manifest['shards'])}.{postfix}"
+        path = os.path.join(source, name)
+        if not os.path.exists(path):
+            break
+        entries = []
+        with file_utils.open_tar(path, "r") as tar:
+            for member in tar:
+                if not member.isreg():
+                    continue
+                entries.append({"path": member.name, "size": member.size, "header_offset": member.offset,
+                                "offset": member.offset_data, "sha256": "", "shard": len(manifest["shards"])})
+                pass
+            pass
+        manifest["shards"].append({"name": name, "files": len(entries), "bytes": sum(e["size"] for e in entries),
+                                   "stored_bytes": os.path.getsize(path)})
+        manifest["files"].extend(entries)
+        pass
+    if len(manifest["shards"]) == 0:
+        raise FileNotFoundError(f"no shards {basename}_<i>.{postfix} in {source}")
+    manifest_file = os.path.join(source, f"{basename}.{file_utils.MANIFEST_POSTFIX}")
+    with open(manifest_file + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+        pass
+    os.replace(manifest_file + ".tmp", manifest_file)
+    return manifest_file
+
+
+class PackReader(object):
+    """
+    Reads single files of a pack by path, without extracting it.
+
+    The manifest next to the shards is the index: path -> shard, offsets and size. Files
+    of uncompressed shards are served from an mmap of their shard, view() without a
+    copy. Compressed shards can't seek: every read of a compressed member decompresses
+    and scans its shard from the start up to the member, the whole shard for the last
+    one, pack with codec none for packs read this way. Thread safe.
+    """
+
+    def __init__(self, source: str, basename: str):
+        self.source = source
+        self.basename = basename
+        manifest_file = os.path.join(source, f"{basename}.{file_utils.MANIFEST_POSTFIX}")
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+            pass
+        self.codec = manifest["codec"]
+        self.shards: List[str] = [os.path.join(source, s["name"]) for s in manifest["shards"]]
+        self.members: Dict[str, PackMember] = {e["path"]: PackMember(
+            e["path"], e["shard"], e["header_offset"], e["offset"], e["size"], e.get("sha256", ""))
+            for e in manifest["files"]}
+        self._maps: Dict[int, mmap.mmap] = dict()
+        self._files: Dict[int, BinaryIO] = dict()
+        self._lock = threading.Lock()
+        pass
+
+    def names(self) -> List[str]:
+        return list(self.members)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.members
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def member(self, path: str) -> PackMember:
+        member = self.members.get(path)
+        if member is None:
+            raise KeyError(f"{path} is not in the pack {self.basename}")
+        return member
+
+    def _map(self, shard: int) -> mmap.mmap:
+        with self._lock:
+            mapped = self._maps.get(shard)
+            if mapped is None:
+                f = open(self.shards[shard], "rb")
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._files[shard] = f
+                self._maps[shard] = mapped
+                pass
+            return mapped
+
+    def view(self, path: str) -> memoryview:
+        """
+        the content of an uncompressed member without copying it. A view outlives close(),
+        its shard stays mapped until the view is released
+        """
+        if self.codec != "none":
+            raise ValueError(f"{self.codec} shards can't be viewed, read() them")
+        member = self.member(path)
+        return memoryview(self._map(member.shard))[member.offset:member.offset + member.size]
+
+    def _read_compressed(self, member: PackMember) -> bytes:
+        with file_utils.open_tar(self.shards[member.shard], "r") as tar:
+            for tarinfo in tar:
+                if tarinfo.name == member.path:
+                    return tar.extractfile(tarinfo).read()
+                pass
+            pass
+        raise KeyError(f"{member.path} is not in {self.shards[member.shard]}")
+
+    def read(self, path: str, verify: bool = False) -> bytes:
+        """
+        a copy of the content of a member, verify checks it against the sha256 of the manifest.
+        A compressed member costs decompressing its shard up to it
+        """
+        member = self.member(path)
+        if self.codec == "none":
+            data = self._map(member.shard)[member.offset:member.offset + member.size]
+        else:
+            data = self._read_compressed(member)
+            pass
+        if verify and member.sha256 and hashlib.sha256(data).hexdigest() != member.sha256:
+            raise ValueError(f"{path} in the pack {self.basename} doesn't match its checksum")
+        return data
+
+    def open(self, path: str) -> BinaryIO:
+        """a seekable file object of a copy of a member"""
+        return io.BytesIO(self.read(path))
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                try:
+                    mapped.close()
+                except BufferError:
+                    # a view() is still alive, the map is dropped here and unmapped when it is released
+                    pass
+                pass
+            for f in self._files.values():
+                f.close()
+                pass
+            self._maps = dict()
+            self._files = dict()
+            pass
+        pass
+
+    def __enter__(self) -> "PackReader":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        pass
+    pass
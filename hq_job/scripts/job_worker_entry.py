@@ -1,100 +1,279 @@
-import io
 import os
 import sys
 import json
+import time
+import selectors
 import subprocess
 import shutil
 from datetime import datetime
 
+# the worker is started as a script, make the hq_job package importable from a source checkout
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-def update_status(job_dir, **kwargs):
+from hq_job.job_registry import JobRegistry
+from hq_job.job_scheduler import JobScheduler
+
+# the steps below are shared with the supervisor (hq_job/job_supervisor.py),
+# which runs them in-process instead of starting one worker interpreter per job
+
+
+def update_status(registry, job_dir, job_id, **kwargs):
     status_file = os.path.join(job_dir, 'status.json')
     if not os.path.exists(status_file):
         return
-    with open(status_file, 'r', encoding='utf-8') as f:
-        job_info = json.load(f)
-    for k, v in kwargs.items():
-        job_info[k] = v
+    job_info = None
+    if registry is not None:
+        job_info = registry.update(job_id, **kwargs)
+    if job_info is None:
+        with open(status_file, 'r', encoding='utf-8') as f:
+            job_info = json.load(f)
+        for k, v in kwargs.items():
+            job_info[k] = v
     with open(status_file, 'w', encoding='utf-8') as f:
         json.dump(job_info, f, ensure_ascii=False, indent=2)
 
 
+def load_job(registry, job_dir, job_id):
+    job_info = registry.get(job_id) if registry is not None else None
+    if job_info is None:
+        with open(os.path.join(job_dir, 'status.json'), 'r', encoding='utf-8') as f:
+            job_info = json.load(f)
+    return job_info
 
-def main():
-    if len(sys.argv) < 3:
-        print('Usage: python job_worker_entry.py <job_dir> <job_id>')
-        sys.exit(1)
-    job_dir = sys.argv[1]
-    job_id = int(sys.argv[2])
-    status_file = os.path.join(job_dir, 'status.json')
-    log_file = os.path.join(job_dir, f'job_{job_id}.log')
-    if not os.path.exists(status_file):
-        print('status.json not found')
-        sys.exit(1)
-    with open(status_file, 'r', encoding='utf-8') as f:
-        job_info = json.load(f)
-    update_status(job_dir, status='running')
+
+# the part of the submitter's env saved with a job, the rest (tokens, keys, passwords) is never
+# written to disk, the supervisor gets the whole env in memory with the schedule request
+LAUNCH_ENV_VARS = ('PATH', 'PYTHONPATH', 'PYTHONHOME', 'VIRTUAL_ENV', 'CONDA_PREFIX', 'CONDA_DEFAULT_ENV',
+                   'LD_LIBRARY_PATH', 'CUDA_VISIBLE_DEVICES', 'HOME', 'USER', 'LANG', 'LC_ALL', 'TMPDIR')
+
+
+def launch_env(environ):
+    """the variables of environ that are saved with a job"""
+    return {k: environ[k] for k in LAUNCH_ENV_VARS if k in environ}
+
+
+def launch_context(job_info, submitter_env=None):
+    """
+    (env, cwd, python) of the process that submitted the job: its whole env when given,
+    otherwise this process' env with the saved LAUNCH_ENV_VARS. This process' own for older jobs
+    """
+    launch = job_info.get('launch') or {}
+    env = dict(submitter_env) if submitter_env is not None else dict(os.environ, **(launch.get('env') or {}))
+    return env, launch.get('cwd') or os.getcwd(), launch.get('python') or sys.executable
+
+
+def prepare_job(job_dir, job_info, submitter_env=None):
+    """returns (command_str, working_dir, env) of a job"""
     command = job_info['command']
     working_dir = job_info.get('working_dir', job_dir)    # working dir, relative to job dir
     if not os.path.isabs(working_dir):
         working_dir = os.path.join(job_dir, working_dir) # relative to job dir
     os.makedirs(working_dir, exist_ok=True) # create working dir
-    env = os.environ.copy() # copy env
+    env, _, _ = launch_context(job_info, submitter_env)    # the submitter's env
     env.update(job_info.get('env', {}))     # update env
+    env['PYTHONUNBUFFERED'] = '1'
+    env['PYTHONIOENCODING'] = 'utf-8'
     command_str = command + " " + " ".join(job_info.get('args', []))    # command with args
-    with open(log_file, 'w', encoding='utf-8', buffering=1) as f:  # line buffering
-        f.write(f"job {job_id} started\n")
-        f.write(f"command: {command_str}\n")
-        f.write(f"working_dir: {working_dir}\n")
-        f.write(f"output_dir: {job_info.get('output_dir', 'none')}\n")
-        f.write(f"start_time: {job_info['start_time']}\n")
-        f.write("-" * 50 + "\n")
-        
-        env_copy = env.copy() if env else os.environ.copy()
-        env_copy['PYTHONUNBUFFERED'] = '1'
-        env_copy['PYTHONIOENCODING'] = 'utf-8'
-
-        process = subprocess.Popen(
-            command_str,
-            cwd=working_dir,
-            env=env_copy,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            bufsize=0,
-            shell=True,
-            start_new_session=True
-        )
-        update_status(job_dir, pid=process.pid)
-        stdout_stream = io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace', line_buffering=True)
+    return command_str, working_dir, env
+
+
+def write_log_header(f, job_id, job_info, command_str, working_dir):
+    f.write(f"job {job_id} started\n")
+    f.write(f"command: {command_str}\n")
+    f.write(f"working_dir: {working_dir}\n")
+    f.write(f"output_dir: {job_info.get('output_dir', 'none')}\n")
+    f.write(f"start_time: {job_info['start_time']}\n")
+    f.write("-" * 50 + "\n")
+
+
+def start_job_process(command_str, working_dir, env):
+    # a new session makes the job a process group that can be killed as a whole
+    return subprocess.Popen(
+        command_str,
+        cwd=working_dir,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        bufsize=0,
+        shell=True,
+        start_new_session=True
+    )
+
+
+class LogPump(object):
+    """
+    Copy a child's output into a log file in chunks.
+
+    The pipe is read with os.read as data arrives (selectors, so an idle job costs nothing),
+    at most chunk_size bytes at a time, so memory stays bounded however long a line is.
+    Bytes go straight to the log fd, readers see them at once, and durability is a policy:
+    fsync after fsync_ms milliseconds or fsync_bytes bytes since the last one, and always
+    at exit. 0 disables a trigger, both 0 means fsync only at exit.
+    """
+
+    def __init__(self, fd_out: int, fsync_ms: int = 1000, fsync_bytes: int = 4 * 1024 * 1024,
+                 chunk_size: int = 64 * 1024):
+        self.fd_out = fd_out
+        self.fsync_ms = fsync_ms
+        self.fsync_bytes = fsync_bytes
+        self.chunk_size = chunk_size
+        self.bytes_written = 0
+        self.fsync_count = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        pass
+
+    def _write(self, data: bytes):
+        view = memoryview(data)
+        while len(view) > 0:
+            n = os.write(self.fd_out, view)
+            view = view[n:]
+        self.bytes_written += len(data)
+        self._unsynced += len(data)
+        if self.fsync_bytes > 0 and self._unsynced >= self.fsync_bytes:
+            self.sync()
+
+    def _sync_due(self) -> bool:
+        return self.fsync_ms > 0 and self._unsynced > 0 \
+            and (time.monotonic() - self._last_sync) * 1000 >= self.fsync_ms
+
+    def sync(self):
+        if self._unsynced > 0:
+            os.fsync(self.fd_out)
+            self.fsync_count += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _timeout(self):
+        # wake up for a pending time-based fsync, otherwise now and then to notice the exit
+        # of a child whose own children still hold the pipe open
+        if self.fsync_ms > 0 and self._unsynced > 0:
+            return max(0.0, self.fsync_ms / 1000 - (time.monotonic() - self._last_sync))
+        return 1.0
+
+    def _drain(self, fd_in: int):
+        """read what is left without blocking, the writer may never close the pipe"""
+        os.set_blocking(fd_in, False)
         while True:
-            line = stdout_stream.readline()
-            if line:
-                f.write(line)
-                f.flush()
-                os.fsync(f.fileno())
-            if process.poll() is not None:
-                for remaining in stdout_stream:
-                    f.write(remaining)
-                    f.flush()
-                    os.fsync(f.fileno())
-                break
-        stdout_stream.close()
-    return_code = process.wait()
+            try:
+                data = os.read(fd_in, self.chunk_size)
+            except BlockingIOError:
+                return
+            if not data:
+                return
+            self._write(data)
+
+    def pump(self, process) -> int:
+        """copy process.stdout until it ends and the process exits, returns the exit code"""
+        fd_in = process.stdout.fileno()
+        try:
+            if sys.platform == 'win32':
+                # no select() on pipes, blocking reads still don't spin
+                while True:
+                    data = os.read(fd_in, self.chunk_size)
+                    if not data:
+                        break
+                    self._write(data)
+                    if self._sync_due():
+                        self.sync()
+            else:
+                with selectors.DefaultSelector() as selector:
+                    selector.register(fd_in, selectors.EVENT_READ)
+                    while True:
+                        if selector.select(self._timeout()):
+                            data = os.read(fd_in, self.chunk_size)
+                            if not data:
+                                break
+                            self._write(data)
+                        elif process.poll() is not None:
+                            self._drain(fd_in)
+                            break
+                        if self._sync_due():
+                            self.sync()
+        finally:
+            self.sync()
+            process.stdout.close()
+        return process.wait()
+
+
+def pump_output(process, f, fsync_ms: int = 1000, fsync_bytes: int = 4 * 1024 * 1024):
+    """copy the job output into the log file until the process exits, returns the exit code"""
+    f.flush()
+    return LogPump(f.fileno(), fsync_ms=fsync_ms, fsync_bytes=fsync_bytes).pump(process)
+
+
+def log_policy(job_info):
+    """fsync settings of a job, see LogPump"""
+    policy = dict()
+    for key in ('log_fsync_ms', 'log_fsync_bytes'):
+        if job_info.get(key) is not None:
+            policy[key[len('log_'):]] = int(job_info[key])
+    return policy
+
+
+def finish_job(registry, job_dir, job_id, job_info, return_code):
+    log_file = os.path.join(job_dir, f'job_{job_id}.log')
+    end_time = datetime.now().isoformat()
+    if registry is not None and registry.status(job_id) == 'stopped':
+        # stopped by the user, keep that status and just record how the process ended
+        update_status(registry, job_dir, job_id, exit_code=return_code)
+        return
     # postprocess
-    update_status(job_dir, status='postprocessing')
+    update_status(registry, job_dir, job_id, status='postprocessing')
     # copy output dir to job dir
     target_output_dir = os.path.join(job_dir, 'output')
     if os.path.exists(target_output_dir):
         shutil.rmtree(target_output_dir)
-    shutil.copytree(job_info.get('output_dir'), target_output_dir)
+    # a relative output dir is relative to where the job was submitted
+    _, cwd, _ = launch_context(job_info)
+    shutil.copytree(os.path.join(cwd, job_info.get('output_dir')), target_output_dir)
     if return_code == 0:
-        update_status(job_dir, status='completed', end_time=datetime.now().isoformat(), exit_code=return_code)
+        update_status(registry, job_dir, job_id, status='completed', end_time=end_time, exit_code=return_code)
     else:
-        update_status(job_dir, status='failed', end_time=datetime.now().isoformat(), exit_code=return_code)
+        update_status(registry, job_dir, job_id, status='failed', end_time=end_time, exit_code=return_code)
     with open(log_file, 'a', encoding='utf-8') as f:
         f.write(f"\njob {job_id} completed\n")
         f.write(f"exit code: {return_code}\n")
-        f.write(f"end time: {datetime.now().isoformat()}\n")
+        f.write(f"end time: {end_time}\n")
+
+
+def fail_job(registry, job_dir, job_id, error):
+    update_status(registry, job_dir, job_id, status='failed', end_time=datetime.now().isoformat(),
+                  error_message=str(error))
+
+
+def run_job(registry, job_dir, job_id):
+    log_file = os.path.join(job_dir, f'job_{job_id}.log')
+    job_info = load_job(registry, job_dir, job_id)
+    update_status(registry, job_dir, job_id, status='running')
+    command_str, working_dir, env = prepare_job(job_dir, job_info)
+    with open(log_file, 'w', encoding='utf-8', buffering=1) as f:  # line buffering
+        write_log_header(f, job_id, job_info, command_str, working_dir)
+        process = start_job_process(command_str, working_dir, env)
+        update_status(registry, job_dir, job_id, pid=process.pid)
+        return_code = pump_output(process, f, **log_policy(job_info))
+    finish_job(registry, job_dir, job_id, job_info, return_code)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print('Usage: python job_worker_entry.py <job_dir> <job_id>')
+        sys.exit(1)
+    job_dir = sys.argv[1]
+    job_id = int(sys.argv[2])
+    if not os.path.exists(os.path.join(job_dir, 'status.json')):
+        print('status.json not found')
+        sys.exit(1)
+    # the registry lives in the jobs dir, one level above the job dir
+    registry = JobRegistry(os.path.dirname(os.path.abspath(job_dir)))
+    try:
+        run_job(registry, job_dir, job_id)
+    except Exception as e:
+        fail_job(registry, job_dir, job_id, e)
+        raise
+    finally:
+        # this job's slots are free now, start whatever fits from the queue
+        JobScheduler.from_registry(registry).schedule()
 
 if __name__ == '__main__':
     main()
@@ -1,5 +1,5 @@
 from hq_job.job_engine import JobDescription
-from hq_job import storage
+from hq_job import env_prep, input_cache, input_staging, output_sync, storage
 from hq_job.job_engine_autodl import JobEngineAutodl
 import os
 import loguru
@@ -10,18 +10,6 @@ import time
 
 logger = loguru.logger
 
-def reinstall_numpy():
-    os.system("python3 -m pip uninstall -y numpy && rm -rf /root/miniconda3/lib/python3.12/site-packages/numpy*")
-
-    for i in range(5):
-        retcd = os.system("python3 -m pip install \"numpy<2.0.0\"")
-        if retcd == 0:
-            break
-        logger.warning("reinstall numpy failed, try again")
-        time.sleep(10)
-        pass
-    pass
-
 if __name__ == '__main__':
     logger.info(f"Starting job worker with args: {sys.argv[1]}")
     job_desc = JobDescription.from_json(base64.b64decode(sys.argv[1].encode('utf-8')).decode('utf-8'))
@@ -32,18 +20,42 @@ if __name__ == '__main__':
     os.makedirs(working_dir, exist_ok=True)
     os.makedirs(output_dir, exist_ok=True)
 
-    logger.info("reinstalling numpy...")
-    reinstall_numpy()
+    # only installs what the interpreter doesn't satisfy yet
+    logger.info("preparing environment...")
+    env_prep.prepare_environment(job_desc.requirements)
 
-    #download input files
-    for input_path in job_desc.input_paths:
-        logger.info(f"Downloading input file: {input_path}")
-        storage.download_file(input_path, os.path.join(working_dir, os.path.basename(input_path)))
+    # download input files in parallel, the command starts once the required ones are in
+    cache = None
+    download = storage.download_file
+    if job_desc.use_input_cache and len(job_desc.input_paths) > 0:
+        cache = input_cache.InputCache()
+        download = cache.download
+        pass
+    stager = input_staging.InputStager(
+        job_desc.input_paths, working_dir, required=job_desc.required_inputs,
+        max_workers=job_desc.input_concurrency, download=download).start()
+    stager.wait_required()
+    if cache is not None:
+        cache.evict()
+        pass
+
+    # upload outputs while the command runs, the final upload is then only the delta
+    output_path = None
+    container_uuid = os.environ.get("AutoDLContainerUUID")
+    if container_uuid is not None:
+        job_engine_cls = JobEngineAutodl
+        output_path = job_engine_cls.default_output_path(container_uuid)
+        pass
+    syncer = None
+    if output_path is not None:
+        syncer = output_sync.OutputSyncer(
+            output_dir, output_path, interval=job_desc.output_sync_interval).start()
         pass
 
     # run the command
     # 将 job_desc.env 合并到环境变量中
     merged_env = os.environ.copy()
+    merged_env["HQJOB_INPUTS_MANIFEST"] = stager.manifest_file
     if job_desc.env:
         merged_env.update(job_desc.env)
     
@@ -71,15 +83,18 @@ if __name__ == '__main__':
     sys.stdout.flush()
     return_code = process.wait()
     logger.info(f"Job completed with return code {return_code}")
+    # inputs the command didn't wait for are of no use anymore
+    stager.close(cancel=True)
+    if cache is not None:
+        cache.evict()
+        cache.log_stats()
+        pass
     pass
 
-    container_uuid = os.environ.get("AutoDLContainerUUID")
-    if container_uuid is not None:
-        job_engine_cls = JobEngineAutodl
-        output_path = job_engine_cls.default_output_path(container_uuid)
+    # upload what changed since the last sync
+    if syncer is not None:
+        syncer.stop()
+    else:
+        logger.warning("AutoDLContainerUUID is not set, outputs are not uploaded")
         pass
-
-    # upload output files
-    storage.upload_file(
-        output_dir.rstrip('/'), output_path)
     pass
\ No newline at end of file
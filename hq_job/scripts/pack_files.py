@@ -1,21 +1,38 @@
 import hq_job.file_utils
-import sys
+import argparse
 import os
 
 
+def parse_size(text: str) -> int:
+    """bytes, or with a K/M/G suffix"""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
 if __name__ == "__main__":
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    parser = argparse.ArgumentParser(description="pack a file or dir into fixed size tar shards")
+    parser.add_argument("input_path")
+    parser.add_argument("output_path", help="<dir>/<basename>, shards are <basename>_<i>.<ext>")
+    parser.add_argument("--shard-size", type=parse_size, default=1024 * 1024 * 1024,
+                        help="input bytes per shard, K/M/G suffixes allowed (default 1G)")
+    parser.add_argument("--workers", type=int, default=None, help="shards packed at a time (default: cpu count)")
+    parser.add_argument("--codec", default="none", choices=sorted(hq_job.file_utils.CODEC_EXTENSIONS),
+                        help="compression of the shards, zstd/lz4 fall back to gzip when not installed")
+    args = parser.parse_args()
 
-    basename = os.path.basename(output_path)
-    destination = os.path.dirname(output_path)
+    basename = os.path.basename(args.output_path)
+    destination = os.path.dirname(args.output_path)
 
     pack_files = hq_job.file_utils.pack_files_by_fixed_size(
-        source=input_path,
+        source=args.input_path,
         destination=destination,
         basename=basename,
-        postfix="tar",
-        size=1024*1024*1024
+        size=args.shard_size,
+        workers=args.workers,
+        codec=args.codec
     )
     print(pack_files)
-    pass
\ No newline at end of file
+    pass
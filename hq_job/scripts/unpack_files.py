@@ -1,19 +1,32 @@
-
 import hq_job.file_utils
-import sys
+import argparse
 import os
 
 if __name__ == "__main__":
-    input_path = sys.argv[1]
-    output_path = sys.argv[2]
+    parser = argparse.ArgumentParser(description="extract the shards of a pack, deleting each once extracted")
+    parser.add_argument("input_path", help="<dir>/<basename> of the shards, the dir may be cos://...")
+    parser.add_argument("output_path")
+    parser.add_argument("--workers", type=int, default=None, help="shards extracted at a time (default: cpu count)")
+    args = parser.parse_args()
 
-    basename = os.path.basename(input_path)
-    source = os.path.dirname(input_path)
+    basename = os.path.basename(args.input_path)
+    source = os.path.dirname(args.input_path)
 
-    hq_job.file_utils.unpack_files_and_delete(
-        source=source,
-        destination=output_path,
-        basename=basename,
-        postfix="tar"
-    )
-    pass
\ No newline at end of file
+    if "://" in source:
+        # streamed from storage into extraction, nothing lands on disk but the files
+        hq_job.file_utils.unpack_files_from_storage(
+            remote_dir=source,
+            destination=args.output_path,
+            basename=basename,
+            workers=args.workers
+        )
+    else:
+        hq_job.file_utils.unpack_files_and_delete(
+            source=source,
+            destination=args.output_path,
+            basename=basename,
+            postfix=None,
+            workers=args.workers
+        )
+        pass
+    pass
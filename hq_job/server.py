@@ -1,18 +1,26 @@
+import asyncio
+import hashlib
+import hmac
+import json
 import os
+import time
 import traceback
-from typing import Optional
+from datetime import datetime
+from typing import List, Optional
 from contextlib import asynccontextmanager
 
 import loguru
 import uvicorn
 from fastapi import FastAPI, Depends, HTTPException, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 
 from .job_engine import JobDescription
-from .job_engine_autodl import JobEngineAutodl
+from .job_engine_autodl_async import JobEngineAutodlAsync
 from .autodl_client import AutodlNetworkError, AutoDLConstants
-from .server_models import JobSubmitRequest, JobInfo, ApiResponse
+from .server_models import JobSubmitRequest, JobStatusBatchRequest, JobInfo, ApiResponse
+from .server_query import DEFAULT_SORT, InvalidQuery, JobQuery
+from .server_state import TERMINAL_STATUSES, DeploymentStateCache
 from .web_ui import HTML_PAGE
 
 logger = loguru.logger
@@ -21,9 +29,21 @@ logger = loguru.logger
 # Configuration
 # ---------------------------------------------------------------------------
 AUTODL_TOKEN = os.environ.get("AUTODL_TOKEN", "")
+AUTODL_HOST = os.environ.get("AUTODL_HOST", "https://api.autodl.com")
 API_TOKEN = os.environ.get("API_TOKEN", "")
 SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
 SERVER_PORT = int(os.environ.get("SERVER_PORT", "9090"))
+# seconds between background refreshes of the deployment state table, 0 disables the table
+STATE_REFRESH_INTERVAL = float(os.environ.get("STATE_REFRESH_INTERVAL", "10"))
+# seconds between SSE heartbeat comments on an idle event stream
+SSE_HEARTBEAT_INTERVAL = 15.0
+# seconds between reads of a followed job log that had nothing new
+LOG_FOLLOW_INTERVAL = 2.0
+# bytes of job log per response / per follow event by default, and at most
+LOG_CHUNK_BYTES = 256 * 1024
+LOG_CHUNK_MAX_BYTES = 4 * 1024 * 1024
+# seconds a stream token can open an event stream, see issue_stream_token
+STREAM_TOKEN_TTL = float(os.environ.get("STREAM_TOKEN_TTL", "60"))
 
 
 # ---------------------------------------------------------------------------
@@ -40,14 +60,70 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     return credentials.credentials
 
 
+stream_security = HTTPBearer(auto_error=False)
+
+
+def _stream_token_signature(expires: int) -> str:
+    return hmac.new(API_TOKEN.encode("utf-8"), f"stream:{expires}".encode("ascii"), hashlib.sha256).hexdigest()
+
+
+def issue_stream_token() -> str:
+    """
+    a token that only opens event streams and only for STREAM_TOKEN_TTL seconds, for clients
+    like EventSource that can't set headers and have to put it in the URL, where it ends up
+    in access logs and browser history. The API token itself is never accepted there
+    """
+    expires = int(time.time() + STREAM_TOKEN_TTL)
+    return f"{expires}.{_stream_token_signature(expires)}"
+
+
+def _valid_stream_token(token: str) -> bool:
+    expires, _, signature = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _stream_token_signature(int(expires)))
+
+
+def verify_stream_token(
+    stream_token: Optional[str] = Query(None, description="token from POST /api/v1/stream_token, for EventSource"),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(stream_security),
+):
+    if not API_TOKEN:
+        raise HTTPException(status_code=500, detail="API_TOKEN not configured on server")
+    if credentials is not None:
+        if credentials.credentials != API_TOKEN:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        return credentials.credentials
+    if stream_token is None or not _valid_stream_token(stream_token):
+        raise HTTPException(status_code=401, detail="Invalid or expired stream token")
+    return stream_token
+
+
 # ---------------------------------------------------------------------------
 # Engine dependency
 # ---------------------------------------------------------------------------
 
-def get_engine() -> JobEngineAutodl:
+def get_engine() -> JobEngineAutodlAsync:
     return app.state.engine
 
 
+def get_state_cache() -> Optional[DeploymentStateCache]:
+    return getattr(app.state, "state_cache", None)
+
+
+def _job_info(d) -> JobInfo:
+    return JobInfo(
+        uuid=d.uuid,
+        name=d.name,
+        status=d.status,
+        deployment_type=d.deployment_type,
+        region_sign=d.region_sign,
+        dc_list=d.dc_list,
+        gpu_name_set=d.gpu_name_set,
+        created_at=d.created_at.isoformat() if d.created_at else "",
+    )
+
+
 # ---------------------------------------------------------------------------
 # Lifespan
 # ---------------------------------------------------------------------------
@@ -58,10 +134,19 @@ async def lifespan(application: FastAPI):
         raise RuntimeError("AUTODL_TOKEN environment variable is required")
     if not API_TOKEN:
         logger.warning("API_TOKEN not set, all authenticated endpoints will return 500")
-    application.state.engine = JobEngineAutodl(token=AUTODL_TOKEN)
+    application.state.engine = JobEngineAutodlAsync(token=AUTODL_TOKEN, host=AUTODL_HOST)
+    application.state.state_cache = None
+    if STATE_REFRESH_INTERVAL > 0:
+        application.state.state_cache = DeploymentStateCache(application.state.engine, interval=STATE_REFRESH_INTERVAL)
+        application.state.state_cache.start()
+        pass
     logger.info(f"Server started on {SERVER_HOST}:{SERVER_PORT}")
     yield
     logger.info("Server shutting down")
+    if application.state.state_cache is not None:
+        await application.state.state_cache.stop()
+        pass
+    await application.state.engine.aclose()
 
 
 # ---------------------------------------------------------------------------
@@ -106,10 +191,17 @@ async def health():
     return ApiResponse(data={"status": "ok"})
 
 
+@app.post("/api/v1/stream_token", dependencies=[Depends(verify_token)])
+async def stream_token():
+    """short-lived token for the event streams, see issue_stream_token"""
+    return ApiResponse(data={"token": issue_stream_token(), "expires_in": STREAM_TOKEN_TTL})
+
+
 @app.post("/api/v1/jobs", dependencies=[Depends(verify_token)])
 async def submit_job(
     req: JobSubmitRequest,
-    engine: JobEngineAutodl = Depends(get_engine),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
 ):
     job_desc = JobDescription(
         name=req.name,
@@ -126,86 +218,312 @@ async def submit_job(
     job_desc.gpu_num = req.gpu_num
     job_desc.gpu_name_set = req.gpu_name_set
     job_desc.region = req.region
+    job_desc.requirements = req.requirements
+    job_desc.required_inputs = req.required_inputs
+    job_desc.input_concurrency = req.input_concurrency
+    job_desc.use_input_cache = req.use_input_cache
+    job_desc.output_sync_interval = req.output_sync_interval
 
     try:
-        job_uuid = engine.run(job_desc)
+        job_uuid = await engine.run(job_desc)
     except AutodlNetworkError as e:
         raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if state_cache is not None:
+        state_cache.request_refresh()
+        pass
     return ApiResponse(data={"job_uuid": job_uuid})
 
 
 @app.get("/api/v1/jobs", dependencies=[Depends(verify_token)])
 async def list_jobs(
-    name: Optional[str] = Query(None, description="Filter by job name"),
-    engine: JobEngineAutodl = Depends(get_engine),
+    name: Optional[str] = Query(None, description="Filter by job name substring"),
+    status: Optional[str] = Query(None, description="Filter by status, e.g. running / stopped"),
+    region: Optional[str] = Query(None, description="Filter by region sign"),
+    gpu_type: Optional[str] = Query(None, description="Filter by GPU type, e.g. RTX 4090"),
+    created_after: Optional[datetime] = Query(None, description="Created at or after, naive means UTC"),
+    created_before: Optional[datetime] = Query(None, description="Created before, naive means UTC"),
+    name_prefix: Optional[str] = Query(None, description="Filter by job name prefix"),
+    sort: str = Query(DEFAULT_SORT, description="One of -created_at, created_at, name, -name"),
+    limit: int = Query(100, ge=1, le=500, description="Page size"),
+    cursor: Optional[str] = Query(None, description="meta.next_cursor of the previous page"),
+    live: bool = Query(False, description="Read from AutoDL instead of the state table"),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
 ):
     try:
-        deployments = engine.list(name=name, page_size=50, limit=100)
-    except AutodlNetworkError as e:
-        raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
+        query = JobQuery(name=name, status=status, region=region, gpu_type=gpu_type,
+                         created_after=created_after, created_before=created_before,
+                         name_prefix=name_prefix, sort=sort, limit=limit, cursor=cursor)
+    except InvalidQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not live and state_cache is not None and state_cache.ready:
+        page, next_cursor, total = query.apply(state_cache.list())
+        meta = state_cache.meta()
+    else:
+        try:
+            page, next_cursor, total = await _list_jobs_live(engine, query)
+        except AutodlNetworkError as e:
+            raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
+        meta = {"source": "live"}
+        pass
+
+    meta.update({"next_cursor": next_cursor, "total": total})
+    return ApiResponse(data=[_job_info(d) for d in page], meta=meta)
+
+
+async def _list_jobs_live(engine: JobEngineAutodlAsync, query: JobQuery):
+    """
+    status and name go to AutoDL. In AutoDL's own order (newest first) pages are
+    fetched only until the page is full, otherwise the whole filtered list is sorted here.
+    """
+    if not query.native_order:
+        deployments = await engine.list(name=query.remote_name, status=query.status, page_size=100)
+        return query.apply(deployments)
+
+    page = []
+    async for d in engine.iter_list(name=query.remote_name, status=query.status,
+                                    page_size=min(max(query.limit + 1, 10), 100)):
+        if query.past_range(d):
+            break
+        if query.matches(d) and query.is_after_cursor(d):
+            page.append(d)
+            if len(page) > query.limit:
+                break
+            pass
+        pass
+    # the total is unknown without walking everything
+    return page[:query.limit], query.next_cursor(page[:query.limit], len(page) > query.limit), None
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _job_event_stream(request: Request, state_cache: DeploymentStateCache, queue: asyncio.Queue,
+                            job_uuids: Optional[List[str]] = None):
+    try:
+        yield _sse("ready", state_cache.meta() if state_cache.ready else {"source": "cache"})
+        while True:
+            if await request.is_disconnected():
+                break
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": heartbeat\n\n"
+                continue
+            if job_uuids and event["job_uuid"] is not None and event["job_uuid"] not in job_uuids:
+                continue
+            deployment = event["deployment"]
+            yield _sse(event["type"], {
+                "job_uuid": event["job_uuid"],
+                "status": event["status"],
+                "previous_status": event["previous_status"],
+                "job": _job_info(deployment).model_dump() if deployment is not None else None,
+            })
+            pass
+    finally:
+        state_cache.unsubscribe(queue)
+        pass
+    pass
+
+
+@app.get("/api/v1/jobs/events", dependencies=[Depends(verify_stream_token)])
+async def job_events(
+    request: Request,
+    job_uuid: Optional[List[str]] = Query(None, description="Only stream events of these jobs"),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
+):
+    """
+    Server-Sent Events stream of job status transitions: added / changed / removed,
+    plus resync when the client fell too far behind and should reload the list.
+    """
+    if state_cache is None:
+        raise HTTPException(status_code=503, detail="state table disabled (STATE_REFRESH_INTERVAL=0)")
+    queue = state_cache.subscribe()
+    return StreamingResponse(
+        _job_event_stream(request, state_cache, queue, job_uuid),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    jobs = [
-        JobInfo(
-            uuid=d.uuid,
-            name=d.name,
-            status=d.status,
-            deployment_type=d.deployment_type,
-            region_sign=d.region_sign,
-            dc_list=d.dc_list,
-            gpu_name_set=d.gpu_name_set,
-            created_at=d.created_at.isoformat() if d.created_at else "",
+
+async def _job_finished(engine: JobEngineAutodlAsync, state_cache: Optional[DeploymentStateCache],
+                        job_uuid: str) -> bool:
+    deployment = state_cache.get(job_uuid) if state_cache is not None and state_cache.ready else None
+    status = deployment.status if deployment is not None else await engine.status(job_uuid)
+    return status is None or status in TERMINAL_STATUSES
+
+
+async def _job_log_stream(request: Request, engine: JobEngineAutodlAsync, state_cache: Optional[DeploymentStateCache],
+                          job_uuid: str, offset: int, max_bytes: int, tail_lines: Optional[int]):
+    last_sent = time.monotonic()
+    finished = False
+    while True:
+        if await request.is_disconnected():
+            break
+        try:
+            chunk = await engine.log(job_uuid, offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+        except AutodlNetworkError as e:
+            yield _sse("error", {"job_uuid": job_uuid, "message": e.message})
+            break
+        # tail_lines only picks where to start
+        tail_lines = None
+        progressed = chunk.next_offset != offset
+        if progressed:
+            offset = chunk.next_offset
+            last_sent = time.monotonic()
+            yield _sse("log", chunk.to_dict())
+            pass
+        if progressed and offset < chunk.size:
+            # more is waiting already
+            continue
+        # no progress is caught up too: a trailing partial utf-8 character is held back until it completes
+        if finished:
+            # the job had ended before this read, nothing more will come
+            yield _sse("end", {"job_uuid": job_uuid, "next_offset": offset})
+            break
+        try:
+            finished = await _job_finished(engine, state_cache, job_uuid)
+        except AutodlNetworkError as e:
+            yield _sse("error", {"job_uuid": job_uuid, "message": e.message})
+            break
+        if finished:
+            # one more read for what was written right before the end
+            continue
+        if time.monotonic() - last_sent >= SSE_HEARTBEAT_INTERVAL:
+            last_sent = time.monotonic()
+            yield ": heartbeat\n\n"
+            pass
+        await asyncio.sleep(LOG_FOLLOW_INTERVAL)
+        pass
+    pass
+
+
+@app.get("/api/v1/jobs/{job_uuid}/log", dependencies=[Depends(verify_stream_token)])
+async def get_job_log(
+    request: Request,
+    job_uuid: str,
+    offset: int = Query(0, ge=0, description="Byte offset to read from, next_offset of the previous chunk"),
+    max_bytes: int = Query(LOG_CHUNK_BYTES, ge=4, le=LOG_CHUNK_MAX_BYTES),  # at least one utf-8 character
+    tail_lines: Optional[int] = Query(None, ge=0, description="Start at the last lines instead of offset"),
+    follow: bool = Query(False, description="Stream new output as Server-Sent Events until the job ends"),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
+):
+    """
+    A chunk of the job log {data, offset, next_offset, size}, read by seeking the remote job.log.
+    With follow, `log` events carry such chunks as output arrives and `end` closes the stream.
+    """
+    if follow:
+        return StreamingResponse(
+            _job_log_stream(request, engine, state_cache, job_uuid, offset, max_bytes, tail_lines),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
         )
-        for d in deployments
-    ]
-    return ApiResponse(data=jobs)
+    try:
+        chunk = await engine.log(job_uuid, offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+    except AutodlNetworkError as e:
+        raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
+    return ApiResponse(data=chunk.to_dict())
 
 
 @app.get("/api/v1/jobs/{job_uuid}/status", dependencies=[Depends(verify_token)])
 async def get_job_status(
     job_uuid: str,
-    engine: JobEngineAutodl = Depends(get_engine),
+    live: bool = Query(False, description="Read from AutoDL instead of the state table"),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
 ):
+    if not live and state_cache is not None and state_cache.ready:
+        deployment = state_cache.get(job_uuid)
+        if deployment is not None:
+            return ApiResponse(data={"job_uuid": job_uuid, "status": deployment.status}, meta=state_cache.meta())
+        pass
+
+    # not in the table yet (e.g. just submitted), ask AutoDL
     try:
-        status = engine.status(job_uuid)
+        status = await engine.status(job_uuid)
     except AutodlNetworkError as e:
         raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
 
     if status is None:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    return ApiResponse(data={"job_uuid": job_uuid, "status": status})
+    return ApiResponse(data={"job_uuid": job_uuid, "status": status}, meta={"source": "live"})
+
+
+@app.post("/api/v1/jobs/status:batch", dependencies=[Depends(verify_token)])
+async def get_job_statuses(
+    req: JobStatusBatchRequest,
+    live: bool = Query(False, description="Read from AutoDL instead of the state table"),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
+):
+    statuses = dict()
+    missing = list(req.job_uuids)
+    meta = {"source": "live"}
+    if not live and state_cache is not None and state_cache.ready:
+        missing = []
+        for job_uuid in req.job_uuids:
+            deployment = state_cache.get(job_uuid)
+            if deployment is None:
+                missing.append(job_uuid)
+            else:
+                statuses[job_uuid] = deployment.status
+                pass
+            pass
+        meta = state_cache.meta()
+        pass
+
+    if len(missing) > 0:
+        try:
+            statuses.update(await engine.statuses(missing))
+        except AutodlNetworkError as e:
+            raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
+        pass
+
+    return ApiResponse(data=statuses, meta=meta)
 
 
 @app.post("/api/v1/jobs/{job_uuid}/stop", dependencies=[Depends(verify_token)])
 async def stop_job(
     job_uuid: str,
-    engine: JobEngineAutodl = Depends(get_engine),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
 ):
     try:
-        engine.stop(job_uuid)
+        await engine.stop(job_uuid)
     except AutodlNetworkError as e:
         raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if state_cache is not None:
+        state_cache.request_refresh()
+        pass
     return ApiResponse(data={"job_uuid": job_uuid, "message": "stop signal sent"})
 
 
 @app.delete("/api/v1/jobs/{job_uuid}", dependencies=[Depends(verify_token)])
 async def delete_job(
     job_uuid: str,
-    engine: JobEngineAutodl = Depends(get_engine),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
+    state_cache: Optional[DeploymentStateCache] = Depends(get_state_cache),
 ):
     try:
-        engine.remove(job_uuid)
+        await engine.remove(job_uuid)
     except AutodlNetworkError as e:
         raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if state_cache is not None:
+        state_cache.remove(job_uuid)
+        pass
     return ApiResponse(data={"job_uuid": job_uuid, "message": "deleted"})
 
 
@@ -221,10 +539,10 @@ async def list_regions():
 @app.get("/api/v1/resources/gpu_stock", dependencies=[Depends(verify_token)])
 async def get_gpu_stock(
     region: str = Query("chongqingDC1", description="Region sign"),
-    engine: JobEngineAutodl = Depends(get_engine),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
 ):
     try:
-        stocks = engine.autodl_client.gpu_stock_list(region=region)
+        stocks = await engine.autodl_client.gpu_stock_list(region=region)
     except AutodlNetworkError as e:
         raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
 
@@ -237,10 +555,10 @@ async def get_gpu_stock(
 
 @app.get("/api/v1/resources/images", dependencies=[Depends(verify_token)])
 async def list_images(
-    engine: JobEngineAutodl = Depends(get_engine),
+    engine: JobEngineAutodlAsync = Depends(get_engine),
 ):
     try:
-        images = engine.autodl_client.image_list()
+        images = await engine.autodl_client.image_list()
     except AutodlNetworkError as e:
         raise HTTPException(status_code=502, detail=f"AutoDL error: {e.message}")
 
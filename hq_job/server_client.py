@@ -1,5 +1,7 @@
+import json
 import requests
-from typing import Dict, List, Optional
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from .server_models import JobSubmitRequest, JobInfo, ApiResponse
 
@@ -58,19 +60,128 @@ class HQJobClient:
         resp = self._request("POST", "/api/v1/jobs", json=req.model_dump())
         return resp.data["job_uuid"]
 
-    def list_jobs(self, name: Optional[str] = None) -> List[JobInfo]:
-        """列出任务"""
+    def list_jobs(self, name: Optional[str] = None, status: Optional[str] = None, region: Optional[str] = None,
+                  gpu_type: Optional[str] = None, created_after: Optional[datetime] = None,
+                  created_before: Optional[datetime] = None, name_prefix: Optional[str] = None,
+                  sort: Optional[str] = None, limit: Optional[int] = None,
+                  cursor: Optional[str] = None) -> List[JobInfo]:
+        """列出任务（单页），参数含义见 list_jobs_page"""
+        jobs, _ = self.list_jobs_page(
+            name=name, status=status, region=region, gpu_type=gpu_type, created_after=created_after,
+            created_before=created_before, name_prefix=name_prefix, sort=sort, limit=limit, cursor=cursor)
+        return jobs
+
+    def list_jobs_page(self, name: Optional[str] = None, status: Optional[str] = None, region: Optional[str] = None,
+                       gpu_type: Optional[str] = None, created_after: Optional[datetime] = None,
+                       created_before: Optional[datetime] = None, name_prefix: Optional[str] = None,
+                       sort: Optional[str] = None, limit: Optional[int] = None,
+                       cursor: Optional[str] = None) -> Tuple[List[JobInfo], Optional[str]]:
+        """
+        列出一页任务，返回 (jobs, next_cursor)，next_cursor 为 None 表示没有更多。
+        sort 可选 -created_at（默认）、created_at、name、-name，未设置的参数不会发送。
+        """
         params = {}
-        if name is not None:
-            params["name"] = name
+        for key, value in (("name", name), ("status", status), ("region", region), ("gpu_type", gpu_type),
+                           ("created_after", created_after), ("created_before", created_before),
+                           ("name_prefix", name_prefix), ("sort", sort), ("limit", limit), ("cursor", cursor)):
+            if value is None:
+                continue
+            params[key] = value.isoformat() if isinstance(value, datetime) else value
         resp = self._request("GET", "/api/v1/jobs", params=params)
-        return [JobInfo(**item) for item in resp.data]
+        next_cursor = (resp.meta or {}).get("next_cursor")
+        return [JobInfo(**item) for item in resp.data], next_cursor
+
+    def iter_jobs(self, page_size: int = 100, **filters) -> Iterator[JobInfo]:
+        """按页惰性遍历全部符合条件的任务，filters 同 list_jobs_page"""
+        cursor = None
+        while True:
+            jobs, cursor = self.list_jobs_page(limit=page_size, cursor=cursor, **filters)
+            for job in jobs:
+                yield job
+            if cursor is None:
+                break
 
     def get_job_status(self, job_uuid: str) -> str:
         """获取任务状态"""
         resp = self._request("GET", f"/api/v1/jobs/{job_uuid}/status")
         return resp.data["status"]
 
+    def get_job_statuses(self, job_uuids: List[str]) -> Dict[str, Optional[str]]:
+        """批量获取任务状态，返回 {job_uuid: status}，不存在的任务为 None"""
+        resp = self._request("POST", "/api/v1/jobs/status:batch", json={"job_uuids": list(job_uuids)})
+        return resp.data
+
+    def watch(self, job_uuids: Optional[List[str]] = None, timeout: float = 60) -> Iterator[dict]:
+        """
+        订阅任务状态变化（SSE），逐个产出事件 {"event", "job_uuid", "status", "previous_status", "job"}。
+        event 为 added / changed / removed / resync，resync 表示事件有丢失，需要重新 list_jobs。
+        timeout 为两次收到数据（含心跳）之间的最长等待秒数。
+        """
+        params = {}
+        if job_uuids:
+            params["job_uuid"] = list(job_uuids)
+        for payload in self._events("/api/v1/jobs/events", params, timeout):
+            if payload["event"] != "ready":
+                yield payload
+
+    def get_job_log(self, job_uuid: str, offset: int = 0, max_bytes: Optional[int] = None,
+                    tail_lines: Optional[int] = None) -> dict:
+        """
+        读取一段任务日志，返回 {"data", "offset", "next_offset", "size"}。
+        下次以 next_offset 作为 offset 继续读；tail_lines 表示从最后若干行开始。
+        """
+        params = {"offset": offset}
+        if max_bytes is not None:
+            params["max_bytes"] = max_bytes
+        if tail_lines is not None:
+            params["tail_lines"] = tail_lines
+        return self._request("GET", f"/api/v1/jobs/{job_uuid}/log", params=params).data
+
+    def follow_job_log(self, job_uuid: str, offset: int = 0, tail_lines: Optional[int] = None,
+                       timeout: float = 60) -> Iterator[str]:
+        """持续产出新增的日志内容（SSE），任务结束后返回"""
+        params = {"offset": offset, "follow": "true"}
+        if tail_lines is not None:
+            params["tail_lines"] = tail_lines
+        for payload in self._events(f"/api/v1/jobs/{job_uuid}/log", params, timeout):
+            if payload["event"] == "log":
+                yield payload["data"]
+            elif payload["event"] == "error":
+                raise HQJobClientError(502, payload.get("message", ""))
+            elif payload["event"] == "end":
+                break
+
+    def _events(self, path: str, params: dict, timeout: float) -> Iterator[dict]:
+        """SSE 事件流，产出带 "event" 键的 data 字典"""
+        headers = self._headers()
+        headers["Accept"] = "text/event-stream"
+        resp = requests.get(f"{self.base_url}{path}", headers=headers, params=params,
+                            stream=True, timeout=timeout)
+        if resp.status_code >= 400:
+            detail = resp.json().get("detail", resp.text) if resp.headers.get("content-type", "").startswith("application/json") else resp.text
+            resp.close()
+            raise HQJobClientError(resp.status_code, str(detail))
+
+        try:
+            event, data = None, []
+            for line in resp.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line == "":
+                    if event is not None and data:
+                        payload = json.loads("\n".join(data))
+                        payload["event"] = event
+                        yield payload
+                    event, data = None, []
+                elif line.startswith(":"):
+                    continue
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].lstrip())
+        finally:
+            resp.close()
+
     def stop_job(self, job_uuid: str) -> None:
         """停止任务"""
         self._request("POST", f"/api/v1/jobs/{job_uuid}/stop")
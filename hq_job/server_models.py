@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 
 
@@ -16,6 +16,15 @@ class JobSubmitRequest(BaseModel):
     gpu_num: int = 1
     gpu_name_set: List[str] = []  # GPU 型号列表
     region: str = ""  # 区域
+    requirements: List[str] = []  # pip 依赖，启动前只安装未满足的
+    required_inputs: List[str] = []  # 命令启动前必须下载完成的输入，空表示全部
+    input_concurrency: int = 4  # 同时下载的输入数
+    use_input_cache: bool = True  # 经容器上的输入缓存下载
+    output_sync_interval: int = 300  # 运行中增量上传输出的间隔（秒），<=0 只在结束时上传
+
+
+class JobStatusBatchRequest(BaseModel):
+    job_uuids: List[str]
 
 
 class JobInfo(BaseModel):
@@ -33,3 +42,4 @@ class ApiResponse(BaseModel):
     code: int = 0
     message: str = "ok"
     data: object = None
+    meta: Optional[Dict] = None  # e.g. data source and staleness of cached reads
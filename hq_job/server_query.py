@@ -0,0 +1,146 @@
+import base64
+import json
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from .autodl_client import AutodlDeployment
+
+# sort option -> (field, descending); AutoDL itself lists newest first
+SORT_OPTIONS = {
+    "-created_at": ("created_at", True),
+    "created_at": ("created_at", False),
+    "name": ("name", False),
+    "-name": ("name", True),
+}
+DEFAULT_SORT = "-created_at"
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def _aware(value: Optional[datetime]) -> Optional[datetime]:
+    # naive datetimes from query strings are taken as UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class JobQuery(object):
+    """
+    Filters, sort order and keyset cursor of a job listing.
+
+    The cursor encodes the sort key of the last returned job, so pages stay stable
+    while new jobs are submitted. status and name are meant to be pushed down to
+    AutoDL, everything else is checked here.
+    """
+
+    def __init__(self, name: Optional[str] = None, status: Optional[str] = None, region: Optional[str] = None,
+                 gpu_type: Optional[str] = None, created_after: Optional[datetime] = None,
+                 created_before: Optional[datetime] = None, name_prefix: Optional[str] = None,
+                 sort: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None):
+        sort = sort or DEFAULT_SORT
+        if sort not in SORT_OPTIONS:
+            raise InvalidQuery(f"unknown sort {sort}, expected one of {', '.join(SORT_OPTIONS)}")
+        self.name = name
+        self.status = status
+        self.region = region
+        self.gpu_type = gpu_type
+        self.created_after = _aware(created_after)
+        self.created_before = _aware(created_before)
+        self.name_prefix = name_prefix
+        self.sort = sort
+        self.sort_field, self.descending = SORT_OPTIONS[sort]
+        self.limit = limit
+        self.after = self._decode_cursor(cursor) if cursor else None
+        pass
+
+    # ------------------------------------------------------------------
+    # push down
+    # ------------------------------------------------------------------
+
+    @property
+    def remote_name(self) -> Optional[str]:
+        """name substring for AutoDL, a prefix is a substring too"""
+        return self.name if self.name is not None else self.name_prefix
+
+    @property
+    def native_order(self) -> bool:
+        """whether the AutoDL list order already is the requested order"""
+        return self.sort == DEFAULT_SORT
+
+    def past_range(self, deployment: AutodlDeployment) -> bool:
+        """in AutoDL order, nothing after this deployment can match anymore"""
+        return self.native_order and self.created_after is not None \
+            and deployment.created_at is not None and deployment.created_at < self.created_after
+
+    # ------------------------------------------------------------------
+    # filtering & ordering
+    # ------------------------------------------------------------------
+
+    def matches(self, d: AutodlDeployment) -> bool:
+        if self.name is not None and self.name not in d.name:
+            return False
+        if self.name_prefix is not None and not d.name.startswith(self.name_prefix):
+            return False
+        if self.status is not None and d.status != self.status:
+            return False
+        if self.region is not None and self.region != d.region_sign and self.region not in d.dc_list:
+            return False
+        if self.gpu_type is not None and self.gpu_type not in d.gpu_name_set:
+            return False
+        if self.created_after is not None and (d.created_at is None or d.created_at < self.created_after):
+            return False
+        if self.created_before is not None and (d.created_at is None or d.created_at >= self.created_before):
+            return False
+        return True
+
+    def sort_key(self, d: AutodlDeployment) -> tuple:
+        return getattr(d, self.sort_field), d.uuid
+
+    def is_after_cursor(self, d: AutodlDeployment) -> bool:
+        if self.after is None:
+            return True
+        key = self.sort_key(d)
+        return key < self.after if self.descending else key > self.after
+
+    def apply(self, deployments: Iterable[AutodlDeployment]) -> Tuple[List[AutodlDeployment], Optional[str], int]:
+        """filter, sort and cut one page out of a complete list, returns (page, next_cursor, total)"""
+        matched = [d for d in deployments if self.matches(d)]
+        total = len(matched)
+        matched.sort(key=self.sort_key, reverse=self.descending)
+        matched = [d for d in matched if self.is_after_cursor(d)]
+        page = matched[:self.limit]
+        return page, self.next_cursor(page, len(matched) > self.limit), total
+
+    # ------------------------------------------------------------------
+    # cursor
+    # ------------------------------------------------------------------
+
+    def next_cursor(self, page: List[AutodlDeployment], has_more: bool) -> Optional[str]:
+        if not has_more or len(page) == 0:
+            return None
+        value, uuid = self.sort_key(page[-1])
+        if isinstance(value, datetime):
+            value = value.isoformat()
+            pass
+        payload = json.dumps({"sort": self.sort, "key": [value, uuid]}).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    def _decode_cursor(self, cursor: str) -> tuple:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            value, uuid = payload["key"]
+            sort = payload["sort"]
+        except Exception:
+            raise InvalidQuery("malformed cursor")
+        if sort != self.sort:
+            raise InvalidQuery(f"cursor was issued for sort {sort}, not {self.sort}")
+        if self.sort_field == "created_at":
+            try:
+                value = _aware(datetime.fromisoformat(value))
+            except (TypeError, ValueError):
+                raise InvalidQuery("malformed cursor")
+            pass
+        return value, uuid
+    pass
@@ -0,0 +1,236 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import loguru
+
+from .autodl_client import AutodlDeployment
+
+logger = loguru.logger
+
+# deployments in these states are not expected to change anymore
+TERMINAL_STATUSES = {"stopped"}
+
+# events a subscriber may lag behind before it is told to resync
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+class DeploymentStateCache(object):
+    """
+    In-memory table of AutoDL deployments kept up to date by a background asyncio task,
+    so read endpoints can answer without calling AutoDL.
+
+    Every tick pages through the deployment list, newest first, and stops early once
+    a whole page in a row is already known, unchanged and terminal. Every
+    full_refresh_every ticks the whole list is swept, which also drops deleted deployments.
+
+    Each new snapshot is diffed against the previous one and the transitions
+    (added / changed / removed) are pushed to subscribers.
+    """
+
+    def __init__(self, engine, interval: float = 10.0, page_size: int = 100, full_refresh_every: int = 6):
+        self.engine = engine
+        self.interval = interval
+        self.page_size = page_size
+        self.full_refresh_every = full_refresh_every
+        self.deployments: Dict[str, AutodlDeployment] = dict()  # in AutoDL list order
+        self.refreshed_at: Optional[float] = None
+        self._tick = 0
+        self._task = None
+        self._wakeup = None
+        self._lock = None
+        self._subscribers = set()
+        pass
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        pass
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            pass
+        pass
+
+    def request_refresh(self):
+        """refresh as soon as possible instead of waiting for the next tick"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+            pass
+        pass
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh(full=self._tick % self.full_refresh_every == 0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"refresh deployment state failed: {e}")
+                pass
+            self._tick += 1
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            pass
+        pass
+
+    # ------------------------------------------------------------------
+    # refresh
+    # ------------------------------------------------------------------
+
+    async def refresh(self, full: bool = True):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            pass
+        async with self._lock:
+            client = self.engine.autodl_client
+            url = "/api/v1/dev/deployment/list"
+            seen = dict()
+            unchanged_run = 0
+            complete = True
+            async for deployment in client.iter_pages(url, {}, client._parse_deployment, page_size=self.page_size):
+                seen[deployment.uuid] = deployment
+                if full:
+                    continue
+                known = self.deployments.get(deployment.uuid)
+                if known is not None and known.status == deployment.status \
+                        and deployment.status in TERMINAL_STATUSES:
+                    unchanged_run += 1
+                else:
+                    unchanged_run = 0
+                    pass
+                if unchanged_run >= self.page_size:
+                    complete = False
+                    break
+                pass
+
+            if not complete:
+                # keep the older part of the table which was not swept this time
+                for uuid, deployment in self.deployments.items():
+                    if uuid not in seen:
+                        seen[uuid] = deployment
+                        pass
+                    pass
+                pass
+            self._apply(seen)
+            self.refreshed_at = time.time()
+            pass
+        pass
+
+    def _apply(self, deployments: Dict[str, AutodlDeployment]):
+        previous = self.deployments
+        self.deployments = deployments
+        if self.ready:
+            # the first snapshot is the baseline, not a burst of "added" events
+            for event in self.diff(previous, deployments):
+                self._publish(event)
+                pass
+            pass
+        pass
+
+    @staticmethod
+    def diff(old: Dict[str, AutodlDeployment], new: Dict[str, AutodlDeployment]) -> List[dict]:
+        """status transitions between two snapshots"""
+        events = []
+        for uuid, deployment in new.items():
+            known = old.get(uuid)
+            if known is None:
+                events.append({"type": "added", "job_uuid": uuid, "status": deployment.status,
+                               "previous_status": None, "deployment": deployment})
+            elif known.status != deployment.status:
+                events.append({"type": "changed", "job_uuid": uuid, "status": deployment.status,
+                               "previous_status": known.status, "deployment": deployment})
+                pass
+            pass
+        for uuid, known in old.items():
+            if uuid not in new:
+                events.append({"type": "removed", "job_uuid": uuid, "status": None,
+                               "previous_status": known.status, "deployment": None})
+                pass
+            pass
+        return events
+
+    # ------------------------------------------------------------------
+    # subscriptions
+    # ------------------------------------------------------------------
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+        pass
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _publish(self, event: dict):
+        for queue in self._subscribers:
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # a slow consumer: drop its backlog and tell it to reload the list
+                while not queue.empty():
+                    queue.get_nowait()
+                    pass
+                queue.put_nowait({"type": "resync", "job_uuid": None, "status": None,
+                                  "previous_status": None, "deployment": None})
+                pass
+            pass
+        pass
+
+    # ------------------------------------------------------------------
+    # reads & write-through
+    # ------------------------------------------------------------------
+
+    @property
+    def ready(self) -> bool:
+        return self.refreshed_at is not None
+
+    def age(self) -> Optional[float]:
+        if self.refreshed_at is None:
+            return None
+        return time.time() - self.refreshed_at
+
+    def meta(self) -> dict:
+        return {
+            "source": "cache",
+            "refreshed_at": datetime.fromtimestamp(self.refreshed_at, tz=timezone.utc).isoformat(),
+            "age_seconds": round(self.age(), 3),
+        }
+
+    def list(self, name: Optional[str] = None, limit: Optional[int] = None) -> List[AutodlDeployment]:
+        deployments = [d for d in self.deployments.values() if name is None or name in d.name]
+        if limit is not None:
+            deployments = deployments[:limit]
+            pass
+        return deployments
+
+    def get(self, deployment_uuid: str) -> Optional[AutodlDeployment]:
+        return self.deployments.get(deployment_uuid)
+
+    def remove(self, deployment_uuid: str):
+        if deployment_uuid in self.deployments:
+            deployments = dict(self.deployments)
+            deployments.pop(deployment_uuid)
+            self._apply(deployments)
+            pass
+        pass
+    pass
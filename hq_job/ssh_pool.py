@@ -0,0 +1,229 @@
+import os
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+import fabric
+import loguru
+from invoke.exceptions import UnexpectedExit
+
+logger = loguru.logger
+
+DEFAULT_IDLE_TIMEOUT = 300      # seconds an unused connection is kept
+DEFAULT_MAX_PER_KEY = 8         # connections to one (host, port, user), more checkouts wait
+DEFAULT_HEALTH_CHECK_AFTER = 30  # idle seconds after which a checkout probes the connection first
+DEFAULT_CONNECT_TIMEOUT = 10
+
+# errors after which the connection is still good: the command or the remote file failed, not ssh
+_CONNECTION_SAFE_ERRORS = (UnexpectedExit, FileNotFoundError, PermissionError)
+
+
+class _Pooled(object):
+    def __init__(self, conn: fabric.Connection, secret: tuple):
+        self.conn = conn
+        self.secret = secret
+        self.idle_since = time.monotonic()
+        pass
+    pass
+
+
+class SSHConnectionPool(object):
+    """
+    Opened fabric connections kept for reuse, keyed by (host, port, user).
+
+    A checkout takes the most recently returned idle connection of its key, one that was
+    idle longer than health_check_after is probed with a session open first. Idle
+    connections are closed after idle_timeout, dead or failed ones are dropped and
+    replaced by a new handshake. At most max_per_key connections of a key are out at
+    a time, a checkout beyond waits. Thread safe, a connection is used by one holder.
+    """
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, max_per_key: int = DEFAULT_MAX_PER_KEY,
+                 health_check_after: float = DEFAULT_HEALTH_CHECK_AFTER,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.max_per_key = max_per_key
+        self.health_check_after = health_check_after
+        self.connect_timeout = connect_timeout
+        self._idle: Dict[tuple, List[_Pooled]] = dict()
+        self._out: Dict[tuple, int] = dict()
+        # id of a checked out connection -> (key, secret)
+        self._checked_out: Dict[int, tuple] = dict()
+        self._condition = threading.Condition()
+        self.requests = 0
+        self.new_connections = 0
+        pass
+
+    def _expire(self, now: float) -> List[_Pooled]:
+        """take the idle connections past idle_timeout out, closed by the caller outside the lock"""
+        expired = []
+        for key in list(self._idle):
+            kept = [p for p in self._idle[key] if now - p.idle_since < self.idle_timeout]
+            expired.extend(p for p in self._idle[key] if now - p.idle_since >= self.idle_timeout)
+            self._idle[key] = kept
+            if len(kept) == 0:
+                del self._idle[key]
+                pass
+            pass
+        return expired
+
+    @staticmethod
+    def _close(pooled: List[_Pooled]):
+        for p in pooled:
+            try:
+                p.conn.close()
+            except Exception as e:
+                logger.debug(f"closing ssh connection to {p.conn.host}:{p.conn.port} failed: {e}")
+                pass
+            pass
+        pass
+
+    def _healthy(self, pooled: _Pooled, now: float) -> bool:
+        transport = pooled.conn.client.get_transport() if pooled.conn.is_connected else None
+        if transport is None or not transport.is_active():
+            return False
+        if now - pooled.idle_since < self.health_check_after:
+            return True
+        try:
+            transport.open_session(timeout=self.connect_timeout).close()
+            return True
+        except Exception:
+            return False
+
+    def checkout(self, host: str, username: str, password=None, port=22, key_file=None) -> fabric.Connection:
+        key = (host, int(port), username)
+        secret = (password, key_file)
+        with self._condition:
+            self.requests += 1
+            pass
+        while True:
+            stale = []
+            with self._condition:
+                while self._out.get(key, 0) >= self.max_per_key:
+                    self._condition.wait()
+                    pass
+                now = time.monotonic()
+                stale.extend(self._expire(now))
+                idle = self._idle.get(key, [])
+                # a container may come back on the same port with a new password
+                stale.extend(p for p in idle if p.secret != secret)
+                idle[:] = [p for p in idle if p.secret == secret]
+                pooled = idle.pop() if len(idle) > 0 else None
+                self._out[key] = self._out.get(key, 0) + 1
+                pass
+            self._close(stale)
+            if pooled is None:
+                break
+            if self._healthy(pooled, now):
+                with self._condition:
+                    self._checked_out[id(pooled.conn)] = (key, secret)
+                    pass
+                return pooled.conn
+            logger.info(f"pooled ssh connection to {host}:{port} is dead, dropped")
+            self._close([pooled])
+            self._release(key)
+            pass
+
+        connect_kwargs = dict()
+        if password is not None:
+            connect_kwargs["password"] = password
+            pass
+        if key_file is not None:
+            connect_kwargs["key_filename"] = key_file
+            pass
+        conn = fabric.Connection(host=host, user=username, port=int(port), connect_kwargs=connect_kwargs,
+                                 connect_timeout=self.connect_timeout)
+        try:
+            conn.open()
+        except BaseException:
+            self._release(key)
+            raise
+        with self._condition:
+            self.new_connections += 1
+            self._checked_out[id(conn)] = (key, secret)
+            pass
+        return conn
+
+    def _release(self, key: tuple):
+        with self._condition:
+            self._out[key] -= 1
+            if self._out[key] == 0:
+                del self._out[key]
+                pass
+            self._condition.notify_all()
+            pass
+        pass
+
+    def checkin(self, conn: fabric.Connection, healthy: bool = True):
+        """return a checked out connection, healthy=False closes it instead"""
+        with self._condition:
+            key, secret = self._checked_out.pop(id(conn))
+            pass
+        if healthy and conn.is_connected:
+            with self._condition:
+                self._idle.setdefault(key, []).append(_Pooled(conn, secret))
+                pass
+        else:
+            self._close([_Pooled(conn, secret)])
+            pass
+        self._release(key)
+        pass
+
+    @contextmanager
+    def connection(self, host: str, username: str, password=None, port=22,
+                   key_file=None) -> Iterator[fabric.Connection]:
+        conn = self.checkout(host, username, password, port, key_file)
+        healthy = False
+        try:
+            yield conn
+            healthy = True
+        except _CONNECTION_SAFE_ERRORS:
+            healthy = True
+            raise
+        finally:
+            self.checkin(conn, healthy)
+            pass
+        pass
+
+    def close(self):
+        """close the idle connections"""
+        with self._condition:
+            idle = [p for pooled in self._idle.values() for p in pooled]
+            self._idle = dict()
+            pass
+        self._close(idle)
+        pass
+
+    def to_dict(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": max(self.requests - self.new_connections, 0),
+                "idle_connections": sum(len(p) for p in self._idle.values()),
+            }
+    pass
+
+
+_default_pool: Optional[SSHConnectionPool] = None
+_default_lock = threading.Lock()
+
+
+def default_pool() -> SSHConnectionPool:
+    """the pool shared by all ssh paths of the process, HQJOB_SSH_IDLE_TIMEOUT/HQJOB_SSH_MAX_PER_HOST to tune"""
+    global _default_pool
+    with _default_lock:
+        if _default_pool is None:
+            _default_pool = SSHConnectionPool(
+                idle_timeout=float(os.environ.get("HQJOB_SSH_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT)),
+                max_per_key=int(os.environ.get("HQJOB_SSH_MAX_PER_HOST", DEFAULT_MAX_PER_KEY)))
+            atexit.register(_default_pool.close)
+            pass
+        return _default_pool
+
+
+def connection(host: str, username: str, password=None, port=22, key_file=None):
+    """a connection of the default pool for a with block"""
+    return default_pool().connection(host, username, password, port, key_file)
@@ -1,24 +1,77 @@
 
+import shlex
+from typing import Dict, List, Optional, Tuple
+
 from .storage.scp import SCPStorage
-import fabric
+from . import file_utils
+from . import ssh_pool
 
 
-def download_file(remote_path: str, local_path: str, host: str, username: str, password=None, port=22, key_file=None, ignores=""):
+def download_file(remote_path: str, local_path: str, host: str, username: str, password=None, port=22, key_file=None, ignores="",
+                  mode: str = "stream", codec: str = "gzip", workers: int = 4):
     storage = SCPStorage(host=host, username=username, password=password, port=port, key_file=key_file)
-    storage.download_file(remote_path, local_path, ignores=ignores)
+    storage.download_file(remote_path, local_path, ignores=ignores, mode=mode, codec=codec, workers=workers)
     pass
 
 
 def execute_command(command: str, host: str, username: str, password=None, port=22, key_file=None):
-    connect_kwargs = dict()
-    if password is not None:
-        connect_kwargs["password"] = password
+    with ssh_pool.connection(host, username, password, port, key_file) as conn:
+        result = conn.run(command, hide=True, in_stream=False)
+        return result.stdout.strip()
+    pass
+
+
+def read_file_chunk(remote_path: str, host: str, username: str, password=None, port=22, key_file=None,
+                    offset: int = 0, max_bytes: Optional[int] = None,
+                    tail_lines: Optional[int] = None) -> Tuple[bytes, int, int, int]:
+    """read part of a remote file over sftp by seeking, returns (data, start, next_offset, size)"""
+    with ssh_pool.connection(host, username, password, port, key_file) as conn:
+        sftp = conn.sftp()
+        with sftp.open(remote_path, "rb") as f:
+            size = f.stat().st_size
+            data, start, next_offset = file_utils.read_chunk(
+                f, size, offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+            pass
         pass
-    if key_file is not None:
-        connect_kwargs["key_filename"] = key_file
+    return data, start, next_offset, size
+
+
+def parse_find_output(output: str) -> List[Tuple[str, int, str]]:
+    """(relative path, size, mtime) from `find -printf '%s\\t%T@\\t%P\\n'`"""
+    files = []
+    for line in output.splitlines():
+        parts = line.split("\t", 2)
+        if len(parts) != 3 or parts[2] == "":
+            continue
+        files.append((parts[2], int(parts[0]), parts[1]))
         pass
-    
-    with fabric.Connection(host=host, user=username, port=port, connect_kwargs=connect_kwargs) as conn:
-        result = conn.run(command, hide=True)
-        return result.stdout.strip()
-    pass
\ No newline at end of file
+    return files
+
+
+def list_remote_files(remote_dir: str, host: str, username: str, password=None, port=22,
+                      key_file=None) -> List[Tuple[str, int, str]]:
+    """(relative path, size, mtime) of the files below remote_dir"""
+    with ssh_pool.connection(host, username, password, port, key_file) as conn:
+        result = conn.run(f"find {shlex.quote(remote_dir)} -type f -printf '%s\\t%T@\\t%P\\n'",
+                          hide=True, in_stream=False)
+        return parse_find_output(result.stdout)
+
+
+def remote_md5(remote_dir: str, paths: List[str], host: str, username: str, password=None, port=22,
+               key_file=None, batch_size: int = 200) -> Dict[str, str]:
+    """md5 of files relative to remote_dir, missing ones are left out"""
+    md5 = dict()
+    with ssh_pool.connection(host, username, password, port, key_file) as conn:
+        for i in range(0, len(paths), batch_size):
+            batch = " ".join(shlex.quote(p) for p in paths[i:i + batch_size])
+            result = conn.run(f"cd {shlex.quote(remote_dir)} && md5sum -- {batch}",
+                              hide=True, warn=True, in_stream=False)
+            for line in result.stdout.splitlines():
+                parts = line.split("  ", 1)
+                if len(parts) == 2:
+                    md5[parts[1]] = parts[0]
+                    pass
+                pass
+            pass
+        pass
+    return md5
@@ -1,9 +1,42 @@
 
+import os
+import threading
+from .base import StorageBase
 from .coscmd import COSCMDStorage
 
+_cos_storage = None
+_cos_lock = threading.Lock()
+
+
+def cos_storage() -> StorageBase:
+    """
+    the backend of cos:// paths, shared by all transfers of the process: the COS SDK
+    when its config (~/.cos.conf or HQJOB_COS_CONFIG) is there, coscmd otherwise
+    """
+    global _cos_storage
+    with _cos_lock:
+        if _cos_storage is None:
+            from .cos import COSStorage, DEFAULT_CONFIG_FILE
+            if os.path.exists(os.environ.get("HQJOB_COS_CONFIG", DEFAULT_CONFIG_FILE)):
+                _cos_storage = COSStorage()
+            else:
+                _cos_storage = COSCMDStorage()
+                pass
+            pass
+        return _cos_storage
+
+
+def cos_client():
+    """the COSClient behind cos_storage(), FileNotFoundError without a COS config"""
+    storage = cos_storage()
+    if not hasattr(storage, "client"):
+        raise FileNotFoundError("no COS config, cos:// paths go through coscmd")
+    return storage.client
+
+
 def download_file(remote_path: str, local_path: str):
     if remote_path.startswith("cos://"):
-        storage = COSCMDStorage()
+        storage = cos_storage()
         storage.download_file(remote_path, local_path)
         pass
     else:
@@ -12,9 +45,19 @@ def download_file(remote_path: str, local_path: str):
 
 def upload_file(local_path: str, remote_path: str):
     if remote_path.startswith("cos://"):
-        storage = COSCMDStorage()
+        storage = cos_storage()
         storage.upload_file(local_path, remote_path)
         pass
     else:
         raise NotImplementedError(f"Unsupported storage type in path: {remote_path}")
-    pass
\ No newline at end of file
+    pass
+
+
+def open_file(remote_path: str):
+    """a readable stream of a remote file, NotImplementedError when its backend can only download"""
+    if remote_path.startswith("cos://"):
+        storage = cos_storage()
+        return storage.open_file(remote_path)
+    else:
+        raise NotImplementedError(f"Unsupported storage type in path: {remote_path}")
+    pass
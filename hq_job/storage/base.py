@@ -10,4 +10,9 @@ class StorageBase:
     
     def upload_file(self, local_path: str, remote_path: str):
         raise NotImplementedError(
-        )
\ No newline at end of file
+        )
+
+    def open_file(self, remote_path: str):
+        """a readable stream of a remote file, for backends that can stream"""
+        raise NotImplementedError(
+        )
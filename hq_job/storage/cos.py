@@ -1,21 +1,63 @@
-
 from qcloud_cos import CosConfig, CosS3Client, CosClientError, CosServiceError
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
 import os
 import configparser
+import threading
+import loguru
 import pydantic
+from .base import StorageBase
+
+logger = loguru.logger
+
+# the coscmd config, also read by this backend
+DEFAULT_CONFIG_FILE = os.path.join(os.path.expanduser("~"), ".cos.conf")
+# ranged downloads keep their progress here, an interrupted download goes on from it
+DEFAULT_CHECKPOINT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "hq_job", "cos")
+DEFAULT_PART_SIZE = 8       # MB, files up to one part go in a single request
+DEFAULT_MAX_THREAD = 5      # parts of one file in flight
+DEFAULT_MAX_WORKERS = 4     # files of a folder in flight
+DEFAULT_RETRY = 3
+
+# progress(key, transferred bytes, total bytes)
+ProgressCallback = Callable[[str, int, int], None]
+
 
 class COSFileInfo(pydantic.BaseModel):
     Key: str
     Size: int
     StorageClass: str
+    ETag: str = ""
+
 
 class COSClient(object):
-    def __init__(self, config_file: str = None):
+    """
+    Transfers with the COS SDK through one shared CosS3Client.
+
+    Files larger than part_size (MB) are moved in parts, max_thread parts at a time,
+    folders max_workers files at a time. Multipart uploads are resumed from the parts
+    COS already holds, ranged downloads from their checkpoint in checkpoint_dir, so a
+    retry only moves what is missing. The config is the coscmd one (~/.cos.conf, or
+    HQJOB_COS_CONFIG), its part_size, max_thread and retry apply unless given here.
+    """
+
+    def __init__(self, config_file: str = None, part_size: Optional[int] = None, max_thread: Optional[int] = None,
+                 max_workers: Optional[int] = None, retry: Optional[int] = None, checkpoint_dir: Optional[str] = None):
         if config_file is None:
-            config_file = os.path.join(os.path.expanduser("~"), ".cos.conf")
+            config_file = os.environ.get("HQJOB_COS_CONFIG", DEFAULT_CONFIG_FILE)
             pass
 
         self._load_config(config_file)
+        self.part_size = part_size or self.part_size
+        self.max_thread = max_thread or self.max_thread
+        self.max_workers = max_workers or self.max_workers
+        self.retry = retry or self.retry
+        self.checkpoint_dir = checkpoint_dir or DEFAULT_CHECKPOINT_DIR
+        # enough connections for every part of every file in flight
+        pool_size = max(10, self.max_thread * self.max_workers)
+        config = CosConfig(Region=self.region, SecretId=self.secret_id, SecretKey=self.secret_key,
+                           Scheme=self.scheme, Domain=self.domain, PoolConnections=pool_size, PoolMaxSize=pool_size)
+        self.client = CosS3Client(config)
         pass
 
     def _load_config(self, config_file: str):
@@ -24,54 +66,156 @@ class COSClient(object):
             pass
         parser = configparser.ConfigParser()
         parser.read(config_file)
-        # print all items
-        self.secret_id = parser['common']['secret_id']
-        self.secret_key = parser['common']['secret_key']
-        self.region = parser['common']['region']
-        self.bucket = parser['common']['bucket']
+        common = parser['common']
+        self.secret_id = common['secret_id']
+        self.secret_key = common['secret_key']
+        self.region = common['region']
+        self.bucket = common['bucket']
+        self.scheme = common.get('schema', 'https')
+        # a custom domain (or host:port) instead of <bucket>.cos.<region>.myqcloud.com
+        self.domain = common.get('domain') or None
+        self.part_size = common.getint('part_size', DEFAULT_PART_SIZE)
+        self.max_thread = common.getint('max_thread', DEFAULT_MAX_THREAD)
+        self.max_workers = common.getint('max_workers', DEFAULT_MAX_WORKERS)
+        self.retry = common.getint('retry', DEFAULT_RETRY)
         pass
 
-    
-    def download_folder(self, cos_prefix: str, local_dir: str):
+    def _retrying(self, what: str, func: Callable):
+        for i in range(self.retry):
+            try:
+                return func()
+            except (CosClientError, CosServiceError) as e:
+                # a missing object or a denied request stays that way
+                if i == self.retry - 1 or (isinstance(e, CosServiceError) and e.get_status_code() < 500):
+                    raise
+                logger.warning(f"{what} failed ({e}), try again")
+                pass
+            pass
+        pass
+
+    @staticmethod
+    def _sdk_progress(key: str, progress: Optional[ProgressCallback], reported: list):
+        if progress is None:
+            return None
+
+        def callback(consumed: int, total: int):
+            reported[0] = consumed
+            progress(key, consumed, total)
+            pass
+        return callback
+
+    def download_file(self, cos_path: str, local_path: str, progress: Optional[ProgressCallback] = None):
+        local_folder = os.path.dirname(os.path.abspath(local_path))
+        os.makedirs(local_folder, exist_ok=True)
+        reported = [0]
+        callback = self._sdk_progress(cos_path, progress, reported)
+        self._retrying(f"download {cos_path}", lambda: self.client.download_file(
+            Bucket=self.bucket,
+            Key=cos_path,
+            DestFilePath=local_path,
+            PartSize=self.part_size,
+            MAXThread=self.max_thread,
+            progress_callback=callback,
+            DumpRecordDir=self.checkpoint_dir))
+        # single request transfers don't report
+        size = os.path.getsize(local_path)
+        if progress is not None and reported[0] < size:
+            progress(cos_path, size, size)
+            pass
+        pass
+
+    def upload_file(self, local_path: str, cos_path: str, progress: Optional[ProgressCallback] = None):
+        reported = [0]
+        callback = self._sdk_progress(cos_path, progress, reported)
+        self._retrying(f"upload {cos_path}", lambda: self.client.upload_file(
+            Bucket=self.bucket,
+            Key=cos_path,
+            LocalFilePath=local_path,
+            PartSize=self.part_size,
+            MAXThread=self.max_thread,
+            progress_callback=callback))
+        size = os.path.getsize(local_path)
+        if progress is not None and reported[0] < size:
+            progress(cos_path, size, size)
+            pass
+        pass
+
+    def open_file(self, cos_path: str):
+        """the body of an object as a readable stream, FileNotFoundError when there is no such object"""
+        try:
+            response = self._retrying(f"open {cos_path}", lambda: self.client.get_object(
+                Bucket=self.bucket,
+                Key=cos_path))
+        except CosServiceError as e:
+            if e.get_status_code() == 404:
+                raise FileNotFoundError(f"cos://{cos_path} not found")
+            raise
+        return response['Body'].get_raw_stream()
+
+    def _run_all(self, what: str, transfers: List[Tuple[str, Callable]]):
+        """run the transfers max_workers at a time, RuntimeError naming the failed ones at the end"""
+        failed = []
+        lock = threading.Lock()
+
+        def run(name: str, func: Callable):
+            try:
+                func()
+            except Exception as e:
+                logger.error(f"{what} {name} failed: {e}")
+                with lock:
+                    failed.append(name)
+                    pass
+                pass
+            pass
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hq_job_cos") as executor:
+            for name, func in transfers:
+                executor.submit(run, name, func)
+                pass
+            pass
+        if len(failed) > 0:
+            raise RuntimeError(f"{what} failed for {len(failed)} of {len(transfers)} files: {sorted(failed)}")
+        pass
+
+    def download_folder(self, cos_prefix: str, local_dir: str, progress: Optional[ProgressCallback] = None):
         files = self.list_files(prefix=cos_prefix)
         os.makedirs(local_dir, exist_ok=True)
+        transfers = []
         for f in files:
+            if f.Key.endswith("/"):
+                continue
             relative_path = os.path.relpath(f.Key, cos_prefix)
             local_path = os.path.join(local_dir, relative_path)
-            local_folder = os.path.dirname(local_path)
-            os.makedirs(local_folder, exist_ok=True)
-            self.download_file(f.Key, local_path)
+            transfers.append((f.Key, lambda key=f.Key, path=local_path: self.download_file(key, path, progress)))
             pass
+        self._run_all("download", transfers)
         pass
-    
-    def download_file(self, cos_path: str, local_path: str):
-        config = CosConfig(Region=self.region, SecretId=self.secret_id, SecretKey=self.secret_key)
-        client = CosS3Client(config)
-        for i in range(0, 10):
-            try:
-                response = client.download_file(
-                    Bucket=self.bucket,
-                    Key=cos_path,
-                    DestFilePath=local_path)
-                break
-            except CosClientError or CosServiceError as e:
+
+    def upload_folder(self, local_dir: str, cos_prefix: str, progress: Optional[ProgressCallback] = None):
+        if cos_prefix != "" and not cos_prefix.endswith("/"):
+            cos_prefix += "/"
+            pass
+        transfers = []
+        for root, dirs, files in os.walk(local_dir):
+            for file in files:
+                local_path = os.path.join(root, file)
+                key = cos_prefix + os.path.relpath(local_path, local_dir).replace(os.sep, "/")
+                transfers.append((key, lambda path=local_path, key=key: self.upload_file(path, key, progress)))
                 pass
             pass
+        self._run_all("upload", transfers)
         pass
 
     def list_files(self, prefix: str = ""):
-        config = CosConfig(Region=self.region, SecretId=self.secret_id, SecretKey=self.secret_key)
-        client = CosS3Client(config)
-
         marker = ""
         files = []
         while True:
-            response = client.list_objects(
+            response = self._retrying(f"list {prefix}", lambda: self.client.list_objects(
                 Bucket=self.bucket,
                 Prefix=prefix,
                 Marker=marker,
                 MaxKeys=1000
-            )
+            ))
             if 'Contents' in response:
                 for item in response['Contents']:
                     files.append(COSFileInfo(**item))
@@ -84,4 +228,45 @@ class COSClient(object):
                 break
             pass
 
-        return files
\ No newline at end of file
+        return files
+
+
+class COSStorage(StorageBase):
+    """cos://<key> paths with the coscmd semantics: a trailing / is a folder, uploaded dirs keep their layout"""
+
+    def __init__(self, client: COSClient = None, progress: Optional[ProgressCallback] = None):
+        super().__init__()
+        self.client = client or COSClient()
+        self.progress = progress
+        pass
+
+    def download_file(self, remote_path: str, local_path: str):
+        if remote_path.startswith("cos://"):
+            remote_path = remote_path[len("cos://"):]
+            pass
+        if remote_path.endswith("/"):
+            self.client.download_folder(remote_path, local_path, self.progress)
+        else:
+            self.client.download_file(remote_path, local_path, self.progress)
+            pass
+        pass
+
+    def upload_file(self, local_path: str, remote_path: str):
+        if remote_path.startswith("cos://"):
+            remote_path = remote_path[len("cos://"):]
+            pass
+        if os.path.isdir(local_path):
+            self.client.upload_folder(local_path, remote_path, self.progress)
+            return
+        if remote_path == "" or remote_path.endswith("/"):
+            remote_path += os.path.basename(local_path)
+            pass
+        self.client.upload_file(local_path, remote_path, self.progress)
+        pass
+
+    def open_file(self, remote_path: str):
+        if remote_path.startswith("cos://"):
+            remote_path = remote_path[len("cos://"):]
+            pass
+        return self.client.open_file(remote_path)
+    pass
@@ -1,11 +1,43 @@
 
-
 import os
+import stat
+import shlex
+import shutil
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Tuple
 from .base import StorageBase
-import fabric
+from .. import file_utils
+from .. import ssh_pool
+import loguru
+
+logger = loguru.logger
+
+# codecs of the remote tar stream -> tar flags
+STREAM_CODECS = {"none": "", "gzip": "-z", "zstd": "-I 'zstd -q -T0 -3'"}
+# a large channel window keeps the stream going on links with a long round trip
+STREAM_WINDOW_SIZE = 16 * 1024 * 1024
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+
+def is_ignored(relative_path: str, ignores: str) -> bool:
+    """tar --exclude semantics: the pattern matches the path or any of its names"""
+    if len(ignores) == 0:
+        return False
+    return fnmatch.fnmatch(relative_path, ignores) or any(
+        fnmatch.fnmatch(name, ignores) for name in relative_path.split("/"))
 
 
 class SCPStorage(StorageBase):
+    """
+    Downloads over SSH. A remote dir (path ending with /) lands in <local_path>/<dir name>,
+    either streamed as one tar piped over the channel into a local extractor
+    (mode "stream", codec none, gzip or zstd), or file by file over workers parallel
+    SFTP connections (mode "sftp", for trees of large files). Nothing is staged on disk.
+    Connections come from the shared ssh_pool.
+    """
+
     def __init__(self, host, username, password=None, port=22, key_file=None) -> None:
         super().__init__()
         self.host = host
@@ -14,61 +46,117 @@ class SCPStorage(StorageBase):
         self.port = port
         self.key_file = key_file
 
-    def download_file(self, remote_path: str, local_path: str, ignores: str = ""):
+    def _connection(self):
+        """a connection of the shared pool for a with block"""
+        return ssh_pool.connection(self.host, self.username, self.password, self.port, self.key_file)
+
+    def download_file(self, remote_path: str, local_path: str, ignores: str = "", mode: str = "stream",
+                      codec: str = "gzip", workers: int = 4):
         if remote_path.endswith("/"):
             # recursive download
-            connect_kwargs = dict()
-            if self.password is not None:
-                connect_kwargs["password"] = self.password
+            basename = os.path.basename(remote_path.rstrip("/"))
+            target_path = os.path.join(local_path, basename)
+            if os.path.exists(target_path):
+                raise RuntimeError(f"target path {target_path} exists")
+            # renamed when complete, a failed download leaves no half tree at the target
+            part_path = target_path + ".part"
+            shutil.rmtree(part_path, ignore_errors=True)
+            os.makedirs(part_path)
+            try:
+                if mode == "stream":
+                    files, total = self._stream_dir(remote_path, part_path, ignores, codec)
+                elif mode == "sftp":
+                    files, total = self._sftp_dir(remote_path, part_path, ignores, workers)
+                else:
+                    raise ValueError(f"Unsupported download mode: {mode}")
+            except BaseException:
+                shutil.rmtree(part_path, ignore_errors=True)
+                raise
+            os.rename(part_path, target_path)
+            logger.info(f"downloaded {files} files ({total} bytes) of {remote_path} to {target_path}")
+            pass
+        else:
+            self.download_file_single(remote_path, local_path)
+        pass
+
+    def _stream_dir(self, remote_path: str, destination: str, ignores: str, codec: str) -> Tuple[int, int]:
+        if codec not in STREAM_CODECS:
+            raise ValueError(f"Unsupported stream codec: {codec}")
+        # without zstandard here the stream is gzip
+        codec = file_utils.resolve_codec(codec)
+        command = f"tar {STREAM_CODECS[codec]} -cf - -C {shlex.quote(remote_path)}"
+        if len(ignores) > 0:
+            command += f" --exclude={shlex.quote(ignores)}"
+            pass
+        command += " ."
+        with self._connection() as conn:
+            channel = conn.client.get_transport().open_session(window_size=STREAM_WINDOW_SIZE)
+            try:
+                channel.exec_command(command)
+                stdout = channel.makefile("rb", STREAM_BUFFER_SIZE)
+                result = file_utils.extract_stream(stdout, destination, codec)
+                # tar exits 1 when files changed while they were read, e.g. outputs of a running job
+                status = channel.recv_exit_status()
+                errors = channel.makefile_stderr("rb").read().decode("utf-8", "replace").strip()
+            finally:
+                channel.close()
                 pass
-            if self.key_file is not None:
-                connect_kwargs["key_filename"] = self.key_file
+            pass
+        if status == 1:
+            logger.warning(f"{remote_path} changed while it was streamed: {errors}")
+        elif status != 0:
+            raise RuntimeError(f"remote tar of {remote_path} failed ({status}): {errors}")
+        return result
+
+    @staticmethod
+    def _walk(sftp, remote_dir: str, relative: str = "") -> Iterator[Tuple[str, int]]:
+        """(relative path, size) of the regular files below remote_dir"""
+        for attr in sftp.listdir_attr(remote_dir + relative):
+            path = relative + attr.filename
+            if stat.S_ISDIR(attr.st_mode):
+                yield from SCPStorage._walk(sftp, remote_dir, path + "/")
+            elif stat.S_ISREG(attr.st_mode):
+                yield path, attr.st_size
                 pass
-            with fabric.Connection(
-                host=self.host, user=self.username, port=self.port, connect_kwargs=connect_kwargs,
-                connect_timeout=5) as conn:
-                # pack dir
-                basename = os.path.basename(remote_path.rstrip("/"))
-                tmp_file = f"/tmp/{basename}.tar.gz"
-                pack_command = f"rm -rf {tmp_file} && tar -czf {tmp_file} -C {remote_path}"
-                if len(ignores) > 0:
-                    pack_command += f" --exclude='{ignores}'"
+            pass
+        pass
+
+    def _sftp_dir(self, remote_path: str, destination: str, ignores: str, workers: int) -> Tuple[int, int]:
+        with self._connection() as conn:
+            files = [(path, size) for path, size in self._walk(conn.sftp(), remote_path)
+                     if not is_ignored(path, ignores)]
+            pass
+        failed = []
+        lock = threading.Lock()
+
+        def download(path: str):
+            local_path = os.path.join(destination, path)
+            try:
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                # every transfer in flight on a pooled connection of its own
+                with self._connection() as conn:
+                    conn.get(remote=remote_path + path, local=local_path)
                     pass
-                pack_command += " ."
-                conn.run(pack_command)
-                try:
-                    if os.path.exists(tmp_file):
-                        # remove old tmp file
-                        os.remove(tmp_file)
-                        pass
-                    conn.get(remote=tmp_file, local=tmp_file)
-                    target_path = os.path.join(local_path, basename)
-                    if os.path.exists(target_path):
-                        raise RuntimeError(f"target path {target_path} exists")
-                    os.makedirs(target_path, exist_ok=True)
-                    os.system(f"tar -xzf {tmp_file} -C {target_path}")
-                finally:
-                    if os.path.exists(tmp_file):
-                        os.remove(tmp_file)
-                        pass
-                    conn.run(f"rm -rf {tmp_file}")
+            except Exception as e:
+                logger.error(f"download {remote_path + path} failed: {e}")
+                with lock:
+                    failed.append(path)
                     pass
                 pass
             pass
-        else:
-            self.download_file_single(remote_path, local_path)
-        pass
-    
-    def download_file_single(self, remote_path: str, local_path: str):
-        connect_kwargs = dict()
-        if self.password is not None:
-            connect_kwargs["password"] = self.password
-            pass
-        if self.key_file is not None:
-            connect_kwargs["key_filename"] = self.key_file
+
+        # largest first, the last transfers in flight are short ones
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hq_job_sftp") as executor:
+            for path, _ in sorted(files, key=lambda f: -f[1]):
+                executor.submit(download, path)
+                pass
             pass
-        
-        with fabric.Connection(host=self.host, user=self.username, port=self.port, connect_kwargs=connect_kwargs) as conn:
+        if len(failed) > 0:
+            raise RuntimeError(f"download failed for {len(failed)} of {len(files)} files: {sorted(failed)}")
+        return len(files), sum(size for _, size in files)
+
+    def download_file_single(self, remote_path: str, local_path: str):
+        with self._connection() as conn:
             conn.get(remote=remote_path, local=local_path)
             pass
         pass
@@ -84,4 +172,3 @@ class SCPStorage(StorageBase):
         os.system(f"coscmd upload {recursive} {local_path} {remote_path}")
         pass
     pass
-
@@ -102,6 +102,11 @@ HTML_PAGE = """<!DOCTYPE html>
   /* Op buttons in table */
   .op-btns { display: flex; gap: 4px; white-space: nowrap; }
 
+  /* Log view */
+  .log-view { background: #0f172a; color: #e2e8f0; font-family: monospace; font-size: 12px;
+              padding: 10px; border-radius: var(--radius); height: 360px; overflow-y: auto;
+              white-space: pre-wrap; word-break: break-all; }
+
   /* Loading */
   .loading { color: var(--text-light); font-size: 13px; padding: 12px 0; text-align: center; }
 </style>
@@ -231,6 +236,12 @@ HTML_PAGE = """<!DOCTYPE html>
         </table>
       </div>
     </div>
+
+    <!-- Task log -->
+    <div class="card" id="logCard" style="display:none;">
+      <h2><span id="logTitle">Log</span> <button class="btn btn-outline btn-sm" onclick="closeLog()">Close</button></h2>
+      <pre class="log-view" id="logView"></pre>
+    </div>
   </div>
 </div>
 
@@ -239,6 +250,8 @@ HTML_PAGE = """<!DOCTYPE html>
 <script>
 let TOKEN = localStorage.getItem('hqjob_token') || '';
 let refreshTimer = null;
+let eventSource = null;
+let logSource = null;
 let regionMap = {};  // sign -> name mapping
 
 function el(id) { return document.getElementById(id); }
@@ -278,11 +291,65 @@ function connect() {
   localStorage.setItem('hqjob_token', TOKEN);
   el('statusDot').classList.add('connected');
   loadAll();
-  if (refreshTimer) clearInterval(refreshTimer);
-  refreshTimer = setInterval(loadJobs, 30000);
+  watchJobs();
   toast('Connected', 'success');
 }
 
+// --- Live updates ---
+// status transitions are pushed by the server over SSE, polling is only the fallback
+function startPolling() {
+  if (!refreshTimer) refreshTimer = setInterval(loadJobs, 30000);
+}
+
+function stopPolling() {
+  if (refreshTimer) { clearInterval(refreshTimer); refreshTimer = null; }
+}
+
+function applyJobEvent(type, ev) {
+  const tbody = el('jobsBody');
+  const row = tbody.querySelector('tr[data-uuid="' + ev.job_uuid + '"]');
+  if (type === 'changed' && row) {
+    const badge = row.querySelector('.badge');
+    badge.className = 'badge ' + badgeClass(ev.status);
+    badge.textContent = ev.status;
+  } else if ((type === 'added' || type === 'changed') && ev.job) {
+    if (row) row.remove();
+    if (!tbody.querySelector('tr[data-uuid]')) tbody.innerHTML = '';
+    tbody.insertAdjacentHTML('afterbegin', jobRow(ev.job));
+  } else if (type === 'removed' && row) {
+    row.remove();
+  }
+}
+
+// EventSource can't send the Authorization header, streams are opened with a short-lived
+// stream token in the URL instead of the API token
+async function streamUrl(path) {
+  const resp = await api('POST', '/api/v1/stream_token');
+  return path + (path.includes('?') ? '&' : '?') + 'stream_token=' + encodeURIComponent(resp.data.token);
+}
+
+async function watchJobs() {
+  if (eventSource) { eventSource.close(); eventSource = null; }
+  if (!window.EventSource) { startPolling(); return; }
+  let url;
+  try { url = await streamUrl('/api/v1/jobs/events'); } catch (e) { startPolling(); return; }
+  eventSource = new EventSource(url);
+  eventSource.addEventListener('ready', () => { stopPolling(); });
+  for (const type of ['added', 'changed', 'removed']) {
+    eventSource.addEventListener(type, e => applyJobEvent(type, JSON.parse(e.data)));
+  }
+  eventSource.addEventListener('resync', () => loadJobs());
+  eventSource.onerror = () => {
+    // the browser reconnects on its own unless the server refused the stream,
+    // e.g. the stream token expired, then open it again with a new one
+    startPolling();
+    if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+      eventSource = null;
+      setTimeout(() => { if (!eventSource) watchJobs(); }, 30000);
+    }
+  };
+}
+
 function loadAll() {
   loadRegions();
   loadImages();
@@ -404,6 +471,24 @@ async function submitJob() {
 }
 
 // --- Jobs List ---
+function jobRow(j) {
+  const t = j.created_at ? new Date(j.created_at).toLocaleString() : '';
+  const autodlUrl = 'https://www.autodl.com/deploy/details/' + j.uuid + '/' + j.name;
+  const regionNames = (j.dc_list || []).map(dc => regionMap[dc] || dc).join(', ');
+  return '<tr data-uuid="' + j.uuid + '">'
+    + '<td title="' + j.uuid + '"><a href="' + autodlUrl + '" target="_blank" style="color:var(--primary);text-decoration:none;">' + j.name + '</a></td>'
+    + '<td><span class="badge ' + badgeClass(j.status) + '">' + j.status + '</span></td>'
+    + '<td>' + j.deployment_type + '</td>'
+    + '<td>' + regionNames + '</td>'
+    + '<td>' + (j.gpu_name_set || []).join(', ') + '</td>'
+    + '<td>' + t + '</td>'
+    + '<td class="op-btns">'
+    + '<button class="btn btn-outline btn-sm" onclick="showLog(\\'' + j.uuid + '\\', \\'' + j.name + '\\')">Log</button>'
+    + '<button class="btn btn-outline btn-sm" onclick="stopJob(\\'' + j.uuid + '\\')">Stop</button>'
+    + '<button class="btn btn-danger btn-sm" onclick="deleteJob(\\'' + j.uuid + '\\')">Delete</button>'
+    + '</td></tr>';
+}
+
 async function loadJobs() {
   const tbody = el('jobsBody');
   try {
@@ -411,26 +496,47 @@ async function loadJobs() {
     const jobs = r.data || [];
     if (jobs.length === 0) { tbody.innerHTML = '<tr><td colspan="7" class="loading">No tasks</td></tr>'; return; }
     let html = '';
-    for (const j of jobs) {
-      const t = j.created_at ? new Date(j.created_at).toLocaleString() : '';
-      const autodlUrl = 'https://www.autodl.com/deploy/details/' + j.uuid + '/' + j.name;
-      const regionNames = (j.dc_list || []).map(dc => regionMap[dc] || dc).join(', ');
-      html += '<tr>'
-        + '<td title="' + j.uuid + '"><a href="' + autodlUrl + '" target="_blank" style="color:var(--primary);text-decoration:none;">' + j.name + '</a></td>'
-        + '<td><span class="badge ' + badgeClass(j.status) + '">' + j.status + '</span></td>'
-        + '<td>' + j.deployment_type + '</td>'
-        + '<td>' + regionNames + '</td>'
-        + '<td>' + (j.gpu_name_set || []).join(', ') + '</td>'
-        + '<td>' + t + '</td>'
-        + '<td class="op-btns">'
-        + '<button class="btn btn-outline btn-sm" onclick="stopJob(\\'' + j.uuid + '\\')">Stop</button>'
-        + '<button class="btn btn-danger btn-sm" onclick="deleteJob(\\'' + j.uuid + '\\')">Delete</button>'
-        + '</td></tr>';
-    }
+    for (const j of jobs) html += jobRow(j);
     tbody.innerHTML = html;
   } catch (e) { tbody.innerHTML = '<tr><td colspan="7" class="loading">Error: ' + e.message + '</td></tr>'; }
 }
 
+// --- Job log ---
+// follows the last lines and then new output only, the log is never downloaded whole
+const LOG_MAX_CHARS = 500000;
+
+function appendLog(text) {
+  const view = el('logView');
+  const atBottom = view.scrollTop + view.clientHeight >= view.scrollHeight - 20;
+  let content = view.textContent + text;
+  if (content.length > LOG_MAX_CHARS) content = content.slice(content.length - LOG_MAX_CHARS);
+  view.textContent = content;
+  if (atBottom) view.scrollTop = view.scrollHeight;
+}
+
+async function showLog(uuid, name) {
+  closeLog();
+  el('logCard').style.display = '';
+  el('logTitle').textContent = 'Log: ' + name;
+  el('logView').textContent = '';
+  let url;
+  try { url = await streamUrl('/api/v1/jobs/' + uuid + '/log?follow=true&tail_lines=500'); }
+  catch (e) { appendLog('[error: ' + e.message + ']\\n'); return; }
+  if (logSource) logSource.close();
+  logSource = new EventSource(url);
+  logSource.addEventListener('log', e => appendLog(JSON.parse(e.data).data));
+  logSource.addEventListener('end', () => { appendLog('\\n[log end]\\n'); logSource.close(); logSource = null; });
+  logSource.addEventListener('error', e => {
+    if (e.data) appendLog('\\n[error: ' + JSON.parse(e.data).message + ']\\n');
+    if (logSource) { logSource.close(); logSource = null; }
+  });
+}
+
+function closeLog() {
+  if (logSource) { logSource.close(); logSource = null; }
+  el('logCard').style.display = 'none';
+}
+
 async function stopJob(uuid) {
   if (!confirm('Stop this task?')) return;
   try {
@@ -455,7 +561,7 @@ window.addEventListener('DOMContentLoaded', () => {
     el('tokenInput').value = TOKEN;
     el('statusDot').classList.add('connected');
     loadAll();
-    refreshTimer = setInterval(loadJobs, 30000);
+    watchJobs();
   }
 });
 </script>
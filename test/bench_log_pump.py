@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Log capture throughput: the old readline + fsync per line loop against LogPump.
+
+    python test/bench_log_pump.py [--lines 200000] [--line-size 100]
+"""
+
+import argparse
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hq_job.scripts.job_worker_entry import LogPump
+
+
+def chatty_child(lines: int, line_size: int) -> subprocess.Popen:
+    code = f"import sys\nline = 'x' * {line_size - 1} + chr(10)\nfor _ in range({lines}): sys.stdout.write(line)\n"
+    return subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            bufsize=0)
+
+
+def readline_fsync(process, log_file):
+    """the loop job_worker_entry used before LogPump"""
+    with open(log_file, "w", encoding="utf-8", buffering=1) as f:
+        stdout_stream = io.TextIOWrapper(process.stdout, encoding='utf-8', errors='replace')
+        while True:
+            line = stdout_stream.readline()
+            if line:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            elif process.poll() is not None:
+                break
+        for remaining in stdout_stream:
+            f.write(remaining)
+        f.flush()
+        os.fsync(f.fileno())
+    return process.wait()
+
+
+def log_pump(**kwargs):
+    def run(process, log_file):
+        with open(log_file, "wb") as f:
+            return LogPump(f.fileno(), **kwargs).pump(process)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--line-size", type=int, default=100)
+    args = parser.parse_args()
+
+    total = args.lines * args.line_size
+    print(f"{args.lines} lines of {args.line_size} bytes ({total / 1e6:.1f} MB)")
+    with tempfile.TemporaryDirectory() as tmp:
+        log_file = os.path.join(tmp, "job.log")
+        for name, run in (("readline + fsync per line", readline_fsync),
+                          ("LogPump, fsync 1s / 4MB", log_pump()),
+                          ("LogPump, fsync every 64KB", log_pump(fsync_ms=0, fsync_bytes=64 * 1024)),
+                          ("LogPump, fsync on exit", log_pump(fsync_ms=0, fsync_bytes=0))):
+            started = time.perf_counter()
+            run(chatty_child(args.lines, args.line_size), log_file)
+            elapsed = time.perf_counter() - started
+            assert os.path.getsize(log_file) == total
+            print(f"{name:<28} {elapsed:8.2f}s {total / elapsed / 1e6:10.1f} MB/s {args.lines / elapsed:12.0f} lines/s")
+            pass
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    main()
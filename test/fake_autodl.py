@@ -0,0 +1,233 @@
+"""
+A local fake AutoDL API server for offline tests.
+
+It speaks HTTP/1.1 with keep-alive, serves paged list endpoints from in-memory
+data and supports fault injection (http errors, business errors, delays).
+"""
+
+import json
+import math
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_image(idx: int, image_name: str) -> dict:
+    return {"id": idx, "image_name": image_name, "image_uuid": f"image-{idx}"}
+
+
+def make_deployment(idx: int, name: str = "job", status: str = "running",
+                    region: str = "chongqingDC1", gpu: str = "RTX 4090",
+                    created_at: str = "2026-03-18T10:00:00+08:00") -> dict:
+    return {
+        "id": idx,
+        "uid": 1,
+        "uuid": f"dep-{idx}",
+        "name": name,
+        "deployment_type": "Job",
+        "status": status,
+        "created_at": created_at,
+        "template": {
+            "region_sign": region,
+            "dc_list": [region],
+            "gpu_name_set": [gpu],
+        },
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.fake.record_connection()
+        pass
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length) if length > 0 else b""
+        req = json.loads(body) if body else {}
+        status, payload = self.server.fake.dispatch(self.command, self.path, req)
+        self._reply(status, payload)
+        pass
+
+    do_GET = _handle
+    do_POST = _handle
+    do_PUT = _handle
+    do_DELETE = _handle
+
+
+class FakeAutodlServer(object):
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.images = []
+        self.deployments = []
+        self.containers = dict()
+        self.events = dict()
+        self.gpu_stock = [{"RTX 4090": {"idle_gpu_num": 3, "total_gpu_num": 8}}]
+        self.faults = []
+        self.requests = []
+        self.connections = 0
+        # requests being answered at once, and the most seen
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        pass
+
+    # ------------------------------------------------------------------
+    # lifecycle
+    # ------------------------------------------------------------------
+
+    def start(self) -> "FakeAutodlServer":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            pass
+        pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        pass
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    # ------------------------------------------------------------------
+    # fault injection & bookkeeping
+    # ------------------------------------------------------------------
+
+    def inject(self, *faults):
+        """
+        Queue faults consumed one per request, each one of:
+        ("http", status_code), ("business", code), ("delay", seconds)
+        """
+        with self._lock:
+            self.faults.extend(faults)
+            pass
+        pass
+
+    def record_connection(self):
+        with self._lock:
+            self.connections += 1
+            pass
+        pass
+
+    def request_count(self, path: str = None) -> int:
+        with self._lock:
+            return len([r for r in self.requests if path is None or r[1] == path])
+
+    # ------------------------------------------------------------------
+    # routing
+    # ------------------------------------------------------------------
+
+    def dispatch(self, method: str, path: str, req: dict):
+        with self._lock:
+            self.requests.append((method, path, req))
+            fault = self.faults.pop(0) if self.faults else None
+            pass
+        if self.latency > 0:
+            with self._lock:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                pass
+            time.sleep(self.latency)
+            with self._lock:
+                self.in_flight -= 1
+                pass
+            pass
+        if fault is not None:
+            kind, value = fault
+            if kind == "http":
+                return value, {"code": "Error", "msg": "injected"}
+            elif kind == "business":
+                return 200, {"code": value, "message": "injected business error"}
+            elif kind == "delay":
+                time.sleep(value)
+                pass
+            pass
+
+        if path == "/api/v1/dev/image/private/list":
+            return self._page(self.images, req)
+        elif path == "/api/v1/dev/deployment/list":
+            items = self.deployments
+            if req.get("deployment_uuid"):
+                items = [d for d in items if d["uuid"] == req["deployment_uuid"]]
+                pass
+            if req.get("name"):
+                items = [d for d in items if req["name"] in d["name"]]
+                pass
+            if req.get("status"):
+                items = [d for d in items if d["status"] == req["status"]]
+                pass
+            return self._page(items, req)
+        elif path == "/api/v1/dev/deployment/container/list":
+            return self._page(self.containers.get(req.get("deployment_uuid"), []), req)
+        elif path == "/api/v1/dev/deployment/container/event/list":
+            return self._page(self.events.get(req.get("deployment_uuid"), []), req)
+        elif path == "/api/v1/dev/machine/region/gpu_stock":
+            return self._ok(self.gpu_stock)
+        elif path == "/api/v1/dev/deployment" and method == "POST":
+            deployment_uuid = uuid.uuid4().hex[:12]
+            dep = make_deployment(len(self.deployments) + 1, name=req.get("name", ""), status="starting")
+            dep["uuid"] = deployment_uuid
+            with self._lock:
+                self.deployments.insert(0, dep)
+                pass
+            return self._ok({"deployment_uuid": deployment_uuid})
+        elif path == "/api/v1/dev/deployment" and method == "DELETE":
+            with self._lock:
+                self.deployments = [d for d in self.deployments if d["uuid"] != req.get("deployment_uuid")]
+                pass
+            return self._ok(None)
+        elif path == "/api/v1/dev/deployment/operate":
+            for d in self.deployments:
+                if d["uuid"] == req.get("deployment_uuid"):
+                    d["status"] = "stopped"
+                    pass
+                pass
+            return self._ok(None)
+        return 404, {"code": "NotFound", "message": path}
+
+    def _ok(self, data):
+        return 200, {"code": "Success", "data": data}
+
+    def _page(self, items, req):
+        page_index = req.get("page_index", 1)
+        page_size = req.get("page_size", 10)
+        start = (page_index - 1) * page_size
+        return self._ok({
+            "list": items[start:start + page_size],
+            "page_index": page_index,
+            "page_size": page_size,
+            "max_page": max(math.ceil(len(items) / page_size), 1),
+        })
+    pass
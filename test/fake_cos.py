@@ -0,0 +1,312 @@
+"""
+A local fake COS (S3-compatible) server for offline tests.
+
+It keeps one bucket in memory, addressed path-style (http://127.0.0.1:port/<key>),
+and serves what the COS SDK transfers use: head/get (with Range)/put/delete of
+objects, paged bucket listing and the multipart upload calls. Signatures are not
+checked. Part uploads and ranged reads can be made to fail for resume tests.
+"""
+
+import hashlib
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+
+def etag_of(data: bytes) -> str:
+    return '"' + hashlib.md5(data).hexdigest() + '"'
+
+
+def _xml(root: str, items: list) -> bytes:
+    """items are (tag, value) pairs, value a str or a list of pairs for a nested element"""
+    def render(pairs):
+        return "".join(f"<{tag}>{render(value) if isinstance(value, list) else escape(str(value))}</{tag}>"
+                       for tag, value in pairs)
+    return f'<?xml version="1.0" encoding="UTF-8"?><{root}>{render(items)}</{root}>'.encode("utf-8")
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, body: bytes = b"", headers: dict = None, content_type: str = "application/xml"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or dict()).items():
+            self.send_header(k, v)
+            pass
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+            pass
+        pass
+
+    def _error(self, status: int, code: str):
+        self._reply(status, _xml("Error", [("Code", code), ("Message", code),
+                                           ("RequestId", uuid.uuid4().hex)]))
+        pass
+
+    def _parse(self):
+        url = urlparse(self.path)
+        key = unquote(url.path.lstrip("/"))
+        params = {k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items()}
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        body = self.rfile.read(length) if length > 0 else b""
+        return key, params, body
+
+    def do_HEAD(self):
+        key, params, body = self._parse()
+        self.server.fake.record(self.command, key, params, self.headers)
+        obj = self.server.fake.get(key)
+        if obj is None:
+            self._reply(404)
+            return
+        # a HEAD reply carries the length of the object, without a body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(obj[0])))
+        self.send_header("ETag", obj[1])
+        self.send_header("Last-Modified", "Wed, 18 Mar 2026 10:00:00 GMT")
+        self.end_headers()
+        pass
+
+    def do_GET(self):
+        key, params, body = self._parse()
+        fake = self.server.fake
+        fake.record(self.command, key, params, self.headers)
+        if key == "":
+            if "uploads" in params:
+                self._reply(200, fake.list_uploads_xml(params))
+            else:
+                self._reply(200, fake.list_objects_xml(params))
+            return
+        if "uploadId" in params:
+            self._reply(200, fake.list_parts_xml(key, params["uploadId"]))
+            return
+        obj = fake.get(key)
+        if obj is None:
+            self._error(404, "NoSuchKey")
+            return
+        data, etag = obj
+        range_header = self.headers.get("Range")
+        if range_header:
+            start, end = range_header[len("bytes="):].split("-")
+            start, end = int(start), min(int(end), len(data) - 1)
+            if fake.should_fail_range(key, start):
+                self._error(500, "InternalError")
+                return
+            self._reply(206, data[start:end + 1], {"ETag": etag, "Content-Range": f"bytes {start}-{end}/{len(data)}"},
+                        content_type="application/octet-stream")
+            return
+        self._reply(200, data, {"ETag": etag}, content_type="application/octet-stream")
+        pass
+
+    def do_PUT(self):
+        key, params, body = self._parse()
+        fake = self.server.fake
+        fake.record(self.command, key, params, self.headers)
+        if "uploadId" in params:
+            part_number = int(params["partNumber"])
+            if fake.should_fail_part(part_number):
+                self._error(500, "InternalError")
+                return
+            etag = fake.put_part(params["uploadId"], part_number, body)
+            if etag is None:
+                self._error(404, "NoSuchUpload")
+                return
+            self._reply(200, b"", {"ETag": etag})
+            return
+        self._reply(200, b"", {"ETag": fake.put(key, body)})
+        pass
+
+    def do_POST(self):
+        key, params, body = self._parse()
+        fake = self.server.fake
+        fake.record(self.command, key, params, self.headers)
+        if "uploads" in params:
+            upload_id = fake.create_upload(key)
+            self._reply(200, _xml("InitiateMultipartUploadResult",
+                                  [("Bucket", fake.bucket), ("Key", key), ("UploadId", upload_id)]))
+            return
+        if "uploadId" in params:
+            numbers = [int(e.text) for e in ElementTree.fromstring(body).iter("PartNumber")]
+            etag = fake.complete_upload(params["uploadId"], numbers)
+            if etag is None:
+                self._error(400, "InvalidPart")
+                return
+            self._reply(200, _xml("CompleteMultipartUploadResult",
+                                  [("Location", key), ("Bucket", fake.bucket), ("Key", key), ("ETag", etag)]))
+            return
+        self._error(400, "InvalidRequest")
+        pass
+
+    def do_DELETE(self):
+        key, params, body = self._parse()
+        fake = self.server.fake
+        fake.record(self.command, key, params, self.headers)
+        if "uploadId" in params:
+            fake.abort_upload(params["uploadId"])
+        else:
+            fake.delete(key)
+            pass
+        self._reply(204)
+        pass
+    pass
+
+
+class FakeCOS(object):
+    def __init__(self, bucket: str = "test-1250000000", page_size: int = 1000):
+        self.bucket = bucket
+        self.page_size = page_size
+        self.objects = dict()   # key -> (data, etag)
+        self.uploads = dict()   # upload id -> {"key": key, "parts": {number: (data, etag)}}
+        self.requests = []      # (method, key, params, headers)
+        self.fail_parts = set()     # part numbers whose uploads fail
+        self.fail_ranges = set()    # (key, start) of ranged reads that fail
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+        pass
+
+    @property
+    def domain(self) -> str:
+        return f"127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FakeCOS":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        pass
+
+    def write_config(self, path: str, **options):
+        """a ~/.cos.conf pointing at this server"""
+        lines = ["[common]", "secret_id = fake-id", "secret_key = fake-key", "region = ap-test",
+                 f"bucket = {self.bucket}", "schema = http", f"domain = {self.domain}"]
+        lines += [f"{k} = {v}" for k, v in options.items()]
+        with open(path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+            pass
+        pass
+
+    def record(self, method: str, key: str, params: dict, headers):
+        with self._lock:
+            self.requests.append((method, key, params, dict(headers)))
+            pass
+        pass
+
+    def count(self, method: str, param: str = None) -> int:
+        with self._lock:
+            return len([r for r in self.requests if r[0] == method and (param is None or param in r[2])])
+
+    def should_fail_part(self, part_number: int) -> bool:
+        return part_number in self.fail_parts
+
+    def should_fail_range(self, key: str, start: int) -> bool:
+        return (key, start) in self.fail_ranges
+
+    def get(self, key: str):
+        with self._lock:
+            return self.objects.get(key)
+
+    def put(self, key: str, data: bytes) -> str:
+        etag = etag_of(data)
+        with self._lock:
+            self.objects[key] = (data, etag)
+            pass
+        return etag
+
+    def delete(self, key: str):
+        with self._lock:
+            self.objects.pop(key, None)
+            pass
+        pass
+
+    def create_upload(self, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self.uploads[upload_id] = {"key": key, "parts": dict()}
+            pass
+        return upload_id
+
+    def put_part(self, upload_id: str, number: int, data: bytes):
+        etag = etag_of(data)
+        with self._lock:
+            if upload_id not in self.uploads:
+                return None
+            self.uploads[upload_id]["parts"][number] = (data, etag)
+            pass
+        return etag
+
+    def complete_upload(self, upload_id: str, numbers: list):
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is None or any(n not in upload["parts"] for n in numbers):
+                return None
+            data = b"".join(upload["parts"][n][0] for n in sorted(numbers))
+            etag = '"' + hashlib.md5(data).hexdigest() + f'-{len(numbers)}"'
+            self.objects[upload["key"]] = (data, etag)
+            del self.uploads[upload_id]
+            pass
+        return etag
+
+    def abort_upload(self, upload_id: str):
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+            pass
+        pass
+
+    def list_objects_xml(self, params: dict) -> bytes:
+        prefix = params.get("prefix", "")
+        marker = params.get("marker", "")
+        max_keys = min(int(params.get("max-keys", 1000) or 1000), self.page_size)
+        with self._lock:
+            keys = sorted(k for k in self.objects if k.startswith(prefix) and k > marker)
+            page = [(k, self.objects[k]) for k in keys[:max_keys]]
+            pass
+        truncated = len(keys) > max_keys
+        items = [("Name", self.bucket), ("Prefix", prefix), ("Marker", marker), ("MaxKeys", max_keys),
+                 ("IsTruncated", "true" if truncated else "false")]
+        if truncated:
+            items.append(("NextMarker", page[-1][0]))
+            pass
+        for key, (data, etag) in page:
+            items.append(("Contents", [("Key", key), ("LastModified", "2026-03-18T10:00:00.000Z"),
+                                       ("ETag", etag), ("Size", len(data)), ("StorageClass", "STANDARD")]))
+            pass
+        return _xml("ListBucketResult", items)
+
+    def list_uploads_xml(self, params: dict) -> bytes:
+        prefix = params.get("prefix", "")
+        with self._lock:
+            uploads = [(u["key"], upload_id) for upload_id, u in self.uploads.items() if u["key"].startswith(prefix)]
+            pass
+        items = [("Bucket", self.bucket), ("Prefix", prefix), ("IsTruncated", "false")]
+        for key, upload_id in uploads:
+            items.append(("Upload", [("Key", key), ("UploadId", upload_id), ("StorageClass", "STANDARD"),
+                                     ("Initiated", "2026-03-18T10:00:00.000Z")]))
+            pass
+        return _xml("ListMultipartUploadsResult", items)
+
+    def list_parts_xml(self, key: str, upload_id: str) -> bytes:
+        with self._lock:
+            parts = sorted(self.uploads.get(upload_id, {"parts": dict()})["parts"].items())
+            pass
+        items = [("Bucket", self.bucket), ("Key", key), ("UploadId", upload_id), ("IsTruncated", "false")]
+        for number, (data, etag) in parts:
+            items.append(("Part", [("PartNumber", number), ("LastModified", "2026-03-18T10:00:00.000Z"),
+                                   ("ETag", etag), ("Size", len(data))]))
+            pass
+        return _xml("ListPartsResult", items)
+    pass
@@ -0,0 +1,172 @@
+"""
+A local SSH server (paramiko) for offline tests.
+
+It accepts one user with a password, runs exec requests with the local shell
+(stdout, stderr and the exit status go back over the channel) and serves SFTP
+read access to the local filesystem. Commands and connections are recorded.
+"""
+
+import os
+import socket
+import subprocess
+import threading
+
+import paramiko
+
+_host_key = None
+
+
+def _key() -> paramiko.RSAKey:
+    global _host_key
+    if _host_key is None:
+        _host_key = paramiko.RSAKey.generate(2048)
+        pass
+    return _host_key
+
+
+class _Handle(paramiko.SFTPHandle):
+
+    def stat(self):
+        return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+    pass
+
+
+class _SFTP(paramiko.SFTPServerInterface):
+
+    def list_folder(self, path):
+        try:
+            return [paramiko.SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)), name)
+                    for name in os.listdir(path)]
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        if flags & (os.O_WRONLY | os.O_RDWR):
+            return paramiko.SFTP_PERMISSION_DENIED
+        try:
+            handle = _Handle(flags)
+            handle.readfile = open(path, "rb")
+            handle.filename = path
+            return handle
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+    pass
+
+
+class _Server(paramiko.ServerInterface):
+
+    def __init__(self, sshd: "FakeSSHD"):
+        self.sshd = sshd
+        pass
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.sshd.username, self.sshd.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode("utf-8")
+        self.sshd.commands.append(command)
+        threading.Thread(target=self._run, args=(channel, command), daemon=True).start()
+        return True
+
+    @staticmethod
+    def _run(channel, command):
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        def pump(source, send):
+            for chunk in iter(lambda: source.read1(65536), b""):
+                send(chunk)
+                pass
+            pass
+
+        errors = threading.Thread(target=pump, args=(process.stderr, channel.sendall_stderr))
+        errors.start()
+        try:
+            pump(process.stdout, channel.sendall)
+        except OSError:
+            # the client went away, stop the command
+            process.kill()
+            pass
+        errors.join()
+        channel.send_exit_status(process.wait())
+        channel.close()
+        pass
+    pass
+
+
+class FakeSSHD(object):
+
+    def __init__(self, username: str = "root", password: str = "secret"):
+        self.username = username
+        self.password = password
+        self.commands = []
+        self.connections = 0
+        self.port = None
+        self._socket = None
+        self._transports = []
+        pass
+
+    def start(self) -> "FakeSSHD":
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(("127.0.0.1", 0))
+        self._socket.listen(16)
+        self.port = self._socket.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+        return self
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._socket.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(client)
+            transport.add_server_key(_key())
+            transport.set_subsystem_handler("sftp", paramiko.SFTPServer, _SFTP)
+            transport.start_server(server=_Server(self))
+            self._transports.append(transport)
+            pass
+        pass
+
+    def ssh(self) -> dict:
+        """the connection arguments of ssh_utils / SCPStorage"""
+        return dict(host="127.0.0.1", username=self.username, password=self.password, port=self.port)
+
+    def drop_connections(self):
+        """close the server side of every connection, as a restarted container does"""
+        for transport in self._transports:
+            transport.close()
+            pass
+        self._transports = []
+        pass
+
+    def stop(self):
+        self._socket.close()
+        for transport in self._transports:
+            transport.close()
+            pass
+        pass
+    pass
@@ -1,6 +1,10 @@
 import unittest
-from hq_job.autodl_client import AutodlClient, AutodlImage, AutodlGpuStock
+from hq_job.autodl_client import AutodlClient, AutodlImage, AutodlGpuStock, AutodlNetworkError, AutodlRetryBudget
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_autodl import FakeAutodlServer, make_image, make_deployment
 
 
 class TestAutodlClient(unittest.TestCase):
@@ -141,6 +145,254 @@ class TestAutodlClient(unittest.TestCase):
     pass
 
 
+class TestAutodlClientConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAutodlServer().start()
+        self.server.images = [make_image(i, f"img:{i}.0.0") for i in range(1, 36)]
+        pass
+
+    def tearDown(self):
+        self.server.stop()
+        pass
+
+    def test_session_reused_across_calls(self):
+        with AutodlClient("token", host=self.server.url) as client:
+            for _ in range(3):
+                images = client.image_list(use_cache=False)
+                self.assertEqual(len(images), 35)
+                pass
+            stats = client.get_connection_stats()
+            pass
+        # 3 listings x 4 pages each over a single keep-alive connection
+        self.assertEqual(stats["requests"], 12)
+        self.assertEqual(stats["new_connections"], 1)
+        self.assertEqual(stats["reused_connections"], 11)
+        self.assertEqual(self.server.connections, 1)
+        pass
+
+    def test_keep_alive_disabled(self):
+        client = AutodlClient("token", host=self.server.url, keep_alive=False)
+        client.image_list(use_cache=False)
+        stats = client.get_connection_stats()
+        client.close()
+        self.assertEqual(stats["requests"], 4)
+        self.assertEqual(stats["new_connections"], 4)
+        pass
+
+    def test_pool_shared_between_threads(self):
+        client = AutodlClient("token", host=self.server.url, pool_maxsize=4)
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda _: client.image_list(use_cache=False), range(16)))
+            pass
+        client.close()
+        self.assertTrue(all(len(r) == 35 for r in results))
+        stats = client.get_connection_stats()
+        self.assertEqual(stats["requests"], 64)
+        self.assertLessEqual(stats["new_connections"], 4)
+        pass
+    pass
+
+
+class TestAutodlClientRetry(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAutodlServer().start()
+        self.server.images = [make_image(1, "img:0.0.1")]
+        self.client = AutodlClient("token", host=self.server.url, backoff_base=0.05, backoff_max=0.2)
+        pass
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        pass
+
+    def test_business_error_fails_fast(self):
+        self.server.inject(("business", "InvalidParam"))
+        start = time.time()
+        with self.assertRaises(AutodlNetworkError) as ctx:
+            self.client.image_list()
+            pass
+        elapsed = time.time() - start
+        print(f"business error surfaced in {elapsed:.3f}s")
+        self.assertEqual(ctx.exception.code, "InvalidParam")
+        self.assertEqual(self.server.request_count(), 1)
+        self.assertLess(elapsed, 1)
+        pass
+
+    def test_client_error_not_retried(self):
+        self.server.inject(("http", 403))
+        with self.assertRaises(AutodlNetworkError) as ctx:
+            self.client.image_list()
+            pass
+        self.assertEqual(ctx.exception.status_code, 403)
+        self.assertEqual(self.server.request_count(), 1)
+        pass
+
+    def test_transient_error_retried_with_backoff(self):
+        self.server.inject(("http", 503), ("http", 502))
+        start = time.time()
+        images = self.client.image_list()
+        elapsed = time.time() - start
+        print(f"recovered from 2 transient errors in {elapsed:.3f}s (was >= 240s with fixed sleeps)")
+        self.assertEqual(len(images), 1)
+        self.assertEqual(self.server.request_count(), 3)
+        self.assertLess(elapsed, 2)
+        pass
+
+    def test_writes_not_retried(self):
+        self.server.deployments = [make_deployment(1)]
+        for call in [lambda: self.client.stop_deployment("dep-1"), lambda: self.client.deployment_delete("dep-1")]:
+            self.server.requests.clear()
+            self.server.inject(("http", 503))
+            with self.assertRaises(AutodlNetworkError):
+                call()
+                pass
+            self.assertEqual(self.server.request_count(), 1)
+            pass
+        pass
+
+    def test_retry_budget_exhausted(self):
+        self.client.retry_budget = AutodlRetryBudget(max_tokens=4, token_ratio=1)
+        self.server.inject(*[("http", 503)] * 10)
+        with self.assertRaises(AutodlNetworkError):
+            self.client.image_list()
+            pass
+        # 4 tokens, retries stop once half of them are spent
+        self.assertEqual(self.server.request_count(), 2)
+        with self.assertRaises(AutodlNetworkError):
+            self.client.image_list()
+            pass
+        self.assertEqual(self.server.request_count(), 3)
+        pass
+    pass
+
+
+class TestAutodlImageCache(unittest.TestCase):
+    IMAGE_LIST_URL = "/api/v1/dev/image/private/list"
+
+    def setUp(self):
+        self.server = FakeAutodlServer().start()
+        self.server.images = [
+            make_image(1, "ml_backend:0.0.9"),
+            make_image(2, "ml_backend:0.0.10"),
+            make_image(3, "ml_backend:0.1.0"),
+            make_image(4, "other:1.0"),
+            make_image(5, "other:latest"),
+        ]
+        pass
+
+    def tearDown(self):
+        self.server.stop()
+        pass
+
+    def test_burst_of_lookups_lists_once(self):
+        client = AutodlClient("token", host=self.server.url)
+        for _ in range(50):
+            self.assertIsNone(client.image_name2uuid("ml_backend"))
+            self.assertEqual(client.image_latest("ml_backend").image_uuid, "image-3")
+            pass
+        self.assertEqual(client.image_name2uuid("other:1.0"), "image-4")
+        self.assertEqual(self.server.request_count(self.IMAGE_LIST_URL), 1)
+        client.close()
+        pass
+
+    def test_latest_version_index(self):
+        client = AutodlClient("token", host=self.server.url)
+        self.assertEqual(client.image_latest("ml_backend:").image_name, "ml_backend:0.1.0")
+        self.assertEqual(client.image_latest("other").image_name, "other:1.0")
+        self.assertIsNone(client.image_latest("missing"))
+        client.close()
+        pass
+
+    def test_invalidate(self):
+        client = AutodlClient("token", host=self.server.url)
+        self.assertIsNone(client.image_name2uuid("new:0.0.1"))
+        self.server.images.append(make_image(6, "new:0.0.1"))
+        self.assertIsNone(client.image_name2uuid("new:0.0.1"))
+        client.invalidate_image_cache()
+        self.assertEqual(client.image_name2uuid("new:0.0.1"), "image-6")
+        self.assertEqual(self.server.request_count(self.IMAGE_LIST_URL), 2)
+        client.close()
+        pass
+
+    def test_stale_while_revalidate(self):
+        client = AutodlClient("token", host=self.server.url, image_cache_ttl=0.2, image_cache_stale_ttl=60)
+        self.assertEqual(len(client.image_list()), 5)
+        self.server.images.append(make_image(6, "new:0.0.1"))
+        time.sleep(0.3)
+        # stale entries are served at once while a refresh runs in background
+        self.assertEqual(len(client.image_list()), 5)
+        for _ in range(50):
+            if client.image_catalog.state() == "fresh":
+                break
+            time.sleep(0.05)
+            pass
+        self.assertEqual(len(client.image_list()), 6)
+        self.assertEqual(self.server.request_count(self.IMAGE_LIST_URL), 2)
+        client.close()
+        pass
+
+    def test_cache_disabled(self):
+        client = AutodlClient("token", host=self.server.url, image_cache_ttl=0)
+        client.image_list()
+        client.image_name2uuid("other:1.0")
+        self.assertEqual(self.server.request_count(self.IMAGE_LIST_URL), 2)
+        client.close()
+        pass
+    pass
+
+
+class TestAutodlClientParallelPages(unittest.TestCase):
+    DEPLOYMENT_LIST_URL = "/api/v1/dev/deployment/list"
+
+    def setUp(self):
+        self.server = FakeAutodlServer(latency=0.05).start()
+        self.server.deployments = [make_deployment(i, name=f"job-{i}") for i in range(1, 201)]
+        self.client = AutodlClient("token", host=self.server.url)
+        pass
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        pass
+
+    def test_parallel_keeps_order(self):
+        start = time.time()
+        serial = self.client.deployment_list(page_size=10)
+        serial_time = time.time() - start
+        start = time.time()
+        parallel = self.client.deployment_list(page_size=10, concurrency=8)
+        parallel_time = time.time() - start
+        print(f"20 pages: serial {serial_time:.2f}s, concurrency=8 {parallel_time:.2f}s")
+        self.assertEqual([d.uuid for d in parallel], [d.uuid for d in serial])
+        self.assertEqual(len(parallel), 200)
+        self.assertLess(parallel_time, serial_time)
+        pass
+
+    def test_parallel_honors_limit(self):
+        deployments = self.client.deployment_list(page_size=10, limit=35, concurrency=8)
+        self.assertEqual([d.uuid for d in deployments], [f"dep-{i}" for i in range(1, 36)])
+        # pages past the limit are never requested
+        self.assertEqual(self.server.request_count(self.DEPLOYMENT_LIST_URL), 4)
+        pass
+
+    def test_deployment_statuses_single_sweep(self):
+        statuses = self.client.deployment_statuses(["dep-3", "dep-150", "dep-404"], page_size=100)
+        self.assertEqual(statuses, {"dep-3": "running", "dep-150": "running", "dep-404": None})
+        self.assertEqual(self.server.request_count(self.DEPLOYMENT_LIST_URL), 2)
+        # stops paging once every uuid is found
+        self.client.deployment_statuses(["dep-1", "dep-2"], page_size=100)
+        self.assertEqual(self.server.request_count(self.DEPLOYMENT_LIST_URL), 3)
+        pass
+
+    def test_parallel_error_propagates(self):
+        self.server.inject(("delay", 0), ("business", "Boom"))
+        with self.assertRaises(AutodlNetworkError):
+            self.client.deployment_list(page_size=10, concurrency=4)
+            pass
+        pass
+    pass
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+
+from hq_job.autodl_client import AutodlNetworkError
+from hq_job.autodl_client_async import AsyncAutodlClient
+
+from fake_autodl import FakeAutodlServer, make_image, make_deployment
+
+
+class TestAsyncAutodlClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = FakeAutodlServer().start()
+        self.server.images = [make_image(1, "ml_backend:0.0.1"), make_image(2, "ml_backend:0.0.2")]
+        self.server.deployments = [make_deployment(i, name=f"job-{i}") for i in range(1, 26)]
+        pass
+
+    def tearDown(self):
+        self.server.stop()
+        pass
+
+    async def test_deployment_list(self):
+        async with AsyncAutodlClient("token", host=self.server.url) as client:
+            deployments = await client.deployment_list(page_size=10)
+            limited = await client.deployment_list(page_size=10, limit=12, concurrency=4)
+            status = await client.deployment_status("dep-3")
+            missing = await client.deployment_status("dep-404")
+            pass
+        self.assertEqual([d.uuid for d in deployments], [f"dep-{i}" for i in range(1, 26)])
+        self.assertEqual([d.uuid for d in limited], [f"dep-{i}" for i in range(1, 13)])
+        self.assertEqual(status, "running")
+        self.assertIsNone(missing)
+        # all requests were served over one pooled connection
+        self.assertEqual(self.server.connections, 1)
+        pass
+
+    async def test_images_and_create(self):
+        async with AsyncAutodlClient("token", host=self.server.url) as client:
+            self.assertIsNone(await client.image_name2uuid("ml_backend"))
+            image = await client.image_latest("ml_backend")
+            job_uuid = await client.create_job_deployment(name="job", image_uuid=image.image_uuid)
+            stocks = await client.gpu_stock_list()
+            pass
+        self.assertEqual(image.image_uuid, "image-2")
+        self.assertEqual(self.server.request_count("/api/v1/dev/image/private/list"), 1)
+        _, _, req = [r for r in self.server.requests if r[1] == "/api/v1/dev/deployment"][0]
+        self.assertEqual(req["deployment_type"], "Job")
+        self.assertEqual(req["parallelism_num"], 1)
+        self.assertEqual(req["container_template"]["image_uuid"], "image-2")
+        self.assertTrue(job_uuid)
+        self.assertEqual(stocks["RTX 4090"].idle_gpu_num, 3)
+        pass
+
+    async def test_retry(self):
+        async with AsyncAutodlClient("token", host=self.server.url, backoff_base=0.01) as client:
+            self.server.inject(("http", 503))
+            deployments = await client.deployment_list(limit=1)
+            self.server.inject(("business", "InvalidParam"))
+            with self.assertRaises(AutodlNetworkError):
+                await client.deployment_list(limit=1)
+                pass
+            # writes are sent once, a retry could apply them twice
+            self.server.inject(("http", 503))
+            with self.assertRaises(AutodlNetworkError):
+                await client.stop_deployment("dep-1")
+                pass
+            pass
+        self.assertEqual(len(deployments), 1)
+        self.assertEqual(self.server.request_count(), 4)
+        pass
+
+    async def test_concurrent_calls_do_not_serialize(self):
+        self.server.latency = 0.2
+        async with AsyncAutodlClient("token", host=self.server.url) as client:
+            results = await asyncio.gather(*[client.deployment_status(f"dep-{i}") for i in range(1, 11)])
+        self.assertEqual(results, ["running"] * 10)
+        # the calls were answered side by side, not one after the other
+        self.assertGreater(self.server.max_in_flight, 1)
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
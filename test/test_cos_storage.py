@@ -0,0 +1,172 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from hq_job import storage
+from hq_job.storage.coscmd import COSCMDStorage
+from hq_job.storage.cos import COSClient, COSStorage
+
+from fake_cos import FakeCOS
+
+MB = 1024 * 1024
+
+
+class TestCOSStorage(unittest.TestCase):
+
+    def setUp(self):
+        # the SDK sleeps between retries of a failed request
+        sleep = mock.patch("qcloud_cos.cos_client.time.sleep")
+        sleep.start()
+        self.addCleanup(sleep.stop)
+        self.tmp = tempfile.mkdtemp()
+        self.cos = FakeCOS().start()
+        self.config_file = os.path.join(self.tmp, "cos.conf")
+        self.cos.write_config(self.config_file, part_size=1, max_thread=3, max_workers=3)
+        self.checkpoint_dir = os.path.join(self.tmp, "checkpoints")
+        pass
+
+    def tearDown(self):
+        self.cos.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def client(self, **kwargs) -> COSClient:
+        return COSClient(self.config_file, checkpoint_dir=self.checkpoint_dir, **kwargs)
+
+    def write(self, relative_path: str, data: bytes) -> str:
+        path = os.path.join(self.tmp, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+            pass
+        return path
+
+    def read(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_multipart_round_trip(self):
+        data = os.urandom(3 * MB + 512 * 1024)
+        path = self.write("big.bin", data)
+        progress = []
+        client = self.client()
+        client.upload_file(path, "in/big.bin", lambda key, done, total: progress.append((key, done, total)))
+        self.assertEqual(self.cos.get("in/big.bin")[0], data)
+        # 4 parts of 1 MB
+        self.assertEqual(self.cos.count("PUT", "uploadId"), 4)
+        self.assertEqual(progress[-1], ("in/big.bin", len(data), len(data)))
+        self.assertEqual([p[1] for p in progress], sorted(p[1] for p in progress))
+
+        progress.clear()
+        dest = os.path.join(self.tmp, "down", "big.bin")
+        client.download_file("in/big.bin", dest, lambda key, done, total: progress.append((done, total)))
+        self.assertEqual(self.read(dest), data)
+        ranged = [r for r in self.cos.requests if r[0] == "GET" and "Range" in r[3]]
+        self.assertEqual(len(ranged), 4)
+        self.assertEqual(progress[-1], (len(data), len(data)))
+        # a finished download leaves no checkpoint
+        self.assertEqual(os.listdir(self.checkpoint_dir), [])
+        pass
+
+    def test_small_file_reports_progress(self):
+        path = self.write("small.txt", b"hello")
+        progress = []
+        client = self.client()
+        client.upload_file(path, "in/small.txt", lambda key, done, total: progress.append((done, total)))
+        self.assertEqual(self.cos.count("PUT", "uploadId"), 0)
+        self.assertEqual(progress, [(5, 5)])
+        pass
+
+    def test_folder_round_trip(self):
+        files = {"a.txt": b"a" * 10, "sub/b.bin": os.urandom(MB + 10), "sub/deep/c.txt": b"c"}
+        for name, data in files.items():
+            self.write(os.path.join("out", name), data)
+            pass
+        cos_storage = COSStorage(self.client())
+        cos_storage.upload_file(os.path.join(self.tmp, "out"), "cos://jobs/1")
+        self.assertEqual(sorted(self.cos.objects), ["jobs/1/a.txt", "jobs/1/sub/b.bin", "jobs/1/sub/deep/c.txt"])
+
+        dest = os.path.join(self.tmp, "dest")
+        cos_storage.download_file("cos://jobs/1/", dest)
+        for name, data in files.items():
+            self.assertEqual(self.read(os.path.join(dest, name)), data)
+            pass
+
+        # a file uploaded to a prefix keeps its name
+        cos_storage.upload_file(os.path.join(self.tmp, "out", "a.txt"), "cos://jobs/2/")
+        self.assertEqual(self.cos.get("jobs/2/a.txt")[0], files["a.txt"])
+        pass
+
+    def test_folder_failures_are_collected(self):
+        self.cos.put("in/ok.txt", b"ok")
+        self.cos.put("in/bad.bin", os.urandom(2 * MB))
+        self.cos.fail_ranges.add(("in/bad.bin", 0))
+        client = self.client(retry=1)
+        with self.assertRaises(RuntimeError) as ctx:
+            client.download_folder("in/", os.path.join(self.tmp, "dest"))
+        self.assertIn("in/bad.bin", str(ctx.exception))
+        self.assertEqual(self.read(os.path.join(self.tmp, "dest", "ok.txt")), b"ok")
+        pass
+
+    def test_upload_resumes_from_uploaded_parts(self):
+        data = os.urandom(4 * MB)
+        path = self.write("big.bin", data)
+        client = self.client(retry=1)
+        self.cos.fail_parts.add(3)
+        with self.assertRaises(Exception):
+            client.upload_file(path, "in/big.bin")
+        self.assertIsNone(self.cos.get("in/big.bin"))
+
+        self.cos.fail_parts.clear()
+        part_puts = self.cos.count("PUT", "uploadId")
+        client.upload_file(path, "in/big.bin")
+        self.assertEqual(self.cos.get("in/big.bin")[0], data)
+        # only the missing part goes again
+        self.assertEqual(self.cos.count("PUT", "uploadId") - part_puts, 1)
+        pass
+
+    def test_download_resumes_from_checkpoint(self):
+        data = os.urandom(4 * MB)
+        self.cos.put("in/big.bin", data)
+        client = self.client(retry=1)
+        self.cos.fail_ranges.add(("in/big.bin", 2 * MB))
+        dest = os.path.join(self.tmp, "big.bin")
+        with self.assertRaises(Exception):
+            client.download_file("in/big.bin", dest)
+        self.assertFalse(os.path.exists(dest))
+        self.assertEqual(len(os.listdir(self.checkpoint_dir)), 1)
+
+        self.cos.fail_ranges.clear()
+        self.cos.requests.clear()
+        client.download_file("in/big.bin", dest)
+        self.assertEqual(self.read(dest), data)
+        ranged = [r for r in self.cos.requests if r[0] == "GET" and "Range" in r[3]]
+        self.assertEqual([r[3]["Range"] for r in ranged], [f"bytes={2 * MB}-{3 * MB - 1}"])
+        pass
+
+    def test_cos_paths_dispatch(self):
+        with mock.patch.object(storage, "_cos_storage", None), \
+                mock.patch.dict(os.environ, {"HQJOB_COS_CONFIG": self.config_file}):
+            backend = storage.cos_storage()
+            self.assertIsInstance(backend, COSStorage)
+            # one backend, one client for the process
+            self.assertIs(storage.cos_storage(), backend)
+            self.assertIs(storage.cos_client(), backend.client)
+            self.cos.put("in/x.txt", b"x")
+            storage.download_file("cos://in/x.txt", os.path.join(self.tmp, "x.txt"))
+            self.assertEqual(self.read(os.path.join(self.tmp, "x.txt")), b"x")
+            pass
+        with mock.patch.object(storage, "_cos_storage", None), \
+                mock.patch.dict(os.environ, {"HQJOB_COS_CONFIG": os.path.join(self.tmp, "missing.conf")}):
+            self.assertIsInstance(storage.cos_storage(), COSCMDStorage)
+            with self.assertRaises(FileNotFoundError):
+                storage.cos_client()
+            pass
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from hq_job import env_prep
+from hq_job.env_prep import EnvPreparer
+from hq_job.job_engine import JobDescription
+
+
+class RecordingPreparer(EnvPreparer):
+    """runs no pip, records what it would run"""
+
+    def __init__(self, *args, pip_result=0, **kwargs):
+        super().__init__(*args, retry_interval=0, **kwargs)
+        self.pip_calls = []
+        self.pip_result = pip_result
+        pass
+
+    def _pip(self, args):
+        self.pip_calls.append(args)
+        return self.pip_result
+    pass
+
+
+class TestEnvPrep(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        pass
+
+    def test_requirement_satisfied(self):
+        self.assertTrue(env_prep.requirement_satisfied("psutil>=1.0"))
+        self.assertFalse(env_prep.requirement_satisfied("psutil<0.0.1"))
+        self.assertFalse(env_prep.requirement_satisfied("surely-not-installed-package-xyz"))
+        self.assertTrue(env_prep.requirement_satisfied('pywin32; sys_platform == "nonexistent"'))
+        self.assertIsNone(env_prep.requirement_satisfied("pkg @ https://example.com/pkg-1.0.tar.gz"))
+        self.assertIsNone(env_prep.requirement_satisfied("--extra-index-url https://example.com"))
+        pass
+
+    def test_merge_requirements(self):
+        self.assertEqual(env_prep.merge_requirements([]), ["numpy<2.0.0"])
+        self.assertEqual(env_prep.merge_requirements(["NumPy==2.1.0", "scipy"]), ["NumPy==2.1.0", "scipy"])
+        self.assertEqual(env_prep.merge_requirements(["scipy"]), ["numpy<2.0.0", "scipy"])
+        pass
+
+    def test_satisfied_requirements_skip_pip(self):
+        preparer = RecordingPreparer(["psutil>=1.0"], cache_dir=self.cache_dir)
+        self.assertTrue(preparer.prepare())
+        self.assertEqual(preparer.pip_calls, [])
+        self.assertEqual([name for name, _ in preparer.timings], ["check requirements"])
+        with open(preparer.marker_file(), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["requirements"], ["psutil>=1.0"])
+            pass
+        pass
+
+    def test_only_missing_requirements_are_installed(self):
+        preparer = RecordingPreparer(["psutil>=1.0", "surely-not-installed-package-xyz==1.0"],
+                                     cache_dir=self.cache_dir)
+        self.assertTrue(preparer.prepare())
+        self.assertEqual(preparer.pip_calls, [["uninstall", "-y", "surely-not-installed-package-xyz"],
+                                              ["install", "surely-not-installed-package-xyz==1.0"]])
+        self.assertEqual([name for name, _ in preparer.timings], ["check requirements", "uninstall", "install"])
+
+        failing = RecordingPreparer(["surely-not-installed-package-xyz"], cache_dir=self.cache_dir,
+                                    pip_result=1, retries=3)
+        self.assertFalse(failing.prepare())
+        self.assertEqual(len(failing.pip_calls), 4)
+        self.assertFalse(os.path.exists(failing.marker_file()))
+        pass
+
+    def test_unverifiable_requirements_are_cached_by_hash(self):
+        requirements = ["pkg @ https://example.com/pkg-1.0.tar.gz"]
+        preparer = RecordingPreparer(requirements, cache_dir=self.cache_dir)
+        self.assertTrue(preparer.prepare())
+        self.assertEqual(preparer.pip_calls[-1], ["install"] + requirements)
+
+        again = RecordingPreparer(requirements, cache_dir=self.cache_dir)
+        self.assertTrue(again.prepare())
+        self.assertEqual(again.pip_calls, [])
+        # other requirements, other marker
+        other = RecordingPreparer(requirements + ["psutil"], cache_dir=self.cache_dir)
+        self.assertNotEqual(other.key(), again.key())
+        self.assertEqual(other.unsatisfied(), requirements)
+        pass
+
+    def test_job_description_round_trip(self):
+        job = JobDescription()
+        job.requirements = ["numpy<2.0.0", "scipy>=1.10"]
+        self.assertEqual(JobDescription.from_json(job.to_json()).requirements, job.requirements)
+        self.assertEqual(JobDescription.from_env(job.to_env()).requirements, job.requirements)
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,280 @@
 
 
+import io
+import json
+import hashlib
+import shutil
+import sys
+import tarfile
+import tempfile
 import unittest
+from unittest import mock
 import os
 import hq_job.file_utils
+from hq_job import storage
+
+from fake_cos import FakeCOS
+
+
+class TestReadChunk(unittest.TestCase):
+
+    def read(self, content: bytes, **kwargs):
+        return hq_job.file_utils.read_chunk(io.BytesIO(content), len(content), **kwargs)
+
+    def test_offsets(self):
+        content = "".join(f"line {i}\n" for i in range(100)).encode()
+        data, start, next_offset = self.read(content, max_bytes=20)
+        self.assertEqual((data, start, next_offset), (content[:20], 0, 20))
+        data, start, next_offset = self.read(content, offset=next_offset)
+        self.assertEqual(data, content[20:])
+        self.assertEqual(self.read(content, offset=len(content)), (b"", len(content), len(content)))
+        # rewritten file, start over
+        self.assertEqual(self.read(content[:10], offset=50), (content[:10], 0, 10))
+        pass
+
+    def test_tail_lines(self):
+        content = "".join(f"line {i}\n" for i in range(100)).encode()
+        data, start, _ = self.read(content, tail_lines=3)
+        self.assertEqual(data, b"line 97\nline 98\nline 99\n")
+        self.assertEqual(self.read(b"a\nb\nno newline", tail_lines=2)[0], b"b\nno newline")
+        self.assertEqual(self.read(b"a\nb\n", tail_lines=10)[0], b"a\nb\n")
+        # never before offset, never more than max_bytes
+        self.assertEqual(self.read(content, tail_lines=3, offset=len(content) - 8)[0], b"line 99\n")
+        self.assertEqual(self.read(content, tail_lines=3, max_bytes=10)[0], content[-10:])
+        # lines longer than the read-back block
+        long_lines = b"x" * 100000 + b"\n" + b"y" * 100000 + b"\n"
+        data, start, _ = hq_job.file_utils.read_chunk(io.BytesIO(long_lines), len(long_lines), tail_lines=1)
+        self.assertEqual(start, 100001)
+        pass
+
+    def test_split_utf8_is_left_for_next_read(self):
+        content = "日志".encode()
+        data, start, next_offset = self.read(content, max_bytes=4)
+        self.assertEqual((data, next_offset), ("日".encode(), 3))
+        data, _, next_offset = self.read(content, offset=next_offset)
+        self.assertEqual((data.decode(), next_offset), ("志", 6))
+        pass
+
+
+class TestPackFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "data")
+        self.files = {"a.bin": os.urandom(3000), "b.txt": b"b" * 5000, "sub/c.bin": os.urandom(100),
+                      "sub/deep/d.bin": os.urandom(7000), "sub/e.txt": b""}
+        for name, data in self.files.items():
+            path = os.path.join(self.source, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+                pass
+            pass
+        self.packs = os.path.join(self.tmp, "packs")
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def manifest(self):
+        with open(os.path.join(self.packs, "ds.manifest.json")) as f:
+            return json.load(f)
+
+    def test_round_trip_with_every_codec(self):
+        for codec in ["none", "gzip", "zstd", "lz4"]:
+            with self.subTest(codec=codec):
+                shutil.rmtree(self.packs, ignore_errors=True)
+                names = hq_job.file_utils.pack_files_by_fixed_size(
+                    self.source, self.packs, "ds", size=6000, workers=2, codec=codec)
+                ext = hq_job.file_utils.CODEC_EXTENSIONS[codec]
+                self.assertEqual(names, [os.path.join(self.packs, f"ds_{i}.{ext}") for i in range(3)])
+                manifest = self.manifest()
+                self.assertEqual(manifest["codec"], codec)
+                self.assertEqual(sorted(e["path"] for e in manifest["files"]), sorted(self.files))
+                for entry in manifest["files"]:
+                    self.assertEqual(entry["sha256"], hashlib.sha256(self.files[entry["path"]]).hexdigest())
+                    pass
+
+                out = os.path.join(self.tmp, "out_" + codec)
+                hq_job.file_utils.unpack_files_and_delete(self.packs, out, "ds", postfix=ext)
+                for name, data in self.files.items():
+                    with open(os.path.join(out, name), "rb") as f:
+                        self.assertEqual(f.read(), data)
+                        pass
+                    pass
+                self.assertFalse(any(os.path.exists(n) for n in names))
+                pass
+            pass
+        pass
+
+    def test_offsets_point_into_the_tar(self):
+        hq_job.file_utils.pack_files_by_fixed_size(self.source, self.packs, "ds", size=6000, workers=1)
+        manifest = self.manifest()
+        # walk order, a file bigger than the shard size gets a shard of its own
+        self.assertEqual([(e["path"], e["shard"]) for e in manifest["files"]],
+                         [("a.bin", 0), ("b.txt", 1), ("sub/c.bin", 1), ("sub/e.txt", 1), ("sub/deep/d.bin", 2)])
+        self.assertEqual([s["bytes"] for s in manifest["shards"]], [3000, 5100, 7000])
+        for entry in manifest["files"]:
+            with open(os.path.join(self.packs, manifest["shards"][entry["shard"]]["name"]), "rb") as f:
+                f.seek(entry["offset"])
+                self.assertEqual(f.read(entry["size"]), self.files[entry["path"]])
+                pass
+            pass
+        # the offsets tarfile finds when it scans the shards
+        for i, shard in enumerate(manifest["shards"]):
+            with hq_job.file_utils.open_tar(os.path.join(self.packs, shard["name"])) as tar:
+                members = [(m.name, m.offset, m.offset_data) for m in tar.getmembers()]
+                pass
+            self.assertEqual(members, [(e["path"], e["header_offset"], e["offset"])
+                                       for e in manifest["files"] if e["shard"] == i])
+            pass
+        pass
+
+    def test_single_file_and_codec_fallback(self):
+        with mock.patch.dict(sys.modules, {"zstandard": None}):
+            names = hq_job.file_utils.pack_files_by_fixed_size(
+                os.path.join(self.source, "a.bin"), self.packs, "one", codec="zstd")
+            pass
+        self.assertEqual(names, [os.path.join(self.packs, "one_0.tar.gz")])
+        with hq_job.file_utils.open_tar(names[0]) as tar:
+            self.assertEqual(tar.getnames(), ["a.bin"])
+            pass
+        pass
+
+    def test_parallel_unpack_deletes_each_shard(self):
+        names = hq_job.file_utils.pack_files_by_fixed_size(self.source, self.packs, "ds", size=6000, codec="lz4")
+        left_at_start = []
+        extract = hq_job.file_utils._extract
+
+        def recording_extract(tar, destination):
+            left_at_start.append(sum(os.path.exists(n) for n in names))
+            return extract(tar, destination)
+
+        out = os.path.join(self.tmp, "out")
+        with mock.patch.object(hq_job.file_utils, "_extract", side_effect=recording_extract):
+            hq_job.file_utils.unpack_files_and_delete(self.packs, out, "ds", postfix=None, workers=1)
+            pass
+        # a shard is gone before the next one starts
+        self.assertEqual(left_at_start, [3, 2, 1])
+
+        hq_job.file_utils.pack_files_by_fixed_size(self.source, self.packs, "ds", size=6000, codec="zstd")
+        out = os.path.join(self.tmp, "out_parallel")
+        hq_job.file_utils.unpack_files_and_delete(self.packs, out, "ds", postfix=None, workers=3)
+        for name, data in self.files.items():
+            with open(os.path.join(out, name), "rb") as f:
+                self.assertEqual(f.read(), data)
+                pass
+            pass
+        self.assertEqual(os.listdir(self.packs), ["ds.manifest.json"])
+        pass
+
+    def test_members_outside_the_destination_are_rejected(self):
+        out = os.path.join(self.tmp, "out")
+
+        def member(name, data=b"", linkname=None):
+            info = tarfile.TarInfo(name)
+            if linkname is not None:
+                info.type, info.linkname = tarfile.SYMTYPE, linkname
+                pass
+            info.size = len(data)
+            return info, io.BytesIO(data)
+
+        for members in [[member("../escaped.txt", b"x")],
+                        [member(os.path.join(self.tmp, "escaped.txt"), b"x")],
+                        [member("link", linkname=self.tmp), member("link/escaped.txt", b"x")]]:
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode="w") as tar:
+                for info, data in members:
+                    tar.addfile(info, data)
+                    pass
+                pass
+            buf.seek(0)
+            with self.subTest(name=members[-1][0].name):
+                with self.assertRaises(tarfile.TarError):
+                    hq_job.file_utils.extract_stream(buf, out)
+                    pass
+                self.assertFalse(os.path.exists(os.path.join(self.tmp, "escaped.txt")))
+                pass
+            pass
+        pass
+    pass
+
+
+class TestUnpackFromStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "data")
+        self.files = {"a.bin": os.urandom(3000), "sub/b.bin": os.urandom(5000), "sub/deep/c.txt": b"c" * 4000}
+        for name, data in self.files.items():
+            path = os.path.join(self.source, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+                pass
+            pass
+        self.cos = FakeCOS().start()
+        config_file = os.path.join(self.tmp, "cos.conf")
+        self.cos.write_config(config_file)
+        for patcher in [mock.patch.object(storage, "_cos_storage", None),
+                        mock.patch.dict(os.environ, {"HQJOB_COS_CONFIG": config_file})]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+            pass
+        packs = os.path.join(self.tmp, "packs")
+        hq_job.file_utils.pack_files_by_fixed_size(self.source, packs, "ds", size=5000, codec="gzip")
+        for name in os.listdir(packs):
+            with open(os.path.join(packs, name), "rb") as f:
+                self.cos.put(f"packs/{name}", f.read())
+                pass
+            pass
+        self.out = os.path.join(self.tmp, "out")
+        pass
+
+    def tearDown(self):
+        self.cos.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def check_out(self):
+        for name, data in self.files.items():
+            with open(os.path.join(self.out, name), "rb") as f:
+                self.assertEqual(f.read(), data)
+                pass
+            pass
+        self.assertEqual(sorted(os.listdir(self.out)), ["a.bin", "sub"])
+        pass
+
+    def test_streamed_in_parallel(self):
+        paths = hq_job.file_utils.unpack_files_from_storage("cos://packs", self.out, "ds", workers=2)
+        self.assertEqual(paths, [f"cos://packs/ds_{i}.tar.gz" for i in range(3)])
+        self.check_out()
+        # the shards are still in storage
+        self.assertEqual(len(self.cos.objects), 4)
+        pass
+
+    def test_without_manifest(self):
+        self.cos.delete("packs/ds.manifest.json")
+        paths = hq_job.file_utils.unpack_files_from_storage("cos://packs/", self.out, "ds", workers=1)
+        self.assertEqual(len(paths), 3)
+        self.check_out()
+        pass
+
+    def test_backend_without_streams(self):
+        def download(remote_path, local_path):
+            with open(local_path, "wb") as f:
+                f.write(self.cos.get(remote_path[len("cos://"):])[0])
+                pass
+            pass
+
+        with mock.patch.object(storage, "open_file", side_effect=NotImplementedError), \
+                mock.patch.object(storage, "download_file", side_effect=download):
+            hq_job.file_utils.unpack_files_from_storage("cos://packs", self.out, "ds", workers=1)
+            pass
+        self.check_out()
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
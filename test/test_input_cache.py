@@ -0,0 +1,156 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from hq_job.input_cache import InputCache
+
+
+class FakeCOS(object):
+    """objects of a bucket, listed and downloaded the way the cache sees COS"""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)    # key -> content
+        self.downloads = []
+        pass
+
+    def list_objects(self, prefix):
+        return [(key, f'"etag-{hash(content)}"', len(content))
+                for key, content in sorted(self.objects.items()) if key.startswith(prefix)]
+
+    def download(self, remote_path, local_path):
+        key = remote_path[len("cos://"):]
+        self.downloads.append(key)
+        with open(local_path, "wb") as f:
+            f.write(self.objects[key])
+            pass
+        pass
+    pass
+
+
+class TestInputCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp, "cache")
+        self.cos = FakeCOS({
+            "ml_backend/input/model.pt": b"m" * 100,
+            "ml_backend/input/data/a.bin": b"a" * 200,
+            "ml_backend/input/data/sub/b.bin": b"b" * 300,
+            "ml_backend/input/data/sub/": b"",
+        })
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def cache(self, max_bytes=10000) -> InputCache:
+        return InputCache(self.cache_dir, max_bytes=max_bytes, list_objects=self.cos.list_objects,
+                          download=self.cos.download)
+
+    def test_hits_are_linked_not_downloaded(self):
+        first = self.cache()
+        work1 = os.path.join(self.tmp, "work1")
+        first.download("cos://ml_backend/input/model.pt", os.path.join(work1, "model.pt"))
+        first.download("cos://ml_backend/input/data/", os.path.join(work1, "data"))
+        self.assertEqual((first.hits, first.misses, first.miss_bytes), (0, 3, 600))
+        with open(os.path.join(work1, "data", "sub", "b.bin"), "rb") as f:
+            self.assertEqual(f.read(), b"b" * 300)
+            pass
+
+        # a later job on the same container, not root: hits are hardlinked
+        second = self.cache()
+        work2 = os.path.join(self.tmp, "work2")
+        with mock.patch("os.geteuid", return_value=1000, create=True):
+            second.download("cos://ml_backend/input/data/", os.path.join(work2, "data"))
+            pass
+        self.assertEqual((second.hits, second.misses, second.hit_bytes), (2, 0, 500))
+        self.assertEqual(len(self.cos.downloads), 3)
+        entry = second._entry_path(InputCache.entry_id(*self.cos.list_objects("ml_backend/input/data/a.bin")[0]))
+        self.assertEqual(os.stat(os.path.join(work2, "data", "a.bin")).st_ino, os.stat(entry).st_ino)
+
+        # a changed object is a new entry
+        self.cos.objects["ml_backend/input/model.pt"] = b"n" * 100
+        second.download("cos://ml_backend/input/model.pt", os.path.join(work2, "model.pt"))
+        self.assertEqual(second.misses, 1)
+        with open(os.path.join(work2, "model.pt"), "rb") as f:
+            self.assertEqual(f.read(), b"n" * 100)
+            pass
+        with self.assertRaises(FileNotFoundError):
+            second.download("cos://ml_backend/input/missing.pt", os.path.join(work2, "missing.pt"))
+            pass
+        pass
+
+    def test_writes_to_staged_inputs_do_not_reach_the_cache(self):
+        cache = self.cache()
+        staged = os.path.join(self.tmp, "work1", "model.pt")
+        cache.download("cos://ml_backend/input/model.pt", staged)
+        try:
+            with open(staged, "r+b") as f:
+                f.write(b"x" * 10)
+                pass
+        except PermissionError:
+            # not root, a read-only hardlink of the entry
+            pass
+        restaged = os.path.join(self.tmp, "work2", "model.pt")
+        cache.download("cos://ml_backend/input/model.pt", restaged)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        with open(restaged, "rb") as f:
+            self.assertEqual(f.read(), b"m" * 100)
+            pass
+
+        # hardlinks, for users the mode applies to, are read-only
+        linked = os.path.join(self.tmp, "work3", "model.pt")
+        with mock.patch("os.geteuid", return_value=1000, create=True):
+            cache.download("cos://ml_backend/input/model.pt", linked)
+            pass
+        self.assertEqual(os.stat(linked).st_mode & 0o222, 0)
+        pass
+
+    def test_lru_eviction(self):
+        cache = self.cache()
+        work = os.path.join(self.tmp, "work")
+        cache.download("cos://ml_backend/input/data/", os.path.join(work, "data"))
+        cache.download("cos://ml_backend/input/model.pt", os.path.join(work, "model.pt"))
+        # make a.bin (200) the oldest, b.bin next, model.pt the newest
+        now = time.time()
+        by_size = {size: path for _, size, path in cache._entries()}
+        os.utime(by_size[200], (now - 300, now - 300))
+        os.utime(by_size[300], (now - 200, now - 200))
+        os.utime(by_size[100], (now - 100, now - 100))
+
+        # entries linked by this process are kept
+        cache.max_bytes = 150
+        self.assertEqual(cache.evict(), 0)
+
+        later = self.cache(max_bytes=400)
+        self.assertEqual(later.evict(), 200)
+        self.assertEqual(later.size(), 400)
+        self.assertFalse(os.path.exists(by_size[200]))
+        # the working copy of an evicted entry survives, it's a hardlink
+        self.assertTrue(os.path.exists(os.path.join(work, "data", "a.bin")))
+        later.max_bytes = 100
+        self.assertEqual(later.evict(), 300)
+        self.assertEqual((later.evicted, later.evicted_bytes), (2, 500))
+        pass
+
+    def test_listing_failure_falls_back_to_plain_download(self):
+        def broken(prefix):
+            raise FileNotFoundError("Config file ~/.cos.conf not found")
+
+        cache = InputCache(self.cache_dir, max_bytes=1000, list_objects=broken, download=self.cos.download)
+        work = os.path.join(self.tmp, "work")
+        os.makedirs(work)
+        cache.download("cos://ml_backend/input/model.pt", os.path.join(work, "model.pt"))
+        self.assertEqual((cache.hits, cache.misses), (0, 0))
+        self.assertEqual(cache.size(), 0)
+        self.assertTrue(os.path.exists(os.path.join(work, "model.pt")))
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from hq_job.input_staging import InputStager
+
+
+class FakeDownloads(object):
+    """stands in for storage.download_file: writes `size` bytes after `delay` seconds"""
+
+    def __init__(self, delays, fail=()):
+        self.delays = delays
+        self.fail = set(fail)
+        self.running = 0
+        self.max_running = 0
+        self.finished = []
+        self.lock = threading.Lock()
+        pass
+
+    def __call__(self, remote_path, local_path):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            pass
+        try:
+            time.sleep(self.delays.get(remote_path, 0.0))
+            if remote_path in self.fail:
+                raise RuntimeError("coscmd download failed: 256")
+            with open(local_path, "wb") as f:
+                f.write(b"x" * 1000)
+                pass
+            self.finished.append(remote_path)
+        finally:
+            with self.lock:
+                self.running -= 1
+                pass
+            pass
+        pass
+    pass
+
+
+class TestInputStaging(unittest.TestCase):
+
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp()
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir, ignore_errors=True)
+        pass
+
+    def test_bounded_parallel_downloads(self):
+        inputs = [f"cos://bucket/data/shard_{i}.tar" for i in range(8)]
+        downloads = FakeDownloads({p: 0.1 for p in inputs})
+        stager = InputStager(inputs, self.working_dir, max_workers=3, download=downloads).start()
+        started = time.time()
+        stager.wait_required()
+        # everything is required by default
+        self.assertEqual(sorted(downloads.finished), sorted(inputs))
+        self.assertLess(time.time() - started, 0.7)
+        self.assertEqual(downloads.max_running, 3)
+        self.assertEqual(stager.close(), [])
+        for transfer in stager.transfers:
+            self.assertEqual((transfer.status, transfer.bytes), ("done", 1000))
+            self.assertGreater(transfer.throughput, 0)
+            pass
+        with open(stager.manifest_file, encoding="utf-8") as f:
+            self.assertTrue(json.load(f)["ready"])
+            pass
+        pass
+
+    def test_command_starts_with_required_subset(self):
+        inputs = ["cos://bucket/model.pt", "cos://bucket/big_0.tar", "cos://bucket/big_1.tar"]
+        downloads = FakeDownloads({"cos://bucket/model.pt": 0.05, "cos://bucket/big_0.tar": 0.5,
+                                   "cos://bucket/big_1.tar": 0.5})
+        stager = InputStager(inputs, self.working_dir, required=["cos://bucket/model.pt"], max_workers=3,
+                             download=downloads).start()
+        stager.wait_required()
+        self.assertEqual(downloads.finished, ["cos://bucket/model.pt"])
+        self.assertTrue(os.path.exists(os.path.join(self.working_dir, "model.pt")))
+        with open(stager.manifest_file, encoding="utf-8") as f:
+            manifest = json.load(f)
+            pass
+        self.assertFalse(manifest["ready"])
+        self.assertEqual([i["status"] for i in manifest["inputs"]], ["done", "running", "running"])
+        self.assertEqual(stager.close(), [])
+        self.assertEqual(len(downloads.finished), 3)
+        pass
+
+    def test_failures(self):
+        inputs = ["cos://bucket/a.tar", "cos://bucket/b.tar", "cos://bucket/c.tar"]
+        with self.assertRaises(ValueError):
+            InputStager(inputs, self.working_dir, required=["cos://bucket/other.tar"])
+            pass
+
+        downloads = FakeDownloads({"cos://bucket/c.tar": 0.3}, fail=["cos://bucket/a.tar"])
+        stager = InputStager(inputs, self.working_dir, required=["cos://bucket/a.tar"], max_workers=1,
+                             download=downloads).start()
+        with self.assertRaises(RuntimeError):
+            stager.wait_required()
+            pass
+        # the job ended, what hasn't started is dropped
+        failed = stager.close(cancel=True)
+        self.assertEqual([t.input_path for t in failed], ["cos://bucket/a.tar"])
+        self.assertIn("cancelled", [t.status for t in stager.transfers])
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from hq_job.job_engine import JobDescription
+from hq_job.job_engine_local import JobEngineLocal
+from hq_job.job_registry import JobRegistry
+
+
+class TestJobRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs_dir = tempfile.mkdtemp()
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+        pass
+
+    def test_crud_and_listing(self):
+        registry = JobRegistry(self.jobs_dir)
+        for i in range(5):
+            job_id = registry.create({"name": f"job-{i}", "status": "pending",
+                                      "start_time": f"2026-03-18T10:0{i}:00"})
+            self.assertEqual(job_id, i + 1)
+            pass
+        registry.update(2, status="running", pid=123)
+        registry.update(4, status="running")
+
+        self.assertEqual(registry.status(2), "running")
+        self.assertEqual(registry.get(2)["pid"], 123)
+        self.assertIsNone(registry.get(404))
+        self.assertIsNone(registry.update(404, status="running"))
+        self.assertEqual([j["id"] for j in registry.list()], [5, 4, 3, 2, 1])
+        self.assertEqual([j["id"] for j in registry.list(status="running")], [4, 2])
+        self.assertEqual([j["id"] for j in registry.list(started_after="2026-03-18T10:02:00", limit=2)], [5, 4])
+        self.assertEqual(registry.count(status="pending"), 3)
+
+        # a second connection, like the worker process, sees the same data
+        other = JobRegistry(self.jobs_dir)
+        other.update(5, status="completed")
+        self.assertEqual(registry.status(5), "completed")
+        other.close()
+        registry.close()
+        pass
+
+    def test_lookups_use_indexes(self):
+        registry = JobRegistry(self.jobs_dir)
+        plan = " ".join(row[-1] for row in registry._query(
+            "EXPLAIN QUERY PLAN SELECT info FROM jobs WHERE status = ? ORDER BY id DESC", ("running",)))
+        self.assertIn("idx_jobs_status", plan)
+        plan = " ".join(row[-1] for row in registry._query(
+            "EXPLAIN QUERY PLAN SELECT status FROM jobs WHERE id = ?", (1,)))
+        self.assertIn("INTEGER PRIMARY KEY", plan)
+        self.assertEqual(registry._query("PRAGMA journal_mode")[0][0], "wal")
+        registry.close()
+        pass
+
+    def test_migrate_from_dirs(self):
+        for job_id, status in ((1, "completed"), (7, "failed")):
+            job_dir = os.path.join(self.jobs_dir, f"job_{job_id}")
+            os.makedirs(job_dir)
+            with open(os.path.join(job_dir, "status.json"), "w", encoding="utf-8") as f:
+                json.dump({"command": "python", "status": status}, f)
+                pass
+            pass
+        os.makedirs(os.path.join(self.jobs_dir, "job_broken"))
+
+        registry = JobRegistry(self.jobs_dir)
+        self.assertEqual(registry.migrate_from_dirs(), 2)
+        self.assertEqual(registry.status(7), "failed")
+        self.assertEqual(registry.get(1)["args"], [])
+        # only once per jobs_dir
+        self.assertEqual(registry.migrate_from_dirs(), 0)
+        # new ids continue after the migrated ones
+        self.assertEqual(registry.create({"status": "pending"}), 8)
+        registry.close()
+        pass
+
+    def test_engine_and_worker(self):
+        output_dir = os.path.join(self.jobs_dir, "out")
+        os.makedirs(output_dir)
+        engine = JobEngineLocal(jobs_dir=self.jobs_dir, use_supervisor=False)
+        job_id = engine.run(JobDescription(
+            command=sys.executable, args=["-c", "\"print('hello')\""], working_dir="work", output_dir=output_dir))
+
+        for _ in range(100):
+            if engine.status(job_id) in ("completed", "failed"):
+                break
+            time.sleep(0.1)
+            pass
+        self.assertEqual(engine.status(job_id), "completed")
+        self.assertEqual(engine.list(status="completed")[0]["exit_code"], 0)
+        with open(os.path.join(self.jobs_dir, f"job_{job_id}", "status.json"), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["status"], "completed")
+            pass
+        self.assertIn("hello", engine.log(job_id).data)
+        head = engine.log(job_id, max_bytes=10)
+        rest = engine.log(job_id, offset=head.next_offset)
+        self.assertEqual((head.offset, head.next_offset, rest.next_offset), (0, 10, rest.size))
+        self.assertEqual(head.data + rest.data, engine.log(job_id).data)
+        self.assertTrue(engine.log(job_id, tail_lines=2).data.startswith("exit code: 0\nend time: "))
+        with self.assertRaises(ValueError):
+            engine.status(job_id + 1)
+            pass
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from hq_job.job_engine import JobDescription
+from hq_job.job_engine_local import JobEngineLocal
+from hq_job.job_registry import JobRegistry
+from hq_job.job_scheduler import JobScheduler
+
+
+class TestJobScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs_dir = tempfile.mkdtemp()
+        self.registry = JobRegistry(self.jobs_dir)
+        self.launched = []
+        self.scheduler = JobScheduler(self.registry, cpu_slots=4, memory_slots=1024, resource_tokens=1,
+                                      launcher=lambda job_dir, job_id: self.launched.append(job_id))
+        pass
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+        pass
+
+    def submit(self, priority=0, cpu_num=1, memory_size=0, resource_tokens=0) -> int:
+        job_info = {"status": "queued", "priority": priority, "cpu_num": cpu_num, "memory_size": memory_size,
+                    "resource_tokens": resource_tokens, "submit_time": "2026-03-18T10:00:00"}
+        self.scheduler.check(job_info)
+        return self.registry.create(job_info)
+
+    def finish(self, job_id):
+        self.registry.update(job_id, status="completed")
+        pass
+
+    def test_priority_then_submit_order(self):
+        low = self.submit(priority=0, cpu_num=2)
+        high = [self.submit(priority=5, cpu_num=2) for _ in range(2)]
+        self.assertEqual(self.scheduler.schedule(), high)
+        self.assertEqual(self.registry.status(low), "queued")
+        self.assertIsNotNone(self.registry.get(high[0])["start_time"])
+
+        self.finish(high[0])
+        self.assertEqual(self.scheduler.schedule(), [low])
+        self.assertEqual(self.launched, high + [low])
+        pass
+
+    def test_head_of_queue_is_not_skipped(self):
+        running = self.submit(cpu_num=3)
+        self.scheduler.schedule()
+        big = self.submit(priority=1, cpu_num=4)
+        small = self.submit(priority=0, cpu_num=1)
+        # the small job would fit, but it must not overtake the big one
+        self.assertEqual(self.scheduler.schedule(), [])
+        self.finish(running)
+        self.assertEqual(self.scheduler.schedule(), [big])
+        self.finish(big)
+        self.assertEqual(self.scheduler.schedule(), [small])
+        pass
+
+    def test_memory_tokens_and_admission_control(self):
+        a = self.submit(memory_size=800, resource_tokens=1)
+        b = self.submit(memory_size=300)
+        c = self.submit(resource_tokens=1)
+        self.assertEqual(self.scheduler.schedule(), [a])
+        self.finish(a)
+        self.assertEqual(self.scheduler.schedule(), [b, c])
+        with self.assertRaises(ValueError):
+            self.submit(cpu_num=5)
+            pass
+        with self.assertRaises(ValueError):
+            self.submit(resource_tokens=2)
+            pass
+        pass
+
+    def test_metrics_and_config(self):
+        self.submit(cpu_num=4)
+        self.submit()
+        self.scheduler.schedule()
+        metrics = self.scheduler.metrics()
+        self.assertEqual((metrics["queue_depth"], metrics["active"]), (1, 1))
+        self.assertEqual(metrics["used"], {"cpu": 4, "memory": 0, "tokens": 0})
+        self.assertGreater(metrics["oldest_wait_seconds"], 0)
+        self.assertGreater(metrics["avg_wait_seconds"], 0)
+
+        self.scheduler.save_config()
+        loaded = JobScheduler.from_registry(self.registry)
+        self.assertEqual(loaded.capacity, {"cpu": 4, "memory": 1024, "tokens": 1})
+        pass
+
+    def test_lowered_capacity_rejects_jobs_that_no_longer_fit(self):
+        running = self.submit(cpu_num=4)
+        self.scheduler.schedule()
+        big = self.submit(priority=1, cpu_num=4)
+        small = self.submit()
+        self.scheduler.capacity["cpu"] = 2
+        self.finish(running)
+        self.assertEqual(self.scheduler.schedule(), [small])
+        self.assertEqual(self.registry.status(big), "failed")
+        self.assertIn("4 cpu > 2", self.registry.get(big)["error_message"])
+        pass
+
+    def test_engine_keeps_saved_capacity(self):
+        JobEngineLocal(jobs_dir=self.jobs_dir, cpu_slots=3, resource_tokens=2, use_supervisor=False)
+        # e.g. local_job_list: no slots given, the saved ones stay
+        engine = JobEngineLocal(jobs_dir=self.jobs_dir, use_supervisor=False)
+        self.assertEqual((engine.scheduler.capacity["cpu"], engine.scheduler.capacity["tokens"]), (3, 2))
+        engine = JobEngineLocal(jobs_dir=self.jobs_dir, cpu_slots=1, use_supervisor=False)
+        self.assertEqual((engine.scheduler.capacity["cpu"], engine.scheduler.capacity["tokens"]), (1, 2))
+        self.assertEqual(JobScheduler.from_registry(self.registry).capacity["cpu"], 1)
+        pass
+
+    def test_engine_queues_and_workers_admit(self):
+        output_dir = os.path.join(self.jobs_dir, "out")
+        os.makedirs(output_dir)
+        engine = JobEngineLocal(jobs_dir=self.jobs_dir, cpu_slots=1, use_supervisor=False)
+        job_ids = []
+        for i in range(3):
+            job = JobDescription(command=sys.executable, args=["-c", "\"import time; time.sleep(0.3)\""],
+                                 working_dir="work", output_dir=output_dir)
+            job.priority = i
+            job_ids.append(engine.run(job))
+            pass
+        # the first job took the only slot, the others wait
+        self.assertEqual([engine.status(job_id) for job_id in job_ids[1:]], ["queued", "queued"])
+        self.assertEqual(engine.metrics()["queue_depth"], 2)
+        engine.stop(job_ids[1])
+
+        for _ in range(100):
+            if engine.status(job_ids[2]) == "completed":
+                break
+            time.sleep(0.1)
+            pass
+        self.assertEqual([engine.status(job_id) for job_id in job_ids], ["completed", "stopped", "completed"])
+        first, _, last = [engine.registry.get(job_id) for job_id in job_ids]
+        self.assertGreaterEqual(last["start_time"], first["end_time"])
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
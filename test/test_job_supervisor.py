@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import psutil
+
+from hq_job import job_supervisor
+from hq_job.job_engine import JobDescription
+from hq_job.job_engine_local import JobEngineLocal
+from hq_job.scripts import job_worker_entry as worker
+
+
+@unittest.skipUnless(job_supervisor.supported(), "needs Unix domain sockets")
+class TestJobSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.jobs_dir, "out")
+        os.makedirs(self.output_dir)
+        self.engine = JobEngineLocal(jobs_dir=self.jobs_dir, cpu_slots=2, use_supervisor=True)
+        pass
+
+    def tearDown(self):
+        self.engine.supervisor.shutdown()
+        for _ in range(50):
+            if not os.path.exists(job_supervisor.socket_path(self.jobs_dir)):
+                break
+            time.sleep(0.1)
+            pass
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+        pass
+
+    def job(self, code: str) -> JobDescription:
+        return JobDescription(command=sys.executable, args=["-c", f"\"{code}\""], working_dir="work",
+                              output_dir=self.output_dir)
+
+    def wait(self, job_id, statuses=("completed", "failed", "stopped"), timeout=10.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.engine.status(job_id) in statuses:
+                break
+            time.sleep(0.05)
+            pass
+        return self.engine.status(job_id)
+
+    def test_run_and_exit_codes(self):
+        ok = self.engine.run(self.job("print('hello')"))
+        # the supervisor is up now, later submissions only cost a registry write and a socket call
+        started = time.time()
+        bad = self.engine.run(self.job("import sys; sys.exit(3)"))
+        self.assertLess(time.time() - started, 0.5)
+
+        self.assertEqual(self.wait(ok), "completed")
+        self.assertEqual(self.wait(bad), "failed")
+        self.assertEqual(self.engine.registry.get(bad)["exit_code"], 3)
+        self.assertIn("hello", self.engine.log(ok).data)
+        self.assertTrue(self.engine.registry.get(ok)["supervised"])
+        pass
+
+    def test_jobs_run_in_the_submitter_env_and_cwd(self):
+        first = self.engine.run(self.job("print('up')"))
+        self.assertEqual(self.wait(first), "completed")
+        # the supervisor is up with the env and cwd of the first submission, the next one differs
+        submit_dir = os.path.join(self.jobs_dir, "submitter")
+        os.makedirs(os.path.join(submit_dir, "results"))
+        with open(os.path.join(submit_dir, "results", "model.txt"), "w") as f:
+            f.write("weights")
+            pass
+        cwd = os.getcwd()
+        os.environ["HQJOB_TEST_SUBMITTER"] = "second"
+        os.environ["HQJOB_TEST_SECRET"] = "hunter2"
+        try:
+            os.chdir(submit_dir)
+            job = JobDescription(command=sys.executable,
+                                 args=["-c", "\"import os; print(os.environ['HQJOB_TEST_SUBMITTER'])\""],
+                                 working_dir="work", output_dir="results")
+            job_id = self.engine.run(job)
+        finally:
+            os.chdir(cwd)
+            os.environ.pop("HQJOB_TEST_SUBMITTER")
+            os.environ.pop("HQJOB_TEST_SECRET")
+            pass
+        self.assertEqual(self.wait(job_id), "completed")
+        self.assertIn("second", self.engine.log(job_id).data)
+        # the env is not saved beyond the allow-list
+        self.assertNotIn("hunter2", json.dumps(self.engine.registry.get(job_id)))
+        with open(os.path.join(self.jobs_dir, f"job_{job_id}", "status.json")) as f:
+            self.assertNotIn("hunter2", f.read())
+            pass
+        with open(os.path.join(self.jobs_dir, f"job_{job_id}", "output", "model.txt")) as f:
+            self.assertEqual(f.read(), "weights")
+            pass
+        pass
+
+    def test_stop_and_queue(self):
+        jobs = [self.engine.run(self.job("import time; time.sleep(30)")) for _ in range(3)]
+        self.assertEqual(self.wait(jobs[0], statuses=("running",)), "running")
+        self.assertEqual(self.wait(jobs[1], statuses=("running",)), "running")
+        self.assertEqual(self.engine.status(jobs[2]), "queued")
+        for _ in range(50):
+            if self.engine.registry.get(jobs[0]).get("pid"):
+                break
+            time.sleep(0.05)
+            pass
+        pid = self.engine.registry.get(jobs[0])["pid"]
+
+        self.assertTrue(self.engine.stop(jobs[0]))
+        self.assertEqual(self.engine.status(jobs[0]), "stopped")
+        self.assertFalse(psutil.pid_exists(pid) and psutil.Process(pid).status() != psutil.STATUS_ZOMBIE)
+        # the freed slot goes to the queued job
+        self.assertEqual(self.wait(jobs[2], statuses=("running",)), "running")
+        self.assertEqual(self.engine.registry.get(jobs[0])["exit_code"], -9)
+
+        for job_id in jobs[1:]:
+            self.assertTrue(self.engine.stop(job_id))
+            pass
+        for _ in range(50):
+            if self.engine.supervisor.request("jobs")["jobs"] == {}:
+                break
+            time.sleep(0.05)
+            pass
+        self.assertEqual(self.engine.supervisor.request("jobs")["jobs"], {})
+        pass
+
+    def test_restart_reconciles(self):
+        job_id = self.engine.run(self.job("import time; time.sleep(30)"))
+        self.assertEqual(self.wait(job_id, statuses=("running",)), "running")
+        # a supervisor killed with its jobs can't report their exit anymore
+        pid = self.engine.supervisor.request("ping")["pid"]
+        psutil.Process(pid).kill()
+        psutil.Process(pid).wait(5)
+        os.remove(job_supervisor.socket_path(self.jobs_dir))
+
+        self.engine.supervisor.ensure_running()
+        self.assertEqual(self.engine.status(job_id), "failed")
+        self.assertIn("supervisor restart", self.engine.registry.get(job_id)["error_message"])
+        pass
+    pass
+
+
+@unittest.skipUnless(job_supervisor.supported(), "needs Unix domain sockets")
+class TestSupervisorStopWhileLaunching(unittest.TestCase):
+
+    def setUp(self):
+        self.jobs_dir = tempfile.mkdtemp()
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.jobs_dir, ignore_errors=True)
+        pass
+
+    def test_stop_between_admission_and_popen(self):
+        # admitted by an engine that doesn't launch, then run by a supervisor in this process
+        engine = JobEngineLocal(jobs_dir=self.jobs_dir, cpu_slots=1, use_supervisor=False)
+        engine.scheduler.launcher = lambda job_dir, job_id: None
+        job_id = engine.run(JobDescription(command=sys.executable, args=["-c", "\"import time; time.sleep(30)\""],
+                                           working_dir="work", output_dir="out"))
+        self.assertEqual(engine.status(job_id), "pending")
+        supervisor = job_supervisor.JobSupervisor(self.jobs_dir)
+        start_job_process = worker.start_job_process
+        stopped = []
+        processes = []
+
+        def stop_then_start(*args):
+            stopped.append(supervisor.stop_job(job_id))
+            processes.append(start_job_process(*args))
+            return processes[-1]
+
+        started = time.time()
+        with mock.patch.object(worker, "start_job_process", stop_then_start):
+            supervisor._run(os.path.join(self.jobs_dir, f"job_{job_id}"), job_id)
+            pass
+        self.assertLess(time.time() - started, 10)
+        self.assertEqual(stopped, [True])
+        self.assertEqual(engine.status(job_id), "stopped")
+        self.assertEqual(engine.registry.get(job_id)["exit_code"], -9)
+        self.assertIsNotNone(processes[0].poll())
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from hq_job.scripts.job_worker_entry import LogPump
+
+
+def _child(code: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            bufsize=0)
+
+
+class TestLogPump(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.log_file = tempfile.mkstemp()
+        os.close(fd)
+        pass
+
+    def tearDown(self):
+        os.remove(self.log_file)
+        pass
+
+    def pump(self, code, **kwargs):
+        process = _child(code) if isinstance(code, str) else code
+        with open(self.log_file, "ab") as f:
+            pump = LogPump(f.fileno(), **kwargs)
+            return_code = pump.pump(process)
+            pass
+        with open(self.log_file, "rb") as f:
+            return pump, return_code, f.read()
+
+    def test_copies_output_and_exit_code(self):
+        pump, return_code, data = self.pump(
+            "import sys\nfor i in range(1000): print(i)\nsys.stdout.write('no newline')\nsys.exit(4)")
+        self.assertEqual(return_code, 4)
+        self.assertEqual(data, "".join(f"{i}\n" for i in range(1000)).encode() + b"no newline")
+        self.assertEqual(pump.bytes_written, len(data))
+        pass
+
+    def test_long_line_in_bounded_chunks(self):
+        reads = []
+        real_read = os.read
+
+        def read(fd, n):
+            reads.append(n)
+            return real_read(fd, n)
+
+        process = _child("import sys; sys.stdout.write('x' * 3000000)")
+        with mock.patch("os.read", side_effect=read):
+            _, _, data = self.pump(process, chunk_size=4096)
+            pass
+        self.assertEqual(data, b"x" * 3000000)
+        self.assertEqual(max(reads), 4096)
+        pass
+
+    def test_fsync_policy(self):
+        code = "import sys\nfor i in range(2000): sys.stdout.write('y' * 99 + chr(10))"
+        with mock.patch("os.fsync") as fsync:
+            pump, _, _ = self.pump(code, fsync_ms=0, fsync_bytes=0)
+            pass
+        # only at exit
+        self.assertEqual((fsync.call_count, pump.fsync_count), (1, 1))
+
+        with mock.patch("os.fsync") as fsync:
+            pump, _, data = self.pump(code, fsync_ms=0, fsync_bytes=50000)
+            pass
+        self.assertEqual(pump.bytes_written, 200000)
+        self.assertGreaterEqual(fsync.call_count, 2)
+        self.assertLessEqual(fsync.call_count, 5)
+
+        # a quiet child still gets its output synced on time
+        with mock.patch("os.fsync") as fsync:
+            pump, _, _ = self.pump("import time\nprint('a')\ntime.sleep(0.5)\nprint('b')",
+                                   fsync_ms=100, fsync_bytes=0)
+            pass
+        self.assertEqual(fsync.call_count, 2)
+        pass
+
+    @unittest.skipIf(sys.platform == "win32", "needs a posix shell")
+    def test_exit_with_pipe_held_by_grandchild(self):
+        # the background sleep keeps the pipe open, the pump must still return when the shell exits
+        process = subprocess.Popen("echo done; sleep 30 &", shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, bufsize=0, start_new_session=True)
+        started = time.time()
+        with open(self.log_file, "ab") as f:
+            return_code = LogPump(f.fileno()).pump(process)
+            pass
+        os.killpg(process.pid, 9)
+        self.assertEqual(return_code, 0)
+        self.assertLess(time.time() - started, 5)
+        with open(self.log_file, "rb") as f:
+            self.assertEqual(f.read(), b"done\n")
+            pass
+        pass
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
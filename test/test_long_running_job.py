@@ -28,39 +28,45 @@ def test_long_running_job():
         output_dir="./test"
     )
     
-    # 提交任务
-    job_id = engine.run(job_desc)
-    print(f"提交任务: {job_id}")
+    try:
+        # 提交任务
+        job_id = engine.run(job_desc)
+        print(f"提交任务: {job_id}")
     
-    # 监控任务状态变化
-    for i in range(5):
-        status = engine.status(job_id)
-        print(f"第 {i+1} 次检查 - 任务 {job_id} 状态: {status}")
+        # 监控任务状态变化
+        for i in range(5):
+            status = engine.status(job_id)
+            print(f"第 {i+1} 次检查 - 任务 {job_id} 状态: {status}")
         
-        if status in ['completed', 'failed', 'error']:
-            print(f"任务已完成，最终状态: {status}")
-            break
-        elif status == 'running':
-            print("任务正在运行中...")
-        elif status == 'postprocessing':
-            print("任务正在后处理中...")
-        else:
-            print(f"任务状态: {status}")
+            if status in ['completed', 'failed', 'error']:
+                print(f"任务已完成，最终状态: {status}")
+                break
+            elif status == 'running':
+                print("任务正在运行中...")
+            elif status == 'postprocessing':
+                print("任务正在后处理中...")
+            else:
+                print(f"任务状态: {status}")
         
-        time.sleep(1)
+            time.sleep(1)
     
-    # 获取最终日志
-    logs = engine.log(job_id)
-    print("\n任务日志:")
-    print(logs)
+        # 获取最终日志
+        logs = engine.log(job_id).data
+        print("\n任务日志:")
+        print(logs)
     
-    # 检查状态文件
-    status_file = f"jobs/job_{job_id}/status.json"
-    if os.path.exists(status_file):
-        with open(status_file, 'r', encoding='utf-8') as f:
-            import json
-            status_data = json.load(f)
-            print(f"\n状态文件内容: {status_data['status']}")
+        # 检查状态文件
+        status_file = f"jobs/job_{job_id}/status.json"
+        if os.path.exists(status_file):
+            with open(status_file, 'r', encoding='utf-8') as f:
+                import json
+                status_data = json.load(f)
+                print(f"\n状态文件内容: {status_data['status']}")
+    finally:
+        # 不留下 supervisor 守护进程
+        if engine.supervisor is not None:
+            engine.supervisor.shutdown()
+
 
 if __name__ == "__main__":
     test_long_running_job() 
\ No newline at end of file
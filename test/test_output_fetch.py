@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from hq_job.output_fetch import DeltaFetcher, RemoteFile, fetch_from_cos, LEGACY_STATE_NAME
+from hq_job.ssh_utils import parse_find_output
+from hq_job.storage.cos import COSClient
+
+from fake_cos import FakeCOS
+
+
+class FakeRemote(object):
+    """a remote dir: relative path -> content, the etag changes with every write"""
+
+    def __init__(self, files):
+        self.files = dict()
+        self.version = 0
+        self.downloads = []
+        self.fail = set()
+        for path, data in files.items():
+            self.write(path, data)
+            pass
+        pass
+
+    def write(self, path, data):
+        self.version += 1
+        self.files[path] = (data, f"v{self.version}")
+        pass
+
+    def listing(self):
+        return [RemoteFile(path, len(data), etag) for path, (data, etag) in sorted(self.files.items())]
+
+    def download(self, remote_file, local_path):
+        if remote_file.path in self.fail:
+            with open(local_path, "wb") as f:
+                f.write(b"partial")
+                pass
+            raise RuntimeError("connection lost")
+        self.downloads.append(remote_file.path)
+        with open(local_path, "wb") as f:
+            f.write(self.files[remote_file.path][0])
+            pass
+        pass
+    pass
+
+
+class TestDeltaFetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.local_dir = os.path.join(self.tmp, "output")
+        env = mock.patch.dict(os.environ, {"HQJOB_FETCH_STATE_DIR": os.path.join(self.tmp, "state")})
+        env.start()
+        self.addCleanup(env.stop)
+        self.remote = FakeRemote({"model.pt": b"m" * 100, "logs/metrics.json": b"{}", "logs/debug.tmp": b"x"})
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def fetch(self, **kwargs):
+        return DeltaFetcher(self.local_dir, max_workers=2, **kwargs).fetch(self.remote.listing(), self.remote.download)
+
+    def read(self, path):
+        with open(os.path.join(self.local_dir, path), "rb") as f:
+            return f.read()
+
+    def test_only_new_and_changed_files_are_transferred(self):
+        summary = self.fetch()
+        self.assertEqual((summary.transferred, summary.transferred_bytes, summary.skipped), (3, 103, 0))
+        self.assertEqual(self.read("logs/metrics.json"), b"{}")
+
+        self.remote.downloads.clear()
+        summary = self.fetch()
+        self.assertEqual((summary.transferred, summary.skipped, summary.skipped_bytes), (0, 3, 103))
+        self.assertEqual(self.remote.downloads, [])
+
+        # changed remotely (same size, new etag), added remotely, changed locally
+        self.remote.write("logs/metrics.json", b"{1")
+        self.remote.write("epoch2.pt", b"2")
+        with open(os.path.join(self.local_dir, "model.pt"), "ab") as f:
+            f.write(b"local")
+            pass
+        summary = self.fetch()
+        self.assertEqual(sorted(self.remote.downloads), ["epoch2.pt", "logs/metrics.json", "model.pt"])
+        self.assertEqual((summary.transferred, summary.skipped), (3, 1))
+        self.assertEqual(self.read("logs/metrics.json"), b"{1")
+        self.assertEqual(self.read("model.pt"), b"m" * 100)
+        pass
+
+    def test_files_without_state_are_compared_by_content(self):
+        os.makedirs(os.path.join(self.local_dir, "logs"))
+        with open(os.path.join(self.local_dir, "model.pt"), "wb") as f:
+            f.write(b"m" * 100)
+            pass
+        with open(os.path.join(self.local_dir, "logs", "metrics.json"), "wb") as f:
+            f.write(b"{]")
+            pass
+        asked = []
+
+        def same_content(candidates):
+            asked.extend(f.path for f in candidates)
+            return {f.path for f in candidates if self.read(f.path) == self.remote.files[f.path][0]}
+
+        summary = DeltaFetcher(self.local_dir).fetch(self.remote.listing(), self.remote.download, same_content)
+        self.assertEqual(sorted(asked), ["logs/metrics.json", "model.pt"])
+        self.assertEqual(sorted(self.remote.downloads), ["logs/debug.tmp", "logs/metrics.json"])
+        self.assertEqual(summary.skipped, 1)
+        self.assertEqual(self.read("logs/metrics.json"), b"{}")
+        pass
+
+    def test_failed_and_ignored_files(self):
+        self.remote.fail.add("model.pt")
+        summary = self.fetch(ignores="*.tmp")
+        self.assertEqual(summary.failed, ["model.pt"])
+        self.assertEqual(summary.transferred, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir, "model.pt")))
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir, "logs", "debug.tmp")))
+        # the state is kept out of the output dir
+        self.assertEqual(os.listdir(self.local_dir), ["logs"])
+
+        self.remote.fail.clear()
+        self.remote.downloads.clear()
+        self.fetch(ignores="*.tmp")
+        self.assertEqual(self.remote.downloads, ["model.pt"])
+        pass
+
+    def test_legacy_state_is_taken_over(self):
+        self.fetch()
+        fetcher = DeltaFetcher(self.local_dir)
+        os.replace(fetcher.state_file, os.path.join(self.local_dir, LEGACY_STATE_NAME))
+        self.remote.downloads.clear()
+        summary = self.fetch()
+        self.assertEqual((summary.transferred, summary.skipped), (0, 3))
+        self.assertTrue(os.path.exists(fetcher.state_file))
+        self.assertFalse(os.path.exists(os.path.join(self.local_dir, LEGACY_STATE_NAME)))
+        pass
+
+    def test_parse_find_output(self):
+        output = "100\t1773800000.1234567890\tmodel.pt\n2\t1773800001.5\tlogs/a b.json\n\n"
+        self.assertEqual(parse_find_output(output), [("model.pt", 100, "1773800000.1234567890"),
+                                                     ("logs/a b.json", 2, "1773800001.5")])
+        pass
+    pass
+
+
+class TestFetchFromCOS(unittest.TestCase):
+
+    def setUp(self):
+        sleep = mock.patch("qcloud_cos.cos_client.time.sleep")
+        sleep.start()
+        self.addCleanup(sleep.stop)
+        self.tmp = tempfile.mkdtemp()
+        self.cos = FakeCOS().start()
+        config_file = os.path.join(self.tmp, "cos.conf")
+        self.cos.write_config(config_file)
+        self.client = COSClient(config_file, checkpoint_dir=os.path.join(self.tmp, "checkpoints"))
+        self.local_dir = os.path.join(self.tmp, "output")
+        env = mock.patch.dict(os.environ, {"HQJOB_FETCH_STATE_DIR": os.path.join(self.tmp, "state")})
+        env.start()
+        self.addCleanup(env.stop)
+        pass
+
+    def tearDown(self):
+        self.cos.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def object_gets(self):
+        return len([r for r in self.cos.requests if r[0] == "GET" and r[1] != ""])
+
+    def test_delta_download(self):
+        self.cos.put("out/c1/model.pt", b"m" * 1000)
+        self.cos.put("out/c1/logs/metrics.json", b"{}")
+        summary = fetch_from_cos("cos://out/c1/", self.local_dir, client=self.client)
+        self.assertEqual((summary.transferred, summary.transferred_bytes), (2, 1002))
+        with open(os.path.join(self.local_dir, "logs", "metrics.json"), "rb") as f:
+            self.assertEqual(f.read(), b"{}")
+            pass
+
+        gets = self.object_gets()
+        self.cos.put("out/c1/logs/metrics.json", b"{1}")
+        summary = fetch_from_cos("cos://out/c1/", self.local_dir, client=self.client)
+        self.assertEqual((summary.transferred, summary.skipped, summary.skipped_bytes), (1, 1, 1000))
+        self.assertEqual(self.object_gets() - gets, 1)
+
+        # a dir downloaded before (no state) is checked against the md5 ETags
+        os.remove(DeltaFetcher(self.local_dir).state_file)
+        summary = fetch_from_cos("cos://out/c1", self.local_dir, client=self.client)
+        self.assertEqual((summary.transferred, summary.skipped), (0, 2))
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from hq_job.output_sync import OutputSyncer
+
+
+class FakeRemote(object):
+    """stands in for storage.upload_file, keeps what was uploaded per remote path"""
+
+    def __init__(self):
+        self.files = dict()
+        self.uploads = []
+        self.fail = set()
+        self.lock = threading.Lock()
+        pass
+
+    def upload(self, local_path, remote_path):
+        if remote_path in self.fail:
+            raise RuntimeError("upload failed")
+        with open(local_path, "rb") as f:
+            data = f.read()
+            pass
+        with self.lock:
+            self.files[remote_path] = data
+            self.uploads.append(remote_path)
+            pass
+        pass
+    pass
+
+
+class TestOutputSync(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.remote = FakeRemote()
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        pass
+
+    def write(self, name, data, age=60.0):
+        path = os.path.join(self.output_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+            pass
+        # settled unless age is 0
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def syncer(self, interval=0) -> OutputSyncer:
+        return OutputSyncer(self.output_dir, "cos://out/c1", interval=interval, upload=self.remote.upload)
+
+    def test_only_changes_are_uploaded(self):
+        self.write("model.pt", b"m" * 100)
+        self.write("logs/metrics.json", b"{}")
+        syncer = self.syncer()
+        self.assertEqual(syncer.sync(), [])
+        self.assertEqual(sorted(self.remote.uploads), ["cos://out/c1/logs/metrics.json", "cos://out/c1/model.pt"])
+
+        self.remote.uploads.clear()
+        syncer.sync()
+        self.assertEqual(self.remote.uploads, [])
+
+        # same content with a new mtime is skipped by hash, new content goes up
+        self.write("model.pt", b"m" * 100, age=30.0)
+        self.write("logs/metrics.json", b"{1}", age=30.0)
+        syncer.sync()
+        self.assertEqual(self.remote.uploads, ["cos://out/c1/logs/metrics.json"])
+        self.assertEqual(self.remote.files["cos://out/c1/logs/metrics.json"], b"{1}")
+        self.assertEqual(syncer.uploaded, 3)
+        pass
+
+    def test_fresh_files_wait_for_the_final_pass(self):
+        self.write("done.txt", b"done")
+        self.write("writing.txt", b"half", age=0)
+        syncer = self.syncer()
+        syncer.sync()
+        self.assertEqual(self.remote.uploads, ["cos://out/c1/done.txt"])
+        syncer.stop()
+        self.assertEqual(self.remote.uploads, ["cos://out/c1/done.txt", "cos://out/c1/writing.txt"])
+        pass
+
+    def test_background_passes_and_final_delta(self):
+        syncer = self.syncer(interval=0.05).start()
+        self.write("epoch1.pt", b"1")
+        deadline = time.time() + 5
+        while "cos://out/c1/epoch1.pt" not in self.remote.files and time.time() < deadline:
+            time.sleep(0.02)
+            pass
+        self.assertIn("cos://out/c1/epoch1.pt", self.remote.files)
+
+        self.write("epoch2.pt", b"2", age=0)
+        syncer.stop()
+        self.assertEqual(sorted(self.remote.files), ["cos://out/c1/epoch1.pt", "cos://out/c1/epoch2.pt"])
+        self.assertEqual(self.remote.uploads.count("cos://out/c1/epoch1.pt"), 1)
+        pass
+
+    def test_failed_uploads_are_retried_and_reported(self):
+        self.write("a.txt", b"a")
+        self.write("b.txt", b"b")
+        self.remote.fail.add("cos://out/c1/b.txt")
+        syncer = self.syncer()
+        self.assertEqual(syncer.sync(), ["b.txt"])
+        with self.assertRaises(RuntimeError):
+            syncer.stop()
+        self.remote.fail.clear()
+        self.assertEqual(syncer.sync(final=True), [])
+        self.assertEqual(self.remote.uploads, ["cos://out/c1/a.txt", "cos://out/c1/b.txt"])
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import hq_job.file_utils
+from hq_job.pack_reader import PackReader, build_manifest
+
+
+class TestPackReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmp, "data")
+        self.files = {"a.bin": os.urandom(3000), "b.txt": b"b" * 5000, "sub/c.bin": os.urandom(100),
+                      "sub/deep/d.bin": os.urandom(7000), "sub/e.txt": b""}
+        for name, data in self.files.items():
+            path = os.path.join(self.source, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+                pass
+            pass
+        self.packs = os.path.join(self.tmp, "packs")
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def pack(self, codec):
+        return hq_job.file_utils.pack_files_by_fixed_size(self.source, self.packs, "ds", size=6000, workers=1,
+                                                          codec=codec)
+
+    def test_reads_members_without_extracting(self):
+        self.pack("none")
+        with PackReader(self.packs, "ds") as reader:
+            self.assertEqual(sorted(reader.names()), sorted(self.files))
+            self.assertIn("sub/c.bin", reader)
+            for name, data in self.files.items():
+                self.assertEqual(reader.read(name, verify=True), data)
+                pass
+            self.assertEqual(bytes(reader.view("sub/deep/d.bin")[10:20]), self.files["sub/deep/d.bin"][10:20])
+            view = reader.view("a.bin")
+            f = reader.open("a.bin")
+            f.seek(1000)
+            self.assertEqual(f.read(10), self.files["a.bin"][1000:1010])
+            self.assertEqual(reader.member("b.txt").shard, 1)
+            with self.assertRaises(KeyError):
+                reader.read("missing.bin")
+                pass
+            pass
+        # closing with a view alive doesn't fail, the view stays readable
+        self.assertEqual(bytes(view), self.files["a.bin"])
+        view.release()
+        self.assertEqual(sorted(os.listdir(self.packs)), ["ds.manifest.json", "ds_0.tar", "ds_1.tar", "ds_2.tar"])
+        pass
+
+    def test_compressed_and_corrupted_shards(self):
+        self.pack("gzip")
+        with PackReader(self.packs, "ds") as reader:
+            self.assertEqual(reader.read("sub/c.bin", verify=True), self.files["sub/c.bin"])
+            with self.assertRaises(ValueError):
+                reader.view("sub/c.bin")
+                pass
+            pass
+
+        shutil.rmtree(self.packs)
+        self.pack("none")
+        offset = PackReader(self.packs, "ds").member("a.bin").offset
+        with open(os.path.join(self.packs, "ds_0.tar"), "r+b") as f:
+            f.seek(offset)
+            f.write(b"\0")
+            pass
+        with PackReader(self.packs, "ds") as reader:
+            with self.assertRaises(ValueError):
+                reader.read("a.bin", verify=True)
+                pass
+            pass
+        pass
+
+    def test_manifest_of_old_packs(self):
+        self.pack("none")
+        manifest_file = os.path.join(self.packs, "ds.manifest.json")
+        os.remove(manifest_file)
+        self.assertEqual(build_manifest(self.packs, "ds"), manifest_file)
+        with PackReader(self.packs, "ds") as reader:
+            for name, data in self.files.items():
+                self.assertEqual(reader.read(name), data)
+                pass
+            pass
+        with self.assertRaises(FileNotFoundError):
+            build_manifest(self.packs, "other", postfix="tar")
+            pass
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
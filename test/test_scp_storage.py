@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from hq_job.storage.scp import SCPStorage, is_ignored
+
+from fake_sshd import FakeSSHD
+
+
+class TestSCPStorage(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sshd = FakeSSHD().start()
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sshd.stop()
+        pass
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.remote = os.path.join(self.tmp, "remote", "output")
+        self.files = {"model.pt": os.urandom(300000), "logs/metrics.json": b"{}", "logs/deep/a b.txt": b"a" * 5000,
+                      "empty.txt": b""}
+        for name, data in list(self.files.items()) + [("logs/debug.tmp", b"x"), ("cache.tmp", b"y")]:
+            path = os.path.join(self.remote, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+                pass
+            pass
+        self.storage = SCPStorage(**self.sshd.ssh())
+        self.sshd.commands.clear()
+        pass
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        pass
+
+    def downloaded(self, local_dir):
+        files = dict()
+        for root, _, names in os.walk(os.path.join(local_dir, "output")):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, os.path.join(local_dir, "output")).replace(os.sep, "/")] = f.read()
+                    pass
+                pass
+            pass
+        return files
+
+    def test_stream_with_every_codec(self):
+        for codec in ["none", "gzip", "zstd"]:
+            with self.subTest(codec=codec):
+                local_dir = os.path.join(self.tmp, "local_" + codec)
+                self.storage.download_file(self.remote + "/", local_dir, ignores="*.tmp", codec=codec)
+                self.assertEqual(self.downloaded(local_dir), self.files)
+                self.assertEqual(os.listdir(local_dir), ["output"])
+                pass
+            pass
+        # one tar per download, piped, no tarball staged remotely
+        self.assertEqual(len(self.sshd.commands), 3)
+        self.assertTrue(all(c.startswith("tar ") and "-cf - " in c and "rm " not in c for c in self.sshd.commands))
+        with self.assertRaises(RuntimeError):
+            self.storage.download_file(self.remote + "/", os.path.join(self.tmp, "local_none"))
+            pass
+        pass
+
+    def test_parallel_sftp(self):
+        local_dir = os.path.join(self.tmp, "local")
+        self.storage.download_file(self.remote + "/", local_dir, ignores="*.tmp", mode="sftp", workers=3)
+        self.assertEqual(self.downloaded(local_dir), self.files)
+        self.assertEqual(self.sshd.commands, [])
+        pass
+
+    def test_failed_download_leaves_nothing(self):
+        local_dir = os.path.join(self.tmp, "local")
+        for mode in ["stream", "sftp"]:
+            with self.subTest(mode=mode):
+                with self.assertRaises(Exception):
+                    self.storage.download_file(os.path.join(self.tmp, "missing") + "/", local_dir, mode=mode)
+                    pass
+                self.assertEqual(os.listdir(local_dir), [])
+                pass
+            pass
+        pass
+
+    def test_ignores(self):
+        self.assertTrue(is_ignored("logs/debug.tmp", "*.tmp"))
+        self.assertTrue(is_ignored("logs/deep/a b.txt", "deep"))
+        self.assertFalse(is_ignored("logs/metrics.json", "*.tmp"))
+        self.assertFalse(is_ignored("model.pt", ""))
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,467 @@
+import asyncio
+import base64
+import io
+import json
+import time
+import unittest
+from datetime import datetime, timezone
+
+import httpx
+
+from hq_job import file_utils, server
+from hq_job.job_engine import LogChunk
+from hq_job.autodl_client import AutodlDeployment
+from hq_job.job_engine_autodl_async import JobEngineAutodlAsync
+from hq_job import server_state
+from hq_job.server_state import DeploymentStateCache
+
+from fake_autodl import FakeAutodlServer, make_deployment
+
+
+class TestServer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.fake = FakeAutodlServer().start()
+        self.fake.deployments = [make_deployment(i, name=f"job-{i}") for i in range(1, 6)]
+        self.api_token = server.API_TOKEN
+        server.API_TOKEN = "test"
+        server.app.state.engine = JobEngineAutodlAsync(token="token", host=self.fake.url)
+        server.app.state.state_cache = None
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app), base_url="http://test",
+            headers={"Authorization": "Bearer test"})
+        pass
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await server.app.state.engine.aclose()
+        server.API_TOKEN = self.api_token
+        self.fake.stop()
+        pass
+
+    async def test_list_and_status(self):
+        resp = await self.client.get("/api/v1/jobs")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([j["uuid"] for j in resp.json()["data"]], [f"dep-{i}" for i in range(1, 6)])
+        resp = await self.client.get("/api/v1/jobs/dep-2/status")
+        self.assertEqual(resp.json()["data"], {"job_uuid": "dep-2", "status": "running"})
+        resp = await self.client.get("/api/v1/jobs/dep-404/status")
+        self.assertEqual(resp.status_code, 404)
+        pass
+
+    async def test_batch_status(self):
+        resp = await self.client.post("/api/v1/jobs/status:batch", json={"job_uuids": ["dep-1", "dep-5", "dep-404"]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["data"], {"dep-1": "running", "dep-5": "running", "dep-404": None})
+        self.assertEqual(self.fake.request_count("/api/v1/dev/deployment/list"), 1)
+        pass
+
+    async def test_slow_autodl_does_not_block_event_loop(self):
+        self.fake.latency = 0.3
+        start = time.time()
+        responses = await asyncio.gather(*[self.client.get(f"/api/v1/jobs/dep-{i}/status") for i in range(1, 6)])
+        elapsed = time.time() - start
+        print(f"5 concurrent status requests took {elapsed:.2f}s")
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertLess(elapsed, 1.2)
+        pass
+
+    def _growing_log(self, lines: int):
+        """stands in for the remote job.log: one more line per read, then the job stops"""
+        log = {"content": b""}
+
+        async def read_log(job_uuid, offset=0, max_bytes=None, tail_lines=None):
+            written = log["content"].count(b"\n")
+            if written < lines:
+                log["content"] += f"step {written}\n".encode()
+            else:
+                self.fake.deployments[1]["status"] = "stopped"
+                pass
+            content = log["content"]
+            data, start, next_offset = file_utils.read_chunk(
+                io.BytesIO(content), len(content), offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+            return LogChunk.from_bytes(data, start, next_offset, len(content))
+
+        server.app.state.engine.log = read_log
+        return log
+
+    async def test_job_log(self):
+        self._growing_log(lines=3)
+        resp = await self.client.get("/api/v1/jobs/dep-2/log", params={"max_bytes": 4})
+        self.assertEqual(resp.json()["data"], {"data": "step", "offset": 0, "next_offset": 4, "size": 7})
+        resp = await self.client.get("/api/v1/jobs/dep-2/log", params={"offset": 4, "tail_lines": 1})
+        self.assertEqual(resp.json()["data"]["data"], "step 1\n")
+        resp = await self.client.get("/api/v1/jobs/dep-2/log", params={"max_bytes": 0})
+        self.assertEqual(resp.status_code, 422)
+        pass
+
+    async def test_job_log_follow(self):
+        log = self._growing_log(lines=5)
+        follow_interval = server.LOG_FOLLOW_INTERVAL
+        server.LOG_FOLLOW_INTERVAL = 0.01
+        try:
+            resp = await self.client.post("/api/v1/stream_token")
+            stream_token = resp.json()["data"]["token"]
+            resp = await self.client.get("/api/v1/jobs/dep-2/log", params={"follow": "true", "stream_token": stream_token},
+                                         headers={"Authorization": ""})
+        finally:
+            server.LOG_FOLLOW_INTERVAL = follow_interval
+            pass
+        self.assertEqual(resp.headers["content-type"], "text/event-stream; charset=utf-8")
+        events = [block.split("\n", 1) for block in resp.text.strip().split("\n\n")]
+        self.assertEqual([e[0] for e in events], ["event: log"] * 5 + ["event: end"])
+        followed = "".join(json.loads(e[1][len("data: "):])["data"] for e in events[:-1])
+        self.assertEqual(followed.encode(), log["content"])
+        self.assertEqual(json.loads(events[-1][1][len("data: "):]),
+                         {"job_uuid": "dep-2", "next_offset": len(log["content"])})
+        pass
+
+    async def test_job_log_follow_with_partial_character(self):
+        # a job that died after half a character: read_chunk holds it back, the stream must not spin on it
+        content = "完\n".encode() + "成".encode()[:1]
+        reads = []
+
+        async def read_log(job_uuid, offset=0, max_bytes=None, tail_lines=None):
+            reads.append(offset)
+            self.fake.deployments[1]["status"] = "stopped"
+            data, start, next_offset = file_utils.read_chunk(
+                io.BytesIO(content), len(content), offset=offset, max_bytes=max_bytes, tail_lines=tail_lines)
+            return LogChunk.from_bytes(data, start, next_offset, len(content))
+
+        server.app.state.engine.log = read_log
+        follow_interval = server.LOG_FOLLOW_INTERVAL
+        server.LOG_FOLLOW_INTERVAL = 0.01
+        try:
+            resp = await asyncio.wait_for(
+                self.client.get("/api/v1/jobs/dep-2/log", params={"follow": "true"}), timeout=5)
+        finally:
+            server.LOG_FOLLOW_INTERVAL = follow_interval
+            pass
+        events = [block.split("\n", 1)[0] for block in resp.text.strip().split("\n\n")]
+        self.assertEqual(events, ["event: log", "event: end"])
+        self.assertLessEqual(len(reads), 3)
+        resp = await self.client.get("/api/v1/jobs/dep-2/log", params={"max_bytes": 3})
+        self.assertEqual(resp.status_code, 422)
+        pass
+    pass
+
+
+class TestServerJobQuery(unittest.IsolatedAsyncioTestCase):
+    DEPLOYMENT_LIST_URL = "/api/v1/dev/deployment/list"
+
+    async def asyncSetUp(self):
+        self.fake = FakeAutodlServer().start()
+        # newest first, like AutoDL: dep-1 is created at 23:00, dep-2 at 22:00, ...
+        self.fake.deployments = [
+            make_deployment(i, name=f"{'train' if i % 2 else 'eval'}-{i}",
+                            status="running" if i <= 10 else "stopped",
+                            region="westDC2" if i % 3 == 0 else "chongqingDC1",
+                            gpu="RTX 3090" if i % 5 == 0 else "RTX 4090",
+                            created_at=f"2026-03-{18 - (i - 1) // 24:02d}T{23 - (i - 1) % 24:02d}:00:00+08:00")
+            for i in range(1, 61)
+        ]
+        self.api_token = server.API_TOKEN
+        server.API_TOKEN = "test"
+        server.app.state.engine = JobEngineAutodlAsync(token="token", host=self.fake.url)
+        server.app.state.state_cache = None
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app), base_url="http://test",
+            headers={"Authorization": "Bearer test"})
+        pass
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await server.app.state.engine.aclose()
+        server.app.state.state_cache = None
+        server.API_TOKEN = self.api_token
+        self.fake.stop()
+        pass
+
+    async def _walk(self, params):
+        uuids, cursor, pages = [], None, 0
+        while True:
+            resp = await self.client.get("/api/v1/jobs", params=dict(params, **({"cursor": cursor} if cursor else {})))
+            self.assertEqual(resp.status_code, 200, resp.text)
+            body = resp.json()
+            uuids.extend(j["uuid"] for j in body["data"])
+            pages += 1
+            cursor = body["meta"]["next_cursor"]
+            if cursor is None:
+                return uuids, pages, body["meta"]
+            pass
+
+    async def test_live_cursor_pages_stop_early(self):
+        resp = await self.client.get("/api/v1/jobs", params={"limit": 5})
+        body = resp.json()
+        self.assertEqual([j["uuid"] for j in body["data"]], [f"dep-{i}" for i in range(1, 6)])
+        self.assertIsNone(body["meta"]["total"])
+        # one AutoDL page of 10 is enough for 5 + 1 look-ahead
+        self.assertEqual(self.fake.request_count(self.DEPLOYMENT_LIST_URL), 1)
+
+        # a job submitted between two pages doesn't shift the next page
+        self.fake.deployments.insert(0, make_deployment(99, name="new", created_at="2026-03-19T00:00:00+08:00"))
+        resp = await self.client.get("/api/v1/jobs", params={"limit": 5, "cursor": body["meta"]["next_cursor"]})
+        self.assertEqual([j["uuid"] for j in resp.json()["data"]], [f"dep-{i}" for i in range(6, 11)])
+
+        uuids, pages, _ = await self._walk({"limit": 25})
+        self.assertEqual(uuids, ["dep-99"] + [f"dep-{i}" for i in range(1, 61)])
+        self.assertEqual(pages, 3)
+        pass
+
+    async def test_live_filters(self):
+        uuids, _, _ = await self._walk({"status": "running", "name_prefix": "train", "limit": 2})
+        self.assertEqual(uuids, ["dep-1", "dep-3", "dep-5", "dep-7", "dep-9"])
+        # status and name are pushed down to AutoDL
+        _, path, req = [r for r in self.fake.requests if r[1] == self.DEPLOYMENT_LIST_URL][-1]
+        self.assertEqual((req["status"], req["name"]), ("running", "train"))
+
+        uuids, _, _ = await self._walk({"region": "westDC2", "gpu_type": "RTX 3090"})
+        self.assertEqual(uuids, ["dep-15", "dep-30", "dep-45", "dep-60"])
+
+        self.fake.requests.clear()
+        uuids, _, _ = await self._walk({"created_after": "2026-03-18T12:00:00+08:00",
+                                        "created_before": "2026-03-18T20:00:00+08:00", "limit": 5})
+        self.assertEqual(uuids, [f"dep-{i}" for i in range(5, 13)])
+        # the list is newest first, so paging stops once created_after is passed:
+        # page 1 for the first result page, pages 1-2 for the second, never pages 3-6
+        self.assertEqual(self.fake.request_count(self.DEPLOYMENT_LIST_URL), 3)
+        pass
+
+    async def test_sort_and_cache(self):
+        uuids, _, meta = await self._walk({"sort": "name", "limit": 7, "name_prefix": "eval"})
+        expected = sorted((f"eval-{i}", f"dep-{i}") for i in range(2, 61, 2))
+        self.assertEqual(uuids, [uuid for _, uuid in expected])
+        self.assertEqual(meta["total"], 30)
+
+        cache = DeploymentStateCache(server.app.state.engine, interval=60, page_size=100)
+        await cache.refresh()
+        server.app.state.state_cache = cache
+        requests_before = self.fake.request_count()
+        uuids, pages, meta = await self._walk({"sort": "created_at", "limit": 20, "status": "stopped"})
+        self.assertEqual(uuids, [f"dep-{i}" for i in range(60, 10, -1)])
+        self.assertEqual((pages, meta["total"], meta["source"]), (3, 50, "cache"))
+        self.assertEqual(self.fake.request_count(), requests_before)
+
+        resp = await self.client.get("/api/v1/jobs", params={"sort": "name", "cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, 400)
+        resp = await self.client.get("/api/v1/jobs", params={"limit": 1})
+        resp = await self.client.get("/api/v1/jobs", params={"sort": "name", "cursor": resp.json()["meta"]["next_cursor"]})
+        self.assertEqual(resp.status_code, 400)
+        # a cursor of the right sort whose created_at isn't a date
+        cursor = base64.urlsafe_b64encode(json.dumps({"key": ["yesterday", "dep-1"], "sort": "-created_at"}).encode())
+        resp = await self.client.get("/api/v1/jobs", params={"cursor": cursor.decode("ascii")})
+        self.assertEqual(resp.status_code, 400)
+        # one without a timezone is taken as UTC, like created_after
+        created_at = datetime(2026, 1, 1, 12).isoformat()
+        cursor = base64.urlsafe_b64encode(json.dumps({"key": [created_at, "dep-1"], "sort": "-created_at"}).encode())
+        resp = await self.client.get("/api/v1/jobs", params={"cursor": cursor.decode("ascii")})
+        self.assertEqual(resp.status_code, 200)
+        resp = await self.client.get("/api/v1/jobs", params={"sort": "size"})
+        self.assertEqual(resp.status_code, 400)
+        pass
+    pass
+
+
+class TestServerStateCache(unittest.IsolatedAsyncioTestCase):
+    DEPLOYMENT_LIST_URL = "/api/v1/dev/deployment/list"
+
+    async def asyncSetUp(self):
+        self.fake = FakeAutodlServer().start()
+        self.fake.deployments = [make_deployment(i, name=f"job-{i}", status="stopped") for i in range(1, 251)]
+        self.api_token = server.API_TOKEN
+        server.API_TOKEN = "test"
+        server.app.state.engine = JobEngineAutodlAsync(token="token", host=self.fake.url)
+        self.cache = DeploymentStateCache(server.app.state.engine, interval=60, page_size=100)
+        server.app.state.state_cache = self.cache
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=server.app), base_url="http://test",
+            headers={"Authorization": "Bearer test"})
+        pass
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        await self.cache.stop()
+        await server.app.state.engine.aclose()
+        server.app.state.state_cache = None
+        server.API_TOKEN = self.api_token
+        self.fake.stop()
+        pass
+
+    async def test_reads_served_from_table(self):
+        await self.cache.refresh()
+        requests_after_refresh = self.fake.request_count()
+        resp = await self.client.get("/api/v1/jobs", params={"name": "job-2"})
+        body = resp.json()
+        self.assertEqual(body["meta"]["source"], "cache")
+        self.assertIn("age_seconds", body["meta"])
+        self.assertEqual(len(body["data"]), 62)  # job-2, job-20..29, job-200..249
+        resp = await self.client.get("/api/v1/jobs/dep-7/status")
+        self.assertEqual(resp.json()["data"]["status"], "stopped")
+        resp = await self.client.post("/api/v1/jobs/status:batch", json={"job_uuids": ["dep-1", "dep-250"]})
+        self.assertEqual(resp.json()["data"], {"dep-1": "stopped", "dep-250": "stopped"})
+        self.assertEqual(self.fake.request_count(), requests_after_refresh)
+
+        resp = await self.client.get("/api/v1/jobs/dep-7/status", params={"live": "true"})
+        self.assertEqual(resp.json()["meta"]["source"], "live")
+        self.assertEqual(self.fake.request_count(), requests_after_refresh + 1)
+        pass
+
+    async def test_incremental_refresh(self):
+        await self.cache.refresh(full=True)
+        self.assertEqual(self.fake.request_count(self.DEPLOYMENT_LIST_URL), 3)
+        self.fake.deployments[0]["status"] = "running"
+        self.fake.deployments.pop()
+        await self.cache.refresh(full=False)
+        # stops after a whole page of unchanged stopped deployments
+        self.assertEqual(self.fake.request_count(self.DEPLOYMENT_LIST_URL), 5)
+        self.assertEqual(self.cache.get("dep-1").status, "running")
+        self.assertIsNotNone(self.cache.get("dep-250"))
+        await self.cache.refresh(full=True)
+        self.assertIsNone(self.cache.get("dep-250"))
+        self.assertEqual(len(self.cache.deployments), 249)
+        pass
+
+    async def test_background_refresher(self):
+        self.cache.interval = 0.05
+        self.cache.start()
+        for _ in range(50):
+            if self.cache.ready:
+                break
+            await asyncio.sleep(0.05)
+            pass
+        self.assertTrue(self.cache.ready)
+        self.fake.deployments[3]["status"] = "running"
+        self.cache.request_refresh()
+        for _ in range(50):
+            if self.cache.get("dep-4").status == "running":
+                break
+            await asyncio.sleep(0.05)
+            pass
+        self.assertEqual(self.cache.get("dep-4").status, "running")
+        pass
+
+    async def _stream(self, query_string: bytes, until, headers=None):
+        """drive the SSE endpoint over raw ASGI until the collected body satisfies `until`"""
+        disconnect = asyncio.Event()
+        chunks = []
+        status = []
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/api/v1/jobs/events", "raw_path": b"/api/v1/jobs/events",
+            "query_string": query_string, "headers": headers or [], "server": ("test", 80),
+            "client": ("127.0.0.1", 1234), "root_path": "",
+        }
+        request_sent = False
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b"").decode("utf-8"))
+                if until("".join(chunks)):
+                    disconnect.set()
+                    pass
+                pass
+            pass
+
+        task = asyncio.ensure_future(server.app(scope, receive, send))
+        return status, chunks, disconnect, task
+
+    async def test_event_stream(self):
+        await self.cache.refresh()
+        stream_token = server.issue_stream_token().encode("ascii")
+        status, chunks, disconnect, task = await self._stream(
+            b"stream_token=" + stream_token + b"&job_uuid=dep-1&job_uuid=dep-3", lambda body: "event: removed" in body)
+        for _ in range(50):
+            if "".join(chunks):
+                break
+            await asyncio.sleep(0.02)
+            pass
+        self.assertEqual(status, [200])
+        self.assertEqual(self.cache.subscriber_count, 1)
+
+        self.fake.deployments[0]["status"] = "running"
+        self.fake.deployments[1]["status"] = "running"  # filtered out by job_uuid
+        await self.cache.refresh()
+        self.cache.remove("dep-3")
+        await asyncio.wait_for(task, timeout=5)
+        body = "".join(chunks)
+        self.assertTrue(body.startswith("event: ready\n"))
+        self.assertIn('event: changed\ndata: {"job_uuid": "dep-1", "status": "running", "previous_status": "stopped"', body)
+        self.assertNotIn("dep-2", body)
+        self.assertIn('"job_uuid": "dep-3", "status": null', body)
+        self.assertEqual(self.cache.subscriber_count, 0)
+        pass
+
+    async def test_event_stream_heartbeat_and_auth(self):
+        await self.cache.refresh()
+        heartbeat = server.SSE_HEARTBEAT_INTERVAL
+        server.SSE_HEARTBEAT_INTERVAL = 0.05
+        try:
+            status, chunks, disconnect, task = await self._stream(
+                b"", lambda body: ": heartbeat" in body, headers=[(b"authorization", b"Bearer test")])
+            await asyncio.wait_for(task, timeout=5)
+        finally:
+            server.SSE_HEARTBEAT_INTERVAL = heartbeat
+            pass
+        self.assertEqual(status, [200])
+        # the API token itself never goes in the URL, stream tokens expire
+        for params in [{"token": "test"}, {"stream_token": "test"}, {"stream_token": "wrong"}]:
+            resp = await self.client.get("/api/v1/jobs/events", params=params, headers={"Authorization": ""})
+            self.assertEqual(resp.status_code, 401)
+            pass
+        ttl = server.STREAM_TOKEN_TTL
+        server.STREAM_TOKEN_TTL = -1
+        try:
+            expired = server.issue_stream_token()
+        finally:
+            server.STREAM_TOKEN_TTL = ttl
+            pass
+        resp = await self.client.get("/api/v1/jobs/events", params={"stream_token": expired}, headers={"Authorization": ""})
+        self.assertEqual(resp.status_code, 401)
+        resp = await self.client.post("/api/v1/stream_token", headers={"Authorization": ""})
+        self.assertIn(resp.status_code, (401, 403))  # by FastAPI version
+        server.app.state.state_cache = None
+        resp = await self.client.get("/api/v1/jobs/events")
+        self.assertEqual(resp.status_code, 503)
+        pass
+
+    def test_diff_and_slow_subscriber(self):
+        cache = DeploymentStateCache(engine=None)
+        cache.refreshed_at = time.time()
+        old = {"a": _deployment("a", "running"), "b": _deployment("b", "running")}
+        new = {"a": _deployment("a", "stopped"), "c": _deployment("c", "starting")}
+        events = DeploymentStateCache.diff(old, new)
+        self.assertEqual([(e["type"], e["job_uuid"]) for e in events],
+                         [("changed", "a"), ("added", "c"), ("removed", "b")])
+
+        size = server_state.SUBSCRIBER_QUEUE_SIZE
+        server_state.SUBSCRIBER_QUEUE_SIZE = 2
+        try:
+            queue = cache.subscribe()
+        finally:
+            server_state.SUBSCRIBER_QUEUE_SIZE = size
+            pass
+        cache.deployments = old
+        cache._apply(new)
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait()["type"], "resync")
+        pass
+    pass
+
+
+def _deployment(uuid, status):
+    return AutodlDeployment(id=1, uid=1, uuid=uuid, name=uuid, deployment_type="Job", status=status,
+                            region_sign="chongqingDC1", dc_list=["chongqingDC1"], gpu_name_set=["RTX 4090"],
+                            created_at=datetime(2026, 3, 18, tzinfo=timezone.utc))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -145,6 +145,110 @@ class TestHQJobClient(unittest.TestCase):
         self.assertEqual(ctx.exception.code, 502)
         self.assertIn("AutoDL error", ctx.exception.message)
 
+    @patch('hq_job.server_client.requests.request')
+    def test_get_job_statuses(self, mock_request):
+        """测试批量查询任务状态"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "code": 0,
+            "message": "ok",
+            "data": {"job-uuid-001": "running", "job-uuid-404": None}
+        }
+        mock_request.return_value = mock_response
+
+        statuses = self.client.get_job_statuses(["job-uuid-001", "job-uuid-404"])
+
+        self.assertEqual(statuses, {"job-uuid-001": "running", "job-uuid-404": None})
+        call_args = mock_request.call_args
+        self.assertEqual(call_args[0][0], "POST")
+        self.assertIn("/api/v1/jobs/status:batch", call_args[0][1])
+        self.assertEqual(call_args[1]["json"], {"job_uuids": ["job-uuid-001", "job-uuid-404"]})
+
+    @patch('hq_job.server_client.requests.request')
+    def test_iter_jobs(self, mock_request):
+        """测试 iter_jobs 按 cursor 逐页遍历"""
+        def job(i):
+            return {"uuid": f"job-uuid-{i}", "name": f"job-{i}", "status": "running", "deployment_type": "Job",
+                    "region_sign": "chongqingDC1", "dc_list": ["chongqingDC1"], "gpu_name_set": ["RTX 4090"],
+                    "created_at": "2026-03-18T10:00:00+08:00"}
+        pages = [
+            {"code": 0, "message": "ok", "data": [job(1), job(2)], "meta": {"next_cursor": "c1"}},
+            {"code": 0, "message": "ok", "data": [job(3)], "meta": {"next_cursor": None}},
+        ]
+        responses = []
+        for page in pages:
+            mock_response = Mock()
+            mock_response.status_code = 200
+            mock_response.json.return_value = page
+            responses.append(mock_response)
+        mock_request.side_effect = responses
+
+        jobs = list(self.client.iter_jobs(page_size=2, status="running"))
+
+        self.assertEqual([j.uuid for j in jobs], ["job-uuid-1", "job-uuid-2", "job-uuid-3"])
+        self.assertEqual(mock_request.call_args_list[0][1]["params"], {"status": "running", "limit": 2})
+        self.assertEqual(mock_request.call_args_list[1][1]["params"], {"status": "running", "limit": 2, "cursor": "c1"})
+
+    @patch('hq_job.server_client.requests.get')
+    def test_watch(self, mock_get):
+        """测试 watch 解析 SSE 事件流"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.iter_lines.return_value = iter([
+            'event: ready',
+            'data: {"source": "cache"}',
+            '',
+            ': heartbeat',
+            '',
+            'event: changed',
+            'data: {"job_uuid": "job-uuid-001", "status": "stopped", "previous_status": "running", "job": null}',
+            '',
+            'event: removed',
+            'data: {"job_uuid": "job-uuid-002", "status": null, "previous_status": "stopped", "job": null}',
+            '',
+        ])
+        mock_get.return_value = mock_response
+
+        events = list(self.client.watch(job_uuids=["job-uuid-001", "job-uuid-002"]))
+
+        self.assertEqual([(e["event"], e["job_uuid"]) for e in events],
+                         [("changed", "job-uuid-001"), ("removed", "job-uuid-002")])
+        self.assertEqual(events[0]["previous_status"], "running")
+        call_args = mock_get.call_args
+        self.assertIn("/api/v1/jobs/events", call_args[0][0])
+        self.assertEqual(call_args[1]["params"], {"job_uuid": ["job-uuid-001", "job-uuid-002"]})
+        self.assertTrue(call_args[1]["stream"])
+        mock_response.close.assert_called()
+
+    @patch('hq_job.server_client.requests.get')
+    def test_follow_job_log(self, mock_get):
+        """测试 follow_job_log 产出日志内容直到 end 事件"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.iter_lines.return_value = iter([
+            'event: log',
+            'data: {"data": "epoch 1\\n", "offset": 0, "next_offset": 8, "size": 8}',
+            '',
+            ': heartbeat',
+            '',
+            'event: log',
+            'data: {"data": "epoch 2\\n", "offset": 8, "next_offset": 16, "size": 16}',
+            '',
+            'event: end',
+            'data: {"job_uuid": "job-uuid-001", "next_offset": 16}',
+            '',
+        ])
+        mock_get.return_value = mock_response
+
+        chunks = list(self.client.follow_job_log("job-uuid-001", tail_lines=100))
+
+        self.assertEqual(chunks, ["epoch 1\n", "epoch 2\n"])
+        call_args = mock_get.call_args
+        self.assertIn("/api/v1/jobs/job-uuid-001/log", call_args[0][0])
+        self.assertEqual(call_args[1]["params"], {"offset": 0, "follow": "true", "tail_lines": 100})
+        mock_response.close.assert_called()
+
 
 if __name__ == '__main__':
     unittest.main()
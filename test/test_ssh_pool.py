@@ -0,0 +1,125 @@
+import threading
+import time
+import unittest
+
+from invoke.exceptions import UnexpectedExit
+
+from hq_job import ssh_utils
+from hq_job.ssh_pool import SSHConnectionPool, default_pool
+
+from fake_sshd import FakeSSHD
+
+
+class TestSSHConnectionPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.sshd = FakeSSHD().start()
+        pass
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.sshd.stop()
+        pass
+
+    def setUp(self):
+        self.pools = []
+        pass
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.close()
+            pass
+        pass
+
+    def pool(self, **kwargs):
+        pool = SSHConnectionPool(**kwargs)
+        self.pools.append(pool)
+        return pool
+
+    def run_on(self, pool, command):
+        with pool.connection(**self.sshd.ssh()) as conn:
+            return conn.run(command, hide=True, in_stream=False).stdout.strip()
+
+    def test_connections_are_reused(self):
+        pool = self.pool()
+        connections = self.sshd.connections
+        for i in range(5):
+            self.assertEqual(self.run_on(pool, f"echo {i}"), str(i))
+            pass
+        # a failed command leaves the connection usable
+        with self.assertRaises(UnexpectedExit):
+            self.run_on(pool, "exit 3")
+            pass
+        self.assertEqual(self.run_on(pool, "echo ok"), "ok")
+        self.assertEqual(self.sshd.connections - connections, 1)
+        self.assertEqual(pool.to_dict(), {"requests": 7, "new_connections": 1, "reused_connections": 6,
+                                          "idle_connections": 1})
+
+        # the ssh paths share the default pool
+        connections = self.sshd.connections
+        for i in range(3):
+            self.assertEqual(ssh_utils.execute_command(f"echo {i}", **self.sshd.ssh()), str(i))
+            pass
+        self.assertLessEqual(self.sshd.connections - connections, 1)
+        self.assertGreaterEqual(default_pool().to_dict()["reused_connections"], 2)
+        pass
+
+    def test_idle_and_dead_connections_are_replaced(self):
+        pool = self.pool(idle_timeout=0.2)
+        connections = self.sshd.connections
+        self.run_on(pool, "true")
+        time.sleep(0.3)
+        self.run_on(pool, "true")
+        self.assertEqual(self.sshd.connections - connections, 2)
+
+        # closed by the server: seen dead at checkout, or by the probe of a long idle one
+        for health_check_after in [30, 0]:
+            with self.subTest(health_check_after=health_check_after):
+                pool = self.pool(health_check_after=health_check_after)
+                self.run_on(pool, "true")
+                connections = self.sshd.connections
+                self.sshd.drop_connections()
+                time.sleep(0.2)
+                self.assertEqual(self.run_on(pool, "echo again"), "again")
+                self.assertEqual(self.sshd.connections - connections, 1)
+                pass
+            pass
+        pass
+
+    def test_concurrent_checkouts(self):
+        pool = self.pool(max_per_key=2)
+        connections = self.sshd.connections
+        results = dict()
+        out = [0, 0]
+        lock = threading.Lock()
+
+        def work(i):
+            with pool.connection(**self.sshd.ssh()) as conn:
+                with lock:
+                    out[0] += 1
+                    out[1] = max(out)
+                    pass
+                results[i] = conn.run(f"sleep 0.1; echo {i}", hide=True, in_stream=False).stdout.strip()
+                with lock:
+                    out[0] -= 1
+                    pass
+                pass
+            pass
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(6)]
+        for t in threads:
+            t.start()
+            pass
+        for t in threads:
+            t.join()
+            pass
+        self.assertEqual(results, {i: str(i) for i in range(6)})
+        self.assertEqual(out[1], 2)
+        self.assertEqual(self.sshd.connections - connections, 2)
+        pass
+    pass
+
+
+if __name__ == "__main__":
+    unittest.main()